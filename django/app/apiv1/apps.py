@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class Apiv1Config(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apiv1'
+
+    def ready(self):
+        from apiv1 import signals  # noqa
+        from apiv1.cpu import cpu_budget
+        cpu_budget.apply()
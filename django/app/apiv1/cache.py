@@ -0,0 +1,71 @@
+"""
+Content-addressed cache of processing results.
+
+A result is identified by the original's content hash, the action and the
+normalized params. Generations carry that key, so a repeated request returns
+the stored generation instead of running OpenCV again. Identical requests in
+flight at the same time are coalesced through a per-key file lock: the first
+one computes, the others wait and then pick up its generation.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+from common.utils.files import file_digest, file_lock
+
+__all__ = [
+    'result_cache',
+    'get_content_hash',
+]
+
+LOCK_STRIPES = 256
+
+
+def get_content_hash(instance) -> str:
+    """Return the sha256 of an Image's file, computing and saving it for older rows."""
+    if not instance.content_hash:
+        with instance.image.open('rb') as f:
+            instance.content_hash = file_digest(f)
+        instance.save(update_fields=['content_hash'])
+    return instance.content_hash
+
+
+class ResultCache:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return settings.IMAGE_RESULT_CACHE['ENABLED']
+
+    @staticmethod
+    def make_key(content_hash: str, action: str, params: dict) -> str:
+        payload = json.dumps([content_hash, action.upper(), params], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def lock(key: str):
+        # 固定数量的锁文件，避免每个 key 都留下一个文件
+        stripe = int(key[:8], 16) % LOCK_STRIPES
+        return file_lock(Path(settings.IMAGE_RESULT_CACHE['LOCK_DIR']) / f'result_{stripe:03d}.lock')
+
+    def record(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        stats['pid'] = os.getpid()
+        return stats
+
+
+result_cache = ResultCache()
@@ -0,0 +1,168 @@
+"""
+CPU budget for OpenCV and BLAS threads.
+
+Every uvicorn worker and every pool process runs its own OpenCV thread pool.
+Left at the default (one thread per core each) they oversubscribe the cores
+under load. Each web worker owns a job pool and a batch pool (see
+apiv1.workers), so the budget splits the cores between all web workers and
+their job processes; batch processes run single-threaded, one per core of
+the web worker's share. The thread count is set once per process:
+cv2.setNumThreads is process-wide and requests run concurrently.
+
+A single large request can still use all cores while the host is idle: it
+is handed to the web worker's one-process 'boost' pool, whose OpenCV runs
+BOOST_THREADS threads. A host-wide lock lets one request at a time do so.
+"""
+import fcntl
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+__all__ = [
+    'cpu_budget',
+]
+
+BLAS_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'BLIS_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+)
+
+
+def available_cores() -> int:
+    """Cores this process may use: CPU affinity, capped by a cgroup v2 quota"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        quota, period = Path('/sys/fs/cgroup/cpu.max').read_text().split()
+        if quota != 'max':
+            cores = min(cores, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+class CpuBudget:
+
+    def __init__(self):
+        self.pool = None
+        self.blas_limited = False
+
+    @property
+    def config(self) -> dict:
+        return settings.CPU_BUDGET
+
+    @property
+    def cores(self) -> int:
+        return self.config['CORES'] or available_cores()
+
+    @property
+    def processes(self) -> int:
+        # 每个 web worker 自己的进程和它的任务进程池共用 CPU
+        return max(1, self.config['WORKERS'] * (1 + settings.IMAGE_JOB_WORKERS))
+
+    @property
+    def worker_cores(self) -> int:
+        """Cores of one web worker's share"""
+        return max(1, self.cores // max(1, self.config['WORKERS']))
+
+    def pool_size(self, pool: str) -> int:
+        """Processes in one web worker's ``pool`` ('jobs', 'batch' or 'boost')"""
+        if pool == 'batch':
+            # 每个 web worker 一个批量进程池，默认按 worker 数平分核数
+            return settings.IMAGE_BATCH_WORKERS or self.worker_cores
+        if pool == 'boost':
+            return 1
+        return settings.IMAGE_JOB_WORKERS
+
+    def threads(self, pool: str = None) -> int:
+        """OpenCV/BLAS threads for a process of ``pool`` (None for a web worker)"""
+        if pool == 'batch':
+            # 批量进程池按核数开进程，每个进程单线程
+            return 1
+        if pool == 'boost':
+            return self.boost_threads
+        return self.config['THREADS'] or max(1, self.cores // self.processes)
+
+    @property
+    def boost_threads(self) -> int:
+        return self.config['BOOST_THREADS'] or self.cores
+
+    def limit_blas_threads(self):
+        """Set the BLAS/OpenMP thread env vars; only effective before NumPy is imported."""
+        threads = str(self.threads())
+        for name in BLAS_ENV_VARS:
+            os.environ.setdefault(name, threads)
+        self.blas_limited = 'numpy' not in sys.modules
+
+    def apply(self, pool: str = None):
+        import cv2
+
+        self.pool = pool
+        cv2.setNumThreads(self.threads(pool))
+
+    def is_idle(self) -> bool:
+        try:
+            load = os.getloadavg()[0]
+        except OSError:
+            return False
+        return load / self.cores < self.config['IDLE_LOAD']
+
+    @contextmanager
+    def boost(self, pixels: int):
+        """
+        Yields True when a web worker may hand a request of ``pixels`` to the
+        boost pool: it is large, the host is idle and no other process on the
+        host is boosting. The lease is held until the block exits.
+        """
+        min_pixels = self.config['BOOST_MIN_PIXELS']
+        if self.pool is not None or not min_pixels or pixels < min_pixels or not self.is_idle():
+            # 进程池中的任务不再转交
+            yield False
+            return
+        path = Path(self.config['LOCK_DIR']) / 'cpu_boost.lock'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'a+') as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    def stats(self) -> dict:
+        import cv2
+
+        try:
+            load = os.getloadavg()
+        except OSError:
+            load = None
+        return {
+            'pid': os.getpid(),
+            'pool': self.pool,
+            'cores': self.cores,
+            'workers': self.config['WORKERS'],
+            'worker_cores': self.worker_cores,
+            'processes': self.processes,
+            'pool_sizes': {pool: self.pool_size(pool) for pool in ('jobs', 'batch', 'boost')},
+            'threads': self.threads(self.pool),
+            'cv2_threads': cv2.getNumThreads(),
+            'blas_env': {name: os.environ.get(name) for name in BLAS_ENV_VARS},
+            'blas_limited': self.blas_limited,
+            'boost_threads': self.boost_threads,
+            'boost_min_pixels': self.config['BOOST_MIN_PIXELS'],
+            'idle': self.is_idle(),
+            'load_average': load,
+            'idle_load': self.config['IDLE_LOAD'],
+        }
+
+
+cpu_budget = CpuBudget()
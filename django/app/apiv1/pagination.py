@@ -0,0 +1,10 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    按 -id 游标分页：深翻页不需要 OFFSET 扫描，也不需要 COUNT(*)
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -1,40 +1,111 @@
-import json
 import uuid
 from pathlib import Path
 
 import cv2
 import numpy as np
-from common.utils.json import NumJsonEncoder
+from django.conf import settings
 from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
+from apiv1 import workers
+from apiv1.cache import get_content_hash, result_cache
+from apiv1.cpu import cpu_budget
 from apiv1.serializers import UserSerializer
-from apiv1.utils import generate_thumbnail
+from apiv1.utils import (
+    decode_proxy, encode_thumbnail, generate_upload_images, get_encoder_profile, read_image
+)
+from common.utils import metrics
+from common.utils.encoders import encode_image
+from common.utils.files import file_digest
+from common.utils.hamming import MAX_DISTANCE, to_signed
+from common.utils.image import (
+    REDUCED_COLOR_FLAGS, array_difference_hash, estimate_jpeg_quality, reduction_factor
+)
+from common.utils.stats import image_statistics
+from common.utils.tiling import apply_tiled, strip_rows
 from main.models.image import Image, ImageGeneration
-from rest_framework.exceptions import PermissionDenied
+from main.models.job import ImageJob
+from rest_framework.exceptions import PermissionDenied, ValidationError
+
+
+class ImageDerivativesField(serializers.Field):
+    """
+    {long edge: url} of an image's derivatives, for building srcset
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = 'derivatives'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        storage = self.parent.Meta.model.image.field.storage
+        request = self.context.get('request')
+        srcset = {}
+        for size, name in value.items():
+            url = storage.url(name)
+            srcset[size] = request.build_absolute_uri(url) if request is not None else url
+        return srcset
+
+
+class DetectedInfoField(serializers.JSONField):
+    """
+    detected_info without the per-channel histograms (3 x 256 values), which
+    only the detail serializer outputs
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value or 'channels' not in value:
+            return value
+        channels = {
+            name: {k: v for k, v in channel.items() if k != 'histogram'} for name, channel in value['channels'].items()
+        }
+        return {**value, 'channels': channels}
 
 
 class ImageSerializer(serializers.ModelSerializer):
     user = UserSerializer()
+    srcset = ImageDerivativesField()
+    # 列表页不输出直方图
+    detected_info = DetectedInfoField()
 
     class Meta:
         model = Image
-        fields = '__all__'
+        # phash 超出 JavaScript 安全整数范围，不对外输出
+        exclude = ('derivatives', 'phash')
 
 
 class ImageGenerationSerializer(serializers.ModelSerializer):
     class Meta:
         model = ImageGeneration
-        fields = '__all__'
+        exclude = ('phash',)
 
 
 class NestedImageSerializer(serializers.ModelSerializer):
-    generations = ImageGenerationSerializer(many=True)
+    # 只内嵌最近的若干条处理记录，完整列表见 image/<pk>/generations/
+    generations = serializers.SerializerMethodField()
+    generation_count = serializers.SerializerMethodField()
+    srcset = ImageDerivativesField()
+
+    def get_generations(self, obj):
+        generations = obj.generations.all()[:settings.IMAGE_NESTED_GENERATIONS]
+        return ImageGenerationSerializer(generations, many=True, context=self.context).data
+
+    @staticmethod
+    def get_generation_count(obj):
+        return obj.generations.count()
 
     class Meta:
         model = Image
-        fields = '__all__'
+        exclude = ('derivatives', 'phash')
 
 
 class NestedImageGenerationSerializer(serializers.ModelSerializer):
@@ -42,6 +113,14 @@ class NestedImageGenerationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ImageGeneration
+        exclude = ('phash',)
+
+
+class ImageJobSerializer(serializers.ModelSerializer):
+    generation = ImageGenerationSerializer(read_only=True)
+
+    class Meta:
+        model = ImageJob
         fields = '__all__'
 
 
@@ -55,20 +134,38 @@ class ImageCreateSerializer(serializers.ModelSerializer):
 
     def validate_image(self, image):
         try:
-            thumbnail = generate_thumbnail(image)
+            # 衍生图、缩略图与感知哈希来自同一次解码
+            self.derivatives, self.thumbnail, self.phash = generate_upload_images(image)
         except Exception:
             # log here
             raise serializers.ValidationError(
                 _('Upload a valid image. The file you uploaded was '
                   'either not an image or a corrupted image.')
             )
-        self.thumbnail = thumbnail
+        self.content_hash = file_digest(image)
         return image
 
     def validate(self, attrs):
         attrs['thumbnail'] = self.thumbnail
+        attrs['content_hash'] = self.content_hash
+        attrs['phash'] = self.phash
         return attrs
 
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        if self.derivatives:
+            # 衍生图按原图的 upload_to 命名：<原图名>_<长边><衍生图格式后缀>
+            field = instance.image.field
+            stem = Path(self.validated_data['image'].name).stem
+            instance.derivatives = {
+                str(size): field.storage.save(
+                    field.generate_filename(instance, f'{stem}_{size}{Path(file.name).suffix}'), file
+                )
+                for size, file in self.derivatives.items()
+            }
+            instance.save(update_fields=['derivatives'])
+        return instance
+
 
 class ImageUpdateSerializer(serializers.ModelSerializer):
 
@@ -77,45 +174,229 @@ class ImageUpdateSerializer(serializers.ModelSerializer):
             raise PermissionDenied
         return attrs
 
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        # 只写入修改的字段，不覆盖同时进行的处理写入的 generation_num 等列
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
     class Meta:
         model = Image
         fields = ('name', 'is_public')
 
 
+class PreviewParamsSerializer(serializers.Serializer):
+    max_edge = serializers.IntegerField(min_value=16, required=False)
+
+    def validate_max_edge(self, value):
+        return min(value, settings.IMAGE_PREVIEW_MAX_EDGE)
+
+
+class SimilarParamsSerializer(serializers.Serializer):
+    distance = serializers.IntegerField(min_value=0, max_value=MAX_DISTANCE, required=False)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_limit(self, value):
+        return min(value, settings.SIMILAR_IMAGES['MAX_RESULTS'])
+
+
+class SimilarImageSerializer(serializers.Serializer):
+    distance = serializers.IntegerField()
+    image = ImageSerializer()
+
+
 class BaseProcessSerializer(serializers.Serializer):
+    # 是否可以作为 PipelineImageSerializer 中的一个步骤
+    pipeline_step = True
+    # 是否产出处理后的图像（预览、批量处理依赖于此）
+    produces_image = True
+    # 输出编码配置，见 settings.IMAGE_ENCODER_PROFILES
+    profile = serializers.ChoiceField(choices=list(settings.IMAGE_ENCODER_PROFILES), required=False)
 
     def _process(self, image: cv2.typing.MatLike, validated_data: dict):
         raise NotImplementedError
 
-    def update(self, instance, validated_data):
-        action = self.__class__.__name__.replace('ImageSerializer', '').lower()
-        # 读取文件内容为字节流
-        image_bytes = self.instance.image.read()
-        # 将字节流转换为 numpy 数组
-        np_array = np.frombuffer(image_bytes, dtype=np.uint8)
-        # 将 numpy 数组解码为图像
-        image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+    def tile_halo(self, validated_data: dict):
+        """
+        Rows of context ``_process`` needs around each output row: 0 for pixelwise
+        ops, the kernel radius for neighbourhood filters, None if it cannot run in strips.
+        """
+        return None
+
+    def check_budget(self, size, validated_data: dict, suffix: str = None) -> bool:
+        """
+        Whether an image of ``size`` (w, h) is processed in strips; raises
+        ValidationError when it is over the pixel budget for this action.
+        A JPEG (``suffix``) is counted at the size it is decoded at.
+        """
+        budget = settings.IMAGE_PROCESS_BUDGET
+        width, height = size
+        pixels = width * height
+        if suffix and suffix.lower() in ('.jpg', '.jpeg'):
+            # 只有 JPEG 在 DCT 域缩小解码；其他格式先完整解码再缩小，峰值内存仍按原尺寸计算
+            pixels //= self.decode_factor(size, validated_data) ** 2
+        if pixels <= budget['MAX_PIXELS']:
+            return False
+        if self.tile_halo(validated_data) is not None and pixels <= budget['MAX_TILED_PIXELS']:
+            return True
+        raise ValidationError(
+            f'The image ({width}x{height}) is too large for {self.context.get("action", "this action").lower()}.'
+        )
 
-        # 图像处理
-        umat_image = self._process(image, validated_data)
-
-        suffix = Path(instance.image.name).suffix
-        # 将处理后的图像转换为字节流
-        _, processed_image_bytes = cv2.imencode(suffix, umat_image)
-        processed_image_content = ContentFile(
-            processed_image_bytes.tobytes(),
-            name=f'{action}_{uuid.uuid4().hex}{suffix}'
+    def process(self, image: cv2.typing.MatLike, validated_data: dict, tiled: bool = False):
+        if not tiled:
+            return self._process(image, validated_data)
+        halo = self.tile_halo(validated_data)
+        rows = strip_rows(image, settings.IMAGE_PROCESS_BUDGET['TILE_BYTES'], halo)
+        # 结果按条带原地写回解码后的数组，不再分配整帧的输出
+        return apply_tiled(image, lambda strip: self._process(strip, validated_data), halo, rows, out=image)
+
+    def decode_factor(self, src_size, validated_data: dict) -> int:
+        """1, 2, 4 or 8: an image of ``src_size`` (w, h) is decoded that many times smaller."""
+        return 1
+
+    def decode_flags(self, src_size, validated_data: dict) -> int:
+        """cv2.imdecode flags for an image of ``src_size`` (w, h); actions with a small output decode reduced."""
+        return REDUCED_COLOR_FLAGS[self.decode_factor(src_size, validated_data)]
+
+    def decode(self, instance, validated_data: dict) -> cv2.typing.MatLike:
+        flags = cv2.IMREAD_COLOR
+        if instance.width and instance.height:
+            flags = self.decode_flags((instance.width, instance.height), validated_data)
+        return read_image(instance, flags=flags)
+
+    @staticmethod
+    def source_quality(instance):
+        """JPEG quality of the original, reused on encode so repeated edits do not drift."""
+        if Path(instance.image.name).suffix.lower() not in ('.jpg', '.jpeg'):
+            return None
+        with instance.image.open('rb') as f:
+            return estimate_jpeg_quality(f)
+
+    @staticmethod
+    def encode(image: cv2.typing.MatLike, suffix: str, profile: str = None, quality: int = None):
+        """
+        将处理后的图像转换为字节流，返回 (字节流, 输出格式的后缀)
+        quality 在编码配置未指定质量时使用
+        """
+        return encode_image(image, suffix, get_encoder_profile(profile), default_quality=quality)
+
+    def normalize_params(self, validated_data: dict) -> dict:
+        """Params as used in the result cache key; equivalent params should normalize equally."""
+        if not self.produces_image:
+            return validated_data
+        # 未指定 profile 时按当前默认配置编码，默认配置变更后不复用旧结果
+        return {**validated_data, 'profile': validated_data.get('profile') or settings.IMAGE_ENCODER_PROFILE}
+
+    def scale_params(self, validated_data: dict, scale: float) -> dict:
+        """Params to apply on a proxy that is ``scale`` times the size of the original."""
+        return validated_data
+
+    def preview(self, instance, validated_data, max_edge):
+        """
+        在缩小的代理图上执行处理，返回编码后的字节流和后缀，不写存储也不建记录
+        """
+        image = decode_proxy(instance, max_edge)
+        scale = max(image.shape[:2]) / max(instance.width or 0, instance.height or 0, 1)
+        umat_image = self._process(image, self.scale_params(validated_data, scale))
+        return self.encode(
+            umat_image, Path(instance.image.name).suffix,
+            profile=validated_data.get('profile'), quality=self.source_quality(instance)
         )
 
-        img_generation = ImageGeneration.objects.create(
+    def update(self, instance, validated_data):
+        with metrics.track(self.context['action'], (instance.width, instance.height)):
+            return self._cached_update(instance, validated_data)
+
+    def _cached_update(self, instance, validated_data):
+        if not result_cache.enabled:
+            return self._update(instance, validated_data)
+
+        with metrics.stage('cache'):
+            cache_key = result_cache.make_key(
+                get_content_hash(instance), self.context['action'], self.normalize_params(validated_data)
+            )
+            img_generation = self._get_cached(instance, cache_key)
+        if img_generation is not None:
+            result_cache.record('hits')
+            return img_generation
+
+        with result_cache.lock(cache_key):
+            # 等待锁期间，相同的请求可能已经完成
+            img_generation = self._get_cached(instance, cache_key)
+            if img_generation is not None:
+                result_cache.record('hits')
+                result_cache.record('coalesced')
+                return img_generation
+            result_cache.record('misses')
+            return self._update(instance, validated_data, cache_key=cache_key)
+
+    @staticmethod
+    def _get_cached(instance, cache_key):
+        return ImageGeneration.objects.filter(original_image=instance, cache_key=cache_key).first()
+
+    def _update(self, instance, validated_data, cache_key=''):
+        action = self.__class__.__name__.replace('ImageSerializer', '').lower()
+        # 解码前检查像素预算，超出时分块处理或拒绝
+        tiled = self.check_budget(
+            (instance.width or 0, instance.height or 0), validated_data, suffix=Path(instance.image.name).suffix
+        )
+        with cpu_budget.boost((instance.width or 0) * (instance.height or 0)) as boost:
+            if boost and not workers.jobs_pending():
+                # 主机空闲时大图交给多线程的 boost 进程，web worker 自身的线程数不变
+                with metrics.stage('boost'):
+                    with instance.image.open('rb') as f:
+                        image_bytes = f.read()
+                    content, suffix, _, _, thumbnail, thumbnail_suffix, phash = workers.submit(
+                        'boost', workers.process_image_bytes,
+                        self.context['action'], image_bytes, Path(instance.image.name).suffix, validated_data
+                    ).result()
+            else:
+                content, suffix, thumbnail, thumbnail_suffix, phash = self._render(instance, validated_data, tiled)
+        metrics.count_bytes('written', len(content))
+
+        img_generation = ImageGeneration(
             action=self.context['action'],
             original_image=instance,
-            processed_image=processed_image_content,
+            params=validated_data,
+            cache_key=cache_key,
+            phash=phash,
         )
-        instance.generation_num += 1
-        instance.save()
+        with metrics.stage('store'):
+            name = f'{action}_{uuid.uuid4().hex}{suffix}'
+            img_generation.processed_image.save(name, ContentFile(content, name=name), save=False)
+            thumbnail_name = f'thumbnail{thumbnail_suffix}'
+            img_generation.thumbnail.save(thumbnail_name, ContentFile(thumbnail, name=thumbnail_name), save=False)
+        with metrics.stage('db'), transaction.atomic():
+            img_generation.save()
+            # 多个 worker 并发处理同一图片时，在数据库中自增计数，不会丢失更新
+            Image.objects.filter(pk=instance.pk).update(
+                generation_num=F('generation_num') + 1, updated_at=timezone.now()
+            )
+            instance.refresh_from_db(fields=['generation_num', 'updated_at'])
         return img_generation
 
+    def _render(self, instance, validated_data, tiled):
+        """Process ``instance`` in this process; returns (content, suffix, thumbnail, thumbnail suffix, phash)"""
+        image = self.decode(instance, validated_data)
+
+        # 图像处理
+        with metrics.stage('process'):
+            umat_image = self.process(image, validated_data, tiled=tiled)
+
+        with metrics.stage('encode'):
+            content, suffix = self.encode(
+                umat_image, Path(instance.image.name).suffix,
+                profile=validated_data.get('profile'), quality=self.source_quality(instance)
+            )
+
+        # 缩略图和感知哈希取自内存中的结果，提升为图片时不再解码
+        with metrics.stage('thumbnail'):
+            thumbnail, thumbnail_suffix = encode_thumbnail(umat_image, suffix)
+            phash = to_signed(array_difference_hash(umat_image, draft=suffix in ('.jpg', '.jpeg')))
+        return content, suffix, thumbnail, thumbnail_suffix, phash
+
     def create(self, validated_data):
         raise PermissionError
 
@@ -130,13 +411,35 @@ class CropImageSerializer(BaseProcessSerializer):
     width = serializers.IntegerField()
     height = serializers.IntegerField()
 
+    def scale_params(self, validated_data: dict, scale: float) -> dict:
+        return {
+            **validated_data,
+            'width': max(1, round(validated_data['width'] * scale)),
+            'height': max(1, round(validated_data['height'] * scale)),
+        }
+
+    def decode_factor(self, src_size, validated_data: dict) -> int:
+        return reduction_factor(src_size, (validated_data['width'], validated_data['height']))
+
     def _process(self, image: cv2.typing.MatLike, validated_data: dict):
         size = (validated_data['width'], validated_data['height'])
+        height, width = image.shape[:2]
+        if size[0] <= width and size[1] <= height:
+            # 缩小用面积插值，避免混叠
+            return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
         return cv2.resize(image, size)
 
 
 class FlipImageSerializer(BaseProcessSerializer):
-    axis = serializers.IntegerField()
+    # 解码后的图像为 (高, 宽, 通道)，负数按 numpy 的规则从末尾计数
+    axis = serializers.IntegerField(min_value=-3, max_value=2)
+
+    def normalize_params(self, validated_data: dict) -> dict:
+        return super().normalize_params({**validated_data, 'axis': validated_data['axis'] % 3})
+
+    def tile_halo(self, validated_data: dict):
+        # 水平翻转、通道翻转只在行内进行；垂直翻转（0 或 -3）不能分块
+        return None if validated_data['axis'] % 3 == 0 else 0
 
     def _process(self, image: cv2.typing.MatLike, validated_data: dict):
         axis = validated_data['axis']
@@ -145,51 +448,150 @@ class FlipImageSerializer(BaseProcessSerializer):
 
 class RotateImageSerializer(BaseProcessSerializer):
     angle = serializers.IntegerField()
+    # 任意角度旋转时扩大画布以容纳整幅图像，而不是裁掉四角
+    expand = serializers.BooleanField(default=False)
+
+    # 逆时针角度 -> cv2.rotate 代码，纯转置/翻转，无插值
+    RIGHT_ANGLES = {
+        90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+        180: cv2.ROTATE_180,
+        270: cv2.ROTATE_90_CLOCKWISE,
+    }
+
+    def normalize_params(self, validated_data: dict) -> dict:
+        angle = validated_data['angle'] % 360
+        expand = bool(validated_data.get('expand')) and angle not in self.RIGHT_ANGLES and angle != 0
+        return super().normalize_params({**validated_data, 'angle': angle, 'expand': expand})
 
     def _process(self, image: cv2.typing.MatLike, validated_data: dict):
-        angle = validated_data['angle']
-        width, height = self.instance.image.width, self.instance.image.height
+        angle = validated_data['angle'] % 360
+        if angle == 0:
+            return image
+        if angle in self.RIGHT_ANGLES:
+            return cv2.rotate(image, self.RIGHT_ANGLES[angle])
+
+        height, width = image.shape[:2]
         center = (width // 2, height // 2)
         matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
-        return cv2.warpAffine(image, matrix, (width, height))
+        size = (width, height)
+        if validated_data.get('expand'):
+            cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+            size = (round(height * sin + width * cos), round(height * cos + width * sin))
+            # 平移到新画布中心
+            matrix[0, 2] += size[0] / 2 - center[0]
+            matrix[1, 2] += size[1] / 2 - center[1]
+        return cv2.warpAffine(image, matrix, size)
 
 
 class BlurImageSerializer(BaseProcessSerializer):
-    mode = serializers.CharField()
+    mode = serializers.ChoiceField(choices=('mean', 'median', 'gaussian'))
+    KERNEL_SIZE = 5
+
+    def tile_halo(self, validated_data: dict):
+        return self.KERNEL_SIZE // 2
 
     def _process(self, image: cv2.typing.MatLike, validated_data: dict):
         mode = validated_data['mode']
+        ksize = self.KERNEL_SIZE
         if mode == "mean":
-            umat = cv2.blur(image, (5, 5))
+            umat = cv2.blur(image, (ksize, ksize))
         elif mode == "median":
-            umat = cv2.medianBlur(image, 5)
+            umat = cv2.medianBlur(image, ksize)
         elif mode == "gaussian":
-            umat = cv2.GaussianBlur(image, (5, 5), 0)
+            umat = cv2.GaussianBlur(image, (ksize, ksize), 0)
         else:
             raise serializers.ValidationError(f'The value "{mode}" is not a valid mode.')
         return umat
 
 
+class PipelineStepSerializer(serializers.Serializer):
+    action = serializers.CharField()
+    params = serializers.DictField(required=False, default=dict)
+
+    def validate(self, attrs):
+        action = attrs['action'].lower()
+        serializer_class = get_process_serializer_class(action)
+        if not serializer_class.pipeline_step:
+            raise ValidationError(f'The action {action} can not be used in a pipeline.')
+        serializer = serializer_class(data=attrs['params'], context=self.context)
+        serializer.is_valid(raise_exception=True)
+        return {'action': action, 'params': serializer.validated_data}
+
+
+class PipelineImageSerializer(BaseProcessSerializer):
+    """
+    按顺序执行多个处理步骤，只解码、编码一次，并只生成一个 ImageGeneration
+    """
+    pipeline_step = False
+    steps = PipelineStepSerializer(many=True, allow_empty=False)
+
+    def validate_steps(self, value):
+        if len(value) > settings.IMAGE_PIPELINE_MAX_STEPS:
+            raise ValidationError(f'A pipeline can have at most {settings.IMAGE_PIPELINE_MAX_STEPS} steps.')
+        return value
+
+    def scale_params(self, validated_data: dict, scale: float) -> dict:
+        steps = []
+        for step in validated_data['steps']:
+            serializer = get_process_serializer_class(step['action'])(self.instance, context=self.context)
+            steps.append({'action': step['action'], 'params': serializer.scale_params(step['params'], scale)})
+        return {**validated_data, 'steps': steps}
+
+    def tile_halo(self, validated_data: dict):
+        # 串联的邻域滤波，所需上下文行数相加
+        halo = 0
+        for step in validated_data['steps']:
+            serializer = get_process_serializer_class(step['action'])(self.instance, context=self.context)
+            step_halo = serializer.tile_halo(step['params'])
+            if step_halo is None:
+                return None
+            halo += step_halo
+        return halo
+
+    def _process(self, image: cv2.typing.MatLike, validated_data: dict):
+        for step in validated_data['steps']:
+            serializer_class = get_process_serializer_class(step['action'])
+            image = serializer_class(self.instance, context=self.context)._process(image, step['params'])
+        return image
+
+
 class DetectImageSerializer(BaseProcessSerializer):
+    pipeline_step = False
+    produces_image = False
+    profile = None
+    # 已有统计结果时直接返回，refresh=true 时重新计算
+    refresh = serializers.BooleanField(default=False)
 
     def update(self, instance, validated_data):
-        # 读取文件内容为字节流
-        image_bytes = self.instance.image.read()
-        # 将字节流转换为 numpy 数组
-        np_array = np.frombuffer(image_bytes, dtype=np.uint8)
-        # 将 numpy 数组解码为图像
-        image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-
-        info = {
-            'width': self.instance.image.width,
-            'height': self.instance.image.height,
-            'max': np.max(image),
-            'min': np.min(image)
-        }
-
-        instance.detected_info = json.dumps(info, cls=NumJsonEncoder)
-        instance.save()
+        if instance.detected_info and not validated_data.get('refresh'):
+            return instance
+
+        with metrics.track(self.context.get('action', 'DETECT'), (instance.width, instance.height)):
+            # 统计在缩小解码后的图像上进行
+            min_edge = settings.IMAGE_DETECT_MIN_EDGE
+            factor = reduction_factor((instance.width, instance.height), (min_edge, min_edge))
+            image = read_image(instance, flags=REDUCED_COLOR_FLAGS[factor])
+
+            with metrics.stage('process'):
+                info = image_statistics(image)
+            info.update({
+                'width': instance.width,
+                'height': instance.height,
+                'analyzed_width': image.shape[1],
+                'analyzed_height': image.shape[0],
+            })
+            instance.detected_info = info
+            with metrics.stage('db'):
+                instance.save(update_fields=['detected_info', 'updated_at'])
         return instance
 
     def to_representation(self, instance):
-        return ImageSerializer(instance).data
+        return NestedImageSerializer(instance, context=self.context).data
+
+
+def get_process_serializer_class(action: str):
+    """Look up the process serializer for an action such as ``crop`` or ``BLUR``."""
+    cls = globals().get(f'{action.capitalize()}ImageSerializer')
+    if not (isinstance(cls, type) and issubclass(cls, BaseProcessSerializer)):
+        raise ValidationError(f'The action {action} is not valid.')
+    return cls
@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from apiv1.similar import similar_index
+from common.backends import user_cache
+from main.models.image import Image
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Image, dispatch_uid='similar_index_add')
+def add_to_similar_index(sender, instance, **kwargs):
+    similar_index.add(instance.id, instance.phash)
+
+
+@receiver(post_delete, sender=Image, dispatch_uid='similar_index_discard')
+def discard_from_similar_index(sender, instance, **kwargs):
+    similar_index.discard(instance.id)
+
+
+@receiver(post_save, sender=User, dispatch_uid='user_cache_user_saved')
+def invalidate_user_cache_on_save(sender, update_fields=None, **kwargs):
+    # 登录只更新 last_login，不影响认证结果
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    # 提交之后再失效：提交前其他进程读到的仍是旧数据，会被重新缓存
+    transaction.on_commit(user_cache.invalidate)
+
+
+@receiver(post_delete, sender=User, dispatch_uid='user_cache_user_deleted')
+@receiver(post_save, sender=Group, dispatch_uid='user_cache_group_saved')
+@receiver(post_delete, sender=Group, dispatch_uid='user_cache_group_deleted')
+@receiver(post_delete, sender=Permission, dispatch_uid='user_cache_permission_deleted')
+def invalidate_user_cache(sender, **kwargs):
+    transaction.on_commit(user_cache.invalidate)
+
+
+@receiver(m2m_changed, sender=User.groups.through, dispatch_uid='user_cache_user_groups')
+@receiver(m2m_changed, sender=User.user_permissions.through, dispatch_uid='user_cache_user_permissions')
+@receiver(m2m_changed, sender=Group.permissions.through, dispatch_uid='user_cache_group_permissions')
+def invalidate_user_cache_on_m2m(sender, action, **kwargs):
+    if action.startswith('post_'):
+        transaction.on_commit(user_cache.invalidate)
@@ -0,0 +1,99 @@
+"""
+Near-duplicate search over the perceptual hashes of all images.
+
+Every worker keeps a multi-index hash table of (id, phash) in memory, about
+40 bytes per image. It is built from the database on first use (or by the
+warm-up thread started from asgi.py), updated by the post_save / post_delete
+signals of its own process, and catches up with rows created by other
+workers by loading ids above the largest one it has seen before each query.
+Deletions made by other workers are not seen, so results are always
+filtered through the database.
+"""
+import threading
+
+from django.conf import settings
+
+from common.utils.hamming import MultiIndexHashTable, to_signed, to_unsigned
+from common.utils.image import difference_hash
+from main.models.image import Image
+
+__all__ = [
+    'similar_index',
+    'get_phash',
+]
+
+BUILD_CHUNK_SIZE = 100_000
+
+
+def get_phash(instance) -> int:
+    """Return the perceptual hash of an Image, computing and saving it for older rows."""
+    if instance.phash is None:
+        with instance.image.open('rb') as f:
+            instance.phash = to_signed(difference_hash(f))
+        instance.save(update_fields=['phash'])
+    return instance.phash
+
+
+class SimilarImageIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table = None
+        self._max_id = 0
+
+    def _load(self, after_id: int):
+        """(ids, unsigned hashes) of hashed rows with id > after_id"""
+        ids, hashes = [], []
+        queryset = Image.objects.filter(id__gt=after_id, phash__isnull=False).order_by('id')
+        while True:
+            # 按 id 分段读取，避免一次取出全部行
+            rows = list(queryset.filter(id__gt=after_id).values_list('id', 'phash')[:BUILD_CHUNK_SIZE])
+            for id_, phash in rows:
+                ids.append(id_)
+                hashes.append(to_unsigned(phash))
+            if len(rows) < BUILD_CHUNK_SIZE:
+                return ids, hashes
+            after_id = rows[-1][0]
+
+    def _ensure_table(self) -> MultiIndexHashTable:
+        with self._lock:
+            if self._table is None:
+                ids, hashes = self._load(0)
+                table = MultiIndexHashTable(merge_threshold=settings.SIMILAR_IMAGES['MERGE_THRESHOLD'])
+                table.build(ids, hashes)
+                self._max_id = max(ids, default=0)
+                self._table = table
+            else:
+                # 其他进程新增的图片
+                for id_, hash_ in zip(*self._load(self._max_id)):
+                    self._table.add(id_, hash_)
+                    self._max_id = max(self._max_id, id_)
+            return self._table
+
+    def warm_up(self):
+        """Build the index in a background thread"""
+        threading.Thread(target=self._ensure_table, name='similar-index', daemon=True).start()
+
+    def add(self, id_: int, phash: int):
+        if self._table is not None and phash is not None:
+            with self._lock:
+                self._table.add(id_, to_unsigned(phash))
+                self._max_id = max(self._max_id, id_)
+
+    def discard(self, id_: int):
+        if self._table is not None:
+            self._table.remove(id_)
+
+    def search(self, phash: int, max_distance: int) -> list:
+        """[(id, distance)] within max_distance of phash, nearest first"""
+        return self._ensure_table().search(to_unsigned(phash), max_distance)
+
+    def stats(self) -> dict:
+        return {
+            'built': self._table is not None,
+            'size': len(self._table) if self._table is not None else 0,
+            'max_id': self._max_id,
+        }
+
+
+similar_index = SimilarImageIndex()
@@ -1,3 +1,1188 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO
+from pathlib import Path
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from PIL import Image as PILImage
+from prometheus_client.parser import text_string_to_metric_families
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apiv1 import workers
+from apiv1.cpu import cpu_budget
+from apiv1.serializers.image import ImageCreateSerializer, ImageUpdateSerializer, get_process_serializer_class
+from apiv1.utils import get_decoded_image_cache
+from common.backends import UserCache, user_cache
+from common.storages import ContentAddressedStorage
+from common.utils import encoders
+from common.utils import image as image_utils
+from common.utils.hamming import MAX_DISTANCE, MultiIndexHashTable, to_signed, to_unsigned
+from common.utils.deleter import BackgroundFileDeleter, file_deleter
+from common.utils.shm_cache import SharedArrayCache
+from main.models.image import Image, ImageGeneration
+from main.models.job import ImageJob
+
+
+def encode(image, suffix='.jpg') -> bytes:
+    _, encoded = cv2.imencode(suffix, image)
+    return encoded.tobytes()
+
+
+def noise(width=320, height=240, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+class MediaMixin:
+    """Stores files of the test under a temporary media root."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, CONTENT_STORAGE={'BLOB_DIR': Path(self.media_root, '.blobs')}
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(get_decoded_image_cache().destroy)
+
+    @staticmethod
+    def create_image(user, name='image', content=None, suffix='.jpg'):
+        if content is None:
+            content = encode(noise(), suffix)
+        return Image.objects.create(name=name, user=user, image=ContentFile(content, name=f'{name}{suffix}'))
+
+
+class ConcurrentWriteTestCase(MediaMixin, TransactionTestCase):
+    """Parallel processing of one image from several threads, each with its own connection."""
+
+    threads = 8
+    rounds = 3
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('worker', password='worker')
+        self.image = self.create_image(self.user, name='concurrent')
+
+    def run_in_threads(self, target):
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def run(index):
+            try:
+                barrier.wait()
+                for round_ in range(self.rounds):
+                    target(index, round_)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run, args=(i,)) for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return errors
+
+    def process(self, index, round_):
+        instance = Image.objects.get(pk=self.image.pk)
+        # 参数各不相同，不命中结果缓存
+        serializer = get_process_serializer_class('ROTATE')(
+            instance, data={'angle': 1 + index * self.rounds + round_}, context={'action': 'ROTATE', 'request': None}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.update(instance, serializer.validated_data)
+
+    def test_no_lost_generation_updates(self):
+        errors = self.run_in_threads(self.process)
+
+        self.assertEqual(errors, [])
+        self.image.refresh_from_db()
+        total = self.threads * self.rounds
+        self.assertEqual(self.image.generations.count(), total)
+        self.assertEqual(self.image.generation_num, total)
+
+    def test_update_does_not_overwrite_generation_num(self):
+        def rename(index, round_):
+            instance = Image.objects.get(pk=self.image.pk)
+            request = type('Request', (), {'user': self.user})
+            serializer = ImageUpdateSerializer(
+                instance, data={'name': f'renamed-{index}-{round_}'}, partial=True, context={'request': request}
+            )
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        def process_or_rename(index, round_):
+            if index % 2:
+                rename(index, round_)
+            else:
+                self.process(index, round_)
+
+        errors = self.run_in_threads(process_or_rename)
+
+        self.assertEqual(errors, [])
+        self.image.refresh_from_db()
+        processed = (self.threads + 1) // 2 * self.rounds
+        self.assertEqual(self.image.generation_num, processed)
+        self.assertTrue(self.image.name.startswith('renamed-'))
+
+
+class JobRecoveryTestCase(MediaMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('jobs', password='jobs')
+        self.image = self.create_image(self.user)
+
+    def create_job(self, status, started=None):
+        return ImageJob.objects.create(
+            action='DETECT', image=self.image, user=self.user, status=status, started_at=started
+        )
+
+    def test_recover_requeues_queued_and_expires_stale_jobs(self):
+        now = timezone.now()
+        queued = self.create_job(ImageJob.QUEUED)
+        stale = self.create_job(ImageJob.RUNNING, now - timedelta(hours=1))
+        running = self.create_job(ImageJob.RUNNING, now)
+
+        with mock.patch.object(workers, 'submit') as submit, self.assertLogs('apiv1.workers', 'WARNING'):
+            workers.recover_jobs()
+
+        submit.assert_called_once_with('jobs', workers.run_job, queued.pk)
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, ImageJob.FAILED)
+        self.assertEqual(running.status, ImageJob.RUNNING)
+
+    def test_submit_failure_leaves_job_queued(self):
+        job = self.create_job(ImageJob.QUEUED)
+        with mock.patch.object(workers, 'submit', side_effect=RuntimeError('pool is gone')), \
+                self.assertLogs('apiv1.workers', 'ERROR'):
+            workers.enqueue_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageJob.QUEUED)
+
+    def test_expired_job_is_not_overwritten(self):
+        job = self.create_job(ImageJob.QUEUED)
+
+        def expire(*args, **kwargs):
+            ImageJob.objects.filter(pk=job.pk).update(status=ImageJob.FAILED, error='Timed out.')
+            return {}
+
+        with mock.patch('apiv1.serializers.image.DetectImageSerializer.update', side_effect=expire):
+            workers.run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageJob.FAILED)
+
+
+def run_process(image_id, action, params):
+    instance = Image.objects.get(pk=image_id)
+    serializer = get_process_serializer_class(action)(
+        instance, data=params, context={'action': action, 'request': None}
+    )
+    serializer.is_valid(raise_exception=True)
+    return serializer.update(instance, serializer.validated_data)
+
+
+class ResultCacheTestCase(MediaMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('cache', password='cache')
+        self.image = self.create_image(self.user)
+
+    def test_repeated_request_returns_stored_generation(self):
+        first = run_process(self.image.pk, 'BLUR', {'mode': 'mean'})
+        second = run_process(self.image.pk, 'BLUR', {'mode': 'mean'})
+        other = run_process(self.image.pk, 'BLUR', {'mode': 'median'})
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertNotEqual(first.pk, other.pk)
+        self.assertEqual(self.image.generations.count(), 2)
+
+    def test_equivalent_params_share_a_result(self):
+        first = run_process(self.image.pk, 'ROTATE', {'angle': 90})
+        second = run_process(self.image.pk, 'ROTATE', {'angle': 450, 'expand': True})
+        self.assertEqual(first.pk, second.pk)
+
+    def test_default_profile_is_part_of_the_key(self):
+        first = run_process(self.image.pk, 'FLIP', {'axis': 1})
+        # 显式指定的 profile 与默认配置相同时复用结果
+        explicit = run_process(self.image.pk, 'FLIP', {'axis': -2, 'profile': settings.IMAGE_ENCODER_PROFILE})
+        self.assertEqual(first.pk, explicit.pk)
+        with override_settings(IMAGE_ENCODER_PROFILE='webp'):
+            webp = run_process(self.image.pk, 'FLIP', {'axis': 1})
+        self.assertNotEqual(first.pk, webp.pk)
+        self.assertTrue(webp.processed_image.name.endswith('.webp'))
+        self.assertEqual(run_process(self.image.pk, 'FLIP', {'axis': 1, 'profile': 'webp'}).pk, webp.pk)
+
+    def test_identical_requests_in_flight_are_coalesced(self):
+        threads = 6
+        barrier = threading.Barrier(threads)
+        results, errors = [], []
+
+        def run():
+            try:
+                barrier.wait()
+                results.append(run_process(self.image.pk, 'BLUR', {'mode': 'gaussian'}).pk)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers_ = [threading.Thread(target=run) for _ in range(threads)]
+        for worker in workers_:
+            worker.start()
+        for worker in workers_:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(self.image.generations.count(), 1)
+
+    @override_settings(IMAGE_RESULT_CACHE={'ENABLED': False, 'LOCK_DIR': tempfile.gettempdir()})
+    def test_disabled_cache_always_processes(self):
+        run_process(self.image.pk, 'BLUR', {'mode': 'mean'})
+        run_process(self.image.pk, 'BLUR', {'mode': 'mean'})
+        self.assertEqual(self.image.generations.count(), 2)
+
+
+class SharedArrayCacheTestCase(TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir, ignore_errors=True)
+        self.cache = SharedArrayCache('test', max_bytes=3000, base_dir=self.base_dir)
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.cache.directory) if not name.startswith('index'))
+
+    def test_get_returns_a_private_copy(self):
+        array = np.arange(100, dtype=np.uint16).reshape(10, 10)
+        self.cache.put('a', array)
+        cached = self.cache.get('a')
+        np.testing.assert_array_equal(cached, array)
+        cached[:] = 0
+        np.testing.assert_array_equal(self.cache.get('a'), array)
+        self.assertIsNone(self.cache.get('missing'))
+
+    def test_evicts_least_recently_used_before_writing(self):
+        for key in 'abc':
+            self.cache.put(key, np.zeros(1000, np.uint8))
+        self.cache.get('a')
+        self.cache.put('d', np.zeros(1000, np.uint8))
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertLessEqual(self.cache.stats()['bytes'], 3000)
+        self.assertEqual(len(self.segments()), 3)
+
+    def test_skips_arrays_over_the_limit_or_the_free_space(self):
+        self.cache.put('big', np.zeros(4000, np.uint8))
+        with mock.patch.object(SharedArrayCache, '_free_bytes', return_value=0):
+            self.cache.put('full', np.zeros(100, np.uint8))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(self.segments(), [])
+
+    def test_entries_of_exited_processes_are_removed(self):
+        self.cache.put('a', np.zeros(100, np.uint8))
+        # 大于 Linux pid 上限（2 ** 22）的进程号不存在
+        self.cache._connect().execute('UPDATE entries SET pid = ?', (2 ** 22 + 1,))
+
+        self.cache.put('b', np.zeros(100, np.uint8))
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.segments()), 1)
+
+        self.cache.release()
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(self.segments(), [])
+
+    def test_decoded_image_cache_is_scoped_by_deployment(self):
+        with override_settings(MEDIA_ROOT='/srv/a'):
+            first = get_decoded_image_cache()
+        with override_settings(MEDIA_ROOT='/srv/b'):
+            second = get_decoded_image_cache()
+        self.assertNotEqual(first.directory, second.directory)
+        self.assertFalse(os.path.exists(first.directory))
+
+
+def run_inline(name, fn, *args):
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+@override_settings(IMAGE_BATCH_MAX_IN_FLIGHT=2)
+class BatchProcessTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('batch', password='batch')
+        self.user.user_permissions.add(Permission.objects.get(codename='change_image'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.images = [self.create_image(self.user, name=f'batch{i}', content=encode(noise(seed=i))) for i in range(5)]
+
+    def batch(self, image_ids, action, data):
+        return self.client.put(f"/api/v1/image/images/{','.join(map(str, image_ids))}/{action}/", data, format='json')
+
+    def stored_files(self):
+        return sorted(str(p.relative_to(self.media_root)) for p in Path(self.media_root).rglob('*')
+                      if p.is_file() and p.relative_to(self.media_root).parts[0] != '.blobs')
+
+    def test_in_flight_submissions_are_capped(self):
+        in_flight, peak = [0], [0]
+
+        def submit(name, fn, *args):
+            # 结果取走之前都算作在途
+            future = run_inline(name, fn, *args)
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            result = future.result
+
+            def take(*args):
+                in_flight[0] -= 1
+                return result(*args)
+
+            future.result = take
+            return future
+
+        with mock.patch('apiv1.views.image.submit', side_effect=submit):
+            response = self.batch([image.pk for image in self.images] + [9999], 'blur', {'mode': 'mean'})
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r.get('error') for r in results], [None] * 5 + ['Not found.'])
+        self.assertEqual(ImageGeneration.objects.filter(action='BLUR').count(), 5)
+        self.assertEqual(peak[0], 2)
+        for image in self.images:
+            updated_at = image.updated_at
+            image.refresh_from_db()
+            self.assertEqual(image.generation_num, 1)
+            self.assertGreater(image.updated_at, updated_at)
+
+    @override_settings(IMAGE_PROCESS_BUDGET={'MAX_PIXELS': 100, 'MAX_TILED_PIXELS': 100, 'TILE_BYTES': 1024})
+    def test_errors_are_returned_as_detail(self):
+        with mock.patch('apiv1.views.image.submit', side_effect=run_inline):
+            response = self.batch([self.images[0].pk], 'blur', {'mode': 'mean'})
+
+        self.assertEqual(response.json()['results'], [
+            {'image': self.images[0].pk, 'error': ['The image (320x240) is too large for blur.']}
+        ])
+
+    def test_saved_files_are_removed_when_the_insert_fails(self):
+        before = self.stored_files()
+        with mock.patch('apiv1.views.image.submit', side_effect=run_inline), \
+                mock.patch.object(ImageGeneration.objects, 'bulk_create', side_effect=DatabaseError('insert failed')):
+            with self.assertRaises(DatabaseError):
+                self.batch([image.pk for image in self.images], 'blur', {'mode': 'mean'})
+        file_deleter.join()
+        self.assertEqual(self.stored_files(), before)
+
+
+class DetectedInfoTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('detect', password='detect')
+        self.user.user_permissions.add(Permission.objects.get(codename='change_imagegeneration'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.image = self.create_image(self.user)
+
+    def test_histograms_are_only_in_the_detail(self):
+        run_process(self.image.pk, 'DETECT', {})
+
+        listed = self.client.get('/api/v1/image/images/').json()['results'][0]['detected_info']
+        detail = self.client.get(f'/api/v1/image/image/{self.image.pk}/').json()['detected_info']
+        self.assertTrue(all('histogram' not in channel for channel in listed['channels'].values()))
+        self.assertTrue(all(len(channel['histogram']) == 256 for channel in detail['channels'].values()))
+        self.assertEqual(listed['sharpness'], detail['sharpness'])
+
+    def test_elevated_image_is_detected(self):
+        generation = run_process(self.image.pk, 'FLIP', {'axis': 1})
+        with mock.patch.object(workers, 'submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(f'/api/v1/image/generation/{generation.pk}/elevate/')
+
+        job = ImageJob.objects.get(image=response.json()['id'])
+        self.assertEqual(job.action, 'DETECT')
+        submit.assert_called_once_with('jobs', workers.run_job, job.pk)
+
+
+@override_settings(IMAGE_PROCESS_BUDGET={'MAX_PIXELS': 320 * 240 // 4, 'MAX_TILED_PIXELS': 0, 'TILE_BYTES': 1024})
+class ReducedDecodeBudgetTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('budget', password='budget')
+
+    def test_jpeg_crop_is_budgeted_at_the_decoded_size(self):
+        image = self.create_image(self.user)
+        generation = run_process(image.pk, 'CROP', {'width': 80, 'height': 60})
+        self.assertEqual((generation.width, generation.height), (80, 60))
+
+        with self.assertRaisesMessage(ValidationError, 'too large'):
+            run_process(image.pk, 'CROP', {'width': 200, 'height': 150})
+
+    def test_png_crop_is_budgeted_at_the_full_size(self):
+        image = self.create_image(self.user, suffix='.png')
+        with self.assertRaisesMessage(ValidationError, 'too large'):
+            run_process(image.pk, 'CROP', {'width': 80, 'height': 60})
+
+
+class PipelineViewTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('pipeline', password='pipeline')
+        self.user.user_permissions.add(Permission.objects.get(codename='change_image'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.image = self.create_image(self.user)
+
+    def pipeline(self, steps):
+        return self.client.put(
+            f'/api/v1/image/image/{self.image.pk}/pipeline/?async=0', {'steps': steps}, format='json'
+        )
+
+    def test_steps_create_one_generation(self):
+        response = self.pipeline([
+            {'action': 'crop', 'params': {'width': 200, 'height': 100}},
+            {'action': 'rotate', 'params': {'angle': 90}},
+            {'action': 'blur', 'params': {'mode': 'gaussian'}},
+        ])
+        self.assertEqual(response.status_code, 200)
+        generation = ImageGeneration.objects.get(original_image=self.image)
+        self.assertEqual(generation.action, 'PIPELINE')
+        self.assertEqual([step['action'] for step in generation.params['steps']], ['crop', 'rotate', 'blur'])
+        with generation.processed_image.open('rb') as f:
+            content = f.read()
+        self.assertEqual(cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR).shape[:2], (200, 100))
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.generation_num, 1)
+
+    def test_invalid_steps_are_rejected(self):
+        for steps in (
+            [{'action': 'sharpen', 'params': {}}],
+            [{'action': 'pipeline', 'params': {'steps': [{'action': 'flip', 'params': {'axis': 1}}]}}],
+            [{'action': 'detect', 'params': {}}],
+            [{'action': 'blur', 'params': {'mode': 'box'}}],
+            [{'action': 'flip', 'params': {'axis': 3}}],
+            [],
+        ):
+            with self.subTest(steps=steps):
+                self.assertEqual(self.pipeline(steps).status_code, 400)
+        self.assertFalse(ImageGeneration.objects.exists())
+
+    @override_settings(IMAGE_PIPELINE_MAX_STEPS=3)
+    def test_step_count_is_limited(self):
+        step = {'action': 'flip', 'params': {'axis': 1}}
+        response = self.pipeline([step] * 4)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('steps', response.json())
+        self.assertFalse(ImageGeneration.objects.exists())
+        self.assertEqual(self.pipeline([step] * 3).status_code, 200)
+
+
+@override_settings(IMAGE_PROCESS_BUDGET={'MAX_PIXELS': 100, 'MAX_TILED_PIXELS': 10 ** 6, 'TILE_BYTES': 4096})
+class TiledProcessTestCase(SimpleTestCase):
+    # 每个动作的参数组合；没有 halo 的组合在超出预算时必须被拒绝，而不是分块
+    cases = {
+        'CROP': [{'width': 100, 'height': 80}],
+        'FLIP': [{'axis': axis} for axis in range(-3, 3)],
+        'ROTATE': [{'angle': 90}, {'angle': 30, 'expand': True}],
+        'BLUR': [{'mode': mode} for mode in ('mean', 'median', 'gaussian')],
+        'PIPELINE': [
+            {'steps': [{'action': 'blur', 'params': {'mode': 'median'}}, {'action': 'flip', 'params': {'axis': 1}}]},
+            {'steps': [{'action': 'blur', 'params': {'mode': 'mean'}}, {'action': 'flip', 'params': {'axis': -3}}]},
+        ],
+    }
+
+    def test_tiled_output_matches_untiled_for_every_action(self):
+        image = noise(320, 240)
+        for action, params_list in self.cases.items():
+            for params in params_list:
+                with self.subTest(action=action, params=params):
+                    serializer = get_process_serializer_class(action)(data=params, context={'action': action})
+                    serializer.is_valid(raise_exception=True)
+                    validated_data = serializer.validated_data
+                    if serializer.tile_halo(validated_data) is None:
+                        with self.assertRaises(ValidationError):
+                            serializer.check_budget((320, 240), validated_data)
+                        continue
+                    self.assertTrue(serializer.check_budget((320, 240), validated_data))
+                    expected = serializer.process(image.copy(), validated_data)
+                    tiled = serializer.process(image.copy(), validated_data, tiled=True)
+                    np.testing.assert_array_equal(tiled, expected)
+
+    def test_vertical_flip_is_not_tiled(self):
+        serializer = get_process_serializer_class('FLIP')(data={'axis': -3})
+        serializer.is_valid(raise_exception=True)
+        self.assertIsNone(serializer.tile_halo(serializer.validated_data))
+        self.assertEqual(
+            serializer.normalize_params(serializer.validated_data),
+            {'axis': 0, 'profile': settings.IMAGE_ENCODER_PROFILE}
+        )
+
+    def test_flip_axis_out_of_range_is_invalid(self):
+        for axis in (-4, 3):
+            serializer = get_process_serializer_class('FLIP')(data={'axis': axis})
+            self.assertFalse(serializer.is_valid())
+            self.assertIn('axis', serializer.errors)
+
+
+class ProcessParamsTestCase(SimpleTestCase):
+    def process(self, action, params, image):
+        serializer = get_process_serializer_class(action)(data=params)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+        return serializer.normalize_params(validated_data), serializer.process(image, validated_data)
+
+    def test_right_angle_rotation_swaps_the_shape(self):
+        image = noise(320, 240)
+        for angle, shape in ((90, (320, 240)), (180, (240, 320)), (270, (320, 240))):
+            for expand in (False, True):
+                with self.subTest(angle=angle, expand=expand):
+                    params, rotated = self.process('ROTATE', {'angle': angle, 'expand': expand}, image)
+                    self.assertEqual(rotated.shape[:2], shape)
+                    # 直角旋转与 expand 无关，缓存键相同
+                    self.assertEqual(
+                        params, {'angle': angle, 'expand': False, 'profile': settings.IMAGE_ENCODER_PROFILE}
+                    )
+                    np.testing.assert_array_equal(rotated, np.rot90(image, angle // 90))
+
+    def test_expand_enlarges_the_canvas(self):
+        image = noise(320, 240)
+        _, cropped = self.process('ROTATE', {'angle': 45}, image)
+        self.assertEqual(cropped.shape[:2], (240, 320))
+        params, expanded = self.process('ROTATE', {'angle': -315, 'expand': True}, image)
+        self.assertEqual(params, {'angle': 45, 'expand': True, 'profile': settings.IMAGE_ENCODER_PROFILE})
+        side = round((320 + 240) * np.sqrt(0.5))
+        self.assertEqual(expanded.shape[:2], (side, side))
+
+    def test_flip_axis_range(self):
+        image = noise(32, 24)
+        for axis in range(-3, 3):
+            with self.subTest(axis=axis):
+                params, flipped = self.process('FLIP', {'axis': axis}, image)
+                self.assertEqual(params, {'axis': axis % 3, 'profile': settings.IMAGE_ENCODER_PROFILE})
+                np.testing.assert_array_equal(flipped, np.flip(image, axis=axis % 3))
+        for axis in (-5, -4, 3, 4):
+            with self.subTest(axis=axis):
+                serializer = get_process_serializer_class('FLIP')(data={'axis': axis})
+                self.assertFalse(serializer.is_valid())
+                self.assertIn('axis', serializer.errors)
+
+    def test_blur_mode_must_be_a_choice(self):
+        for mode in ('box', '', 'MEAN', None):
+            with self.subTest(mode=mode):
+                serializer = get_process_serializer_class('BLUR')(data={'mode': mode})
+                self.assertFalse(serializer.is_valid())
+                self.assertIn('mode', serializer.errors)
+        self.assertFalse(get_process_serializer_class('BLUR')(data={}).is_valid())
+
+
+class EncoderTestCase(SimpleTestCase):
+    # 文件头 -> Pillow 识别的格式
+    pil_formats = {'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+    def test_jpeg_quality_is_estimated(self):
+        image = noise()
+        for quality in (50, 75, 95):
+            with self.subTest(quality=quality):
+                content, _ = encoders.encode_image(image, '.jpg', {'format': 'jpeg'}, default_quality=quality)
+                self.assertAlmostEqual(image_utils.estimate_jpeg_quality(BytesIO(content)), quality, delta=3)
+
+    def test_non_jpeg_quality_is_unknown(self):
+        content, _ = encoders.encode_image(noise(), '.png', {'format': 'png'})
+        self.assertIsNone(image_utils.estimate_jpeg_quality(BytesIO(content)))
+        self.assertIsNone(image_utils.estimate_jpeg_quality(BytesIO(b'not an image')))
+
+    def test_every_profile_sets_suffix_and_format(self):
+        image = noise()
+        for name, profile in settings.IMAGE_ENCODER_PROFILES.items():
+            for source in ('.jpg', '.png'):
+                with self.subTest(profile=name, source=source):
+                    # format 为 None 时沿用原图格式
+                    fmt = profile['format'] or encoders.SUFFIX_FORMATS[source]
+                    content, suffix = encoders.encode_image(image, source, profile, default_quality=90)
+                    self.assertEqual(suffix, encoders.FORMAT_SUFFIXES[fmt])
+                    with PILImage.open(BytesIO(content)) as img:
+                        self.assertEqual(img.format, self.pil_formats[fmt])
+
+                    output = BytesIO()
+                    pil_image = PILImage.fromarray(image[:, :, ::-1])
+                    self.assertEqual(encoders.save_pil_image(pil_image, output, profile, fmt, 90), fmt)
+                    output.seek(0)
+                    with PILImage.open(output) as img:
+                        self.assertEqual(img.format, self.pil_formats[fmt])
+
+    def test_profile_quality_overrides_the_source(self):
+        profile = settings.IMAGE_ENCODER_PROFILES['jpeg']
+        content, _ = encoders.encode_image(noise(), '.png', profile, default_quality=50)
+        self.assertAlmostEqual(image_utils.estimate_jpeg_quality(BytesIO(content)), profile['quality'], delta=3)
+
+
+class CpuBudgetTestCase(SimpleTestCase):
+    @override_settings(CPU_BUDGET={'CORES': 16, 'WORKERS': 2, 'THREADS': 0}, IMAGE_JOB_WORKERS=3, IMAGE_BATCH_WORKERS=0)
+    def test_cores_are_split_between_web_workers_and_their_pools(self):
+        # 2 个 web worker，各自 1 个主进程 + 3 个任务进程
+        self.assertEqual(cpu_budget.processes, 8)
+        self.assertEqual(cpu_budget.threads(), 2)
+        self.assertEqual(cpu_budget.threads('jobs'), 2)
+        self.assertEqual(cpu_budget.threads('batch'), 1)
+        self.assertEqual(workers.pool_size('jobs'), 3)
+        self.assertEqual(workers.pool_size('batch'), 8)
+        self.assertEqual(cpu_budget.worker_cores, 8)
+
+    @override_settings(CPU_BUDGET={'CORES': 2, 'WORKERS': 4, 'THREADS': 0}, IMAGE_JOB_WORKERS=2, IMAGE_BATCH_WORKERS=0)
+    def test_at_least_one_thread_and_process(self):
+        self.assertEqual(cpu_budget.threads(), 1)
+        self.assertEqual(workers.pool_size('batch'), 1)
+        self.assertEqual(cpu_budget.worker_cores, 1)
+
+
+class BoostTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lock_dir, ignore_errors=True)
+        budget = {
+            'CORES': 8, 'WORKERS': 2, 'THREADS': 0, 'BOOST_THREADS': 0,
+            'BOOST_MIN_PIXELS': 100, 'IDLE_LOAD': 0.25, 'LOCK_DIR': self.lock_dir,
+        }
+        override = override_settings(CPU_BUDGET=budget)
+        override.enable()
+        self.addCleanup(override.disable)
+        idle = mock.patch.object(cpu_budget, 'is_idle', return_value=True)
+        self.is_idle = idle.start()
+        self.addCleanup(idle.stop)
+
+    def test_boost_pool_uses_every_core(self):
+        self.assertEqual(workers.pool_size('boost'), 1)
+        self.assertEqual(cpu_budget.threads('boost'), 8)
+        # web worker 自身的线程数不受影响
+        self.assertEqual(cpu_budget.threads(), 1)
+
+    def test_lease_requires_a_large_request_on_an_idle_host(self):
+        with cpu_budget.boost(100) as boost:
+            self.assertTrue(boost)
+        with cpu_budget.boost(99) as boost:
+            self.assertFalse(boost)
+        self.is_idle.return_value = False
+        with cpu_budget.boost(100) as boost:
+            self.assertFalse(boost)
+
+    def test_one_lease_per_host(self):
+        with cpu_budget.boost(100) as boost:
+            self.assertTrue(boost)
+            # 其他进程持有锁时不能同时加速
+            with cpu_budget.boost(100) as other:
+                self.assertFalse(other)
+        with cpu_budget.boost(100) as boost:
+            self.assertTrue(boost)
+
+    def test_pool_processes_do_not_boost(self):
+        with mock.patch.object(cpu_budget, 'pool', 'jobs'), cpu_budget.boost(100) as boost:
+            self.assertFalse(boost)
+
+    def test_large_request_is_handed_to_the_boost_pool(self):
+        user = get_user_model().objects.create_user('boost', password='boost')
+        image = self.create_image(user)
+        with mock.patch('apiv1.workers.submit', side_effect=run_inline) as submit:
+            generation = run_process(image.pk, 'BLUR', {'mode': 'mean'})
+        self.assertEqual(submit.call_args.args[0], 'boost')
+        self.assertEqual(generation.processed_image.read()[:2], b'\xff\xd8')
+
+        ImageJob.objects.create(image=image, action='DETECT')
+        with mock.patch('apiv1.workers.submit') as submit:
+            run_process(image.pk, 'BLUR', {'mode': 'median'})
+        submit.assert_not_called()
+
+
+class AsyncViewTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('aio', password='aio')
+        self.user.user_permissions.add(
+            *Permission.objects.filter(codename__in=['change_image', 'change_imagegeneration'])
+        )
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.image = self.create_image(self.user)
+
+    async def test_not_found_names_the_model(self):
+        response = await self.async_client.put('/api/v1/aio/image/generation/9999/elevate/', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'detail': 'No ImageGeneration matches the given query.'})
+
+        response = await self.async_client.put(
+            '/api/v1/aio/image/image/9999/blur/', {'mode': 'mean'},
+            content_type='application/json', headers=self.headers
+        )
+        self.assertEqual(response.json(), {'detail': 'No Image matches the given query.'})
+
+    async def test_preview_is_returned_whole(self):
+        response = await self.async_client.put(
+            f'/api/v1/aio/image/image/{self.image.pk}/blur/preview/?max_edge=64', {'mode': 'mean'},
+            content_type='application/json', headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR).shape, (48, 64, 3))
+
+
+class PreviewViewTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('preview', password='preview')
+        self.user.user_permissions.add(Permission.objects.get(codename='change_image'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.image = self.create_image(self.user)
+
+    def preview(self, action, data, query='', image=None):
+        image = image or self.image
+        return self.client.put(f'/api/v1/image/image/{image.pk}/{action}/preview/{query}', data, format='json')
+
+    def decode(self, response):
+        return cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
+
+    def test_preview_returns_image_bytes(self):
+        png = self.create_image(self.user, name='png', suffix='.png')
+        files = sorted(Path(self.media_root).rglob('*'))
+        response = self.preview('blur', {'mode': 'mean'}, '?max_edge=64')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertEqual(self.decode(response).shape, (48, 64, 3))
+
+        # 参数按代理图缩放：320x240 上裁成 160x120，在 64 像素的代理图上为 32x24
+        response = self.preview('crop', {'width': 160, 'height': 120}, '?max_edge=64')
+        self.assertEqual(self.decode(response).shape, (24, 32, 3))
+
+        response = self.preview('flip', {'axis': 1, 'profile': 'webp'})
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(self.decode(response).shape, (240, 320, 3))
+
+        response = self.preview('rotate', {'angle': 90}, image=png)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(self.decode(response).shape, (320, 240, 3))
+
+        # 不建 ImageGeneration，也不写存储
+        self.assertFalse(ImageGeneration.objects.exists())
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.generation_num, 0)
+        self.assertEqual(sorted(Path(self.media_root).rglob('*')), files)
+
+    @override_settings(IMAGE_PREVIEW_MAX_EDGE=100)
+    def test_max_edge_is_capped(self):
+        response = self.preview('blur', {'mode': 'median'}, '?max_edge=1000')
+        self.assertEqual(self.decode(response).shape, (75, 100, 3))
+        self.assertEqual(self.preview('blur', {'mode': 'median'}, '?max_edge=8').status_code, 400)
+
+    def test_invalid_actions_are_rejected(self):
+        for action in ('sharpen', 'detect'):
+            with self.subTest(action=action):
+                self.assertEqual(self.preview(action, {}).status_code, 400)
+        self.assertEqual(self.preview('blur', {'mode': 'box'}).status_code, 400)
+        self.assertFalse(ImageGeneration.objects.exists())
+
+
+class ListImageGenerationTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('generations', password='generations')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.image = self.create_image(self.user)
+        self.generations = [
+            ImageGeneration.objects.create(
+                action=action, original_image=self.image, processed_image=f'generation{i}.jpg', width=1, height=1
+            )
+            for i, action in enumerate(['BLUR', 'FLIP', 'BLUR', 'CROP', 'BLUR'])
+        ]
+
+    def list(self, image=None, query=''):
+        return self.client.get(f'/api/v1/image/image/{(image or self.image).pk}/generations/{query}')
+
+    def ids(self, response):
+        return [generation['id'] for generation in response.json()['results']]
+
+    def test_action_filter(self):
+        blurs = [g.pk for g in reversed(self.generations) if g.action == 'BLUR']
+        self.assertEqual(self.ids(self.list(query='?action=blur')), blurs)
+        self.assertEqual(self.ids(self.list(query='?action=CROP')), [self.generations[3].pk])
+        self.assertEqual(self.ids(self.list(query='?action=rotate')), [])
+        self.assertEqual(self.ids(self.list()), [g.pk for g in reversed(self.generations)])
+
+    def test_pages_are_limited(self):
+        response = self.list(query='?page_size=2')
+        self.assertEqual(self.ids(response), [self.generations[4].pk, self.generations[3].pk])
+        ids = []
+        url = response.json()['next']
+        while url:
+            response = self.client.get(url)
+            ids += self.ids(response)
+            url = response.json()['next']
+        self.assertEqual(ids, [g.pk for g in reversed(self.generations[:3])])
+
+    @override_settings(IMAGE_NESTED_GENERATIONS=2)
+    def test_nested_generations_are_limited_and_counted(self):
+        data = self.client.get(f'/api/v1/image/image/{self.image.pk}/').json()
+        self.assertEqual([g['id'] for g in data['generations']], [self.generations[4].pk, self.generations[3].pk])
+        self.assertEqual(data['generation_count'], 5)
+
+    def test_other_users_images_are_not_found(self):
+        other = get_user_model().objects.create_user('other', password='other')
+        image = self.create_image(other)
+        ImageGeneration.objects.create(
+            action='BLUR', original_image=image, processed_image='other.jpg', width=1, height=1
+        )
+        self.assertEqual(self.list(image).status_code, 404)
+        self.assertEqual(self.list(image, '?action=blur').status_code, 404)
+        # 公开图片的处理记录可以查看
+        Image.objects.filter(pk=image.pk).update(is_public=True)
+        self.assertEqual(len(self.ids(self.list(image))), 1)
+
+
+class MetricsViewTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('metrics', password='metrics')
+        self.user.user_permissions.add(Permission.objects.get(codename='change_image'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.image = self.create_image(self.user)
+
+    def samples(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return {
+            (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(response.content.decode())
+            for sample in family.samples
+        }
+
+    def test_request_is_recorded(self):
+        key = ('image_operations_total', (('action', 'BLUR'), ('outcome', 'ok'), ('size', '0-0.5MP')))
+        before = self.samples().get(key, 0)
+        response = self.client.put(f'/api/v1/image/image/{self.image.pk}/blur/?async=0', {'mode': 'gaussian'})
+        self.assertEqual(response.status_code, 200)
+
+        samples = self.samples()
+        self.assertEqual(samples[key], before + 1)
+        labels = (('action', 'BLUR'), ('size', '0-0.5MP'))
+        self.assertGreater(samples[('image_operation_seconds_count', labels)], 0)
+        for stage in ('decode', 'process', 'encode', 'store', 'db'):
+            with self.subTest(stage=stage):
+                self.assertGreater(samples[('image_stage_seconds_count', (*labels, ('stage', stage)))], 0)
+        self.assertGreater(samples[('image_bytes_total', (('action', 'BLUR'), ('direction', 'written')))], 0)
+        self.assertEqual(samples[('image_operations_in_flight', (('action', 'BLUR'),))], 0)
+
+    @override_settings(METRICS={'ALLOWED_IPS': ['10.0.0.1']})
+    def test_other_addresses_are_forbidden(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_values_of_every_process_are_summed(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        # 每个进程（web worker、进程池）在导入 prometheus_client 前设置目录，各自写文件
+        script = (
+            'from common.utils import metrics\n'
+            'with metrics.track("crop", (4000, 3000)):\n'
+            '    with metrics.stage("decode"):\n'
+            '        metrics.count_bytes("read", 100)\n'
+        )
+        for _ in range(2):
+            subprocess.run(
+                [sys.executable, '-c', script], check=True, cwd=settings.BASE_DIR,
+                env={**os.environ, 'PROMETHEUS_MULTIPROC_DIR': path}
+            )
+        with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': path}):
+            samples = self.samples()
+        labels = (('action', 'CROP'), ('size', '8-24MP'))
+        self.assertEqual(samples[('image_operations_total', (*labels[:1], ('outcome', 'ok'), labels[1]))], 2)
+        self.assertEqual(samples[('image_stage_seconds_count', (*labels, ('stage', 'decode')))], 2)
+        self.assertEqual(samples[('image_bytes_total', (('action', 'CROP'), ('direction', 'read')))], 200)
+        # 已退出进程的 in-flight 值被移除
+        self.assertEqual(samples.get(('image_operations_in_flight', (('action', 'CROP'),)), 0), 0)
+
+
+class ContentAddressedStorageTestCase(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.storage = ContentAddressedStorage(location=self.root, blob_dir=Path(self.root, '.blobs'))
+
+    def blobs(self):
+        return [p for p in Path(self.root, '.blobs').rglob('*') if p.is_file()]
+
+    def test_identical_content_is_stored_once(self):
+        first = self.storage.save('image/a.JPG', ContentFile(b'same bytes'))
+        second = self.storage.save('image/b.jpg', ContentFile(b'same bytes'))
+        other = self.storage.save('image/c.jpg', ContentFile(b'other bytes'))
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.storage.content_hash_of(first), self.storage.content_hash_of(second))
+        self.assertTrue(first.endswith('.jpg'))
+        self.assertEqual(len(self.blobs()), 2)
+        self.assertEqual(self.storage.refcount(first), 2)
+        self.assertEqual(self.storage.refcount(other), 1)
+
+    def test_delete_keeps_shared_bytes_until_the_last_name(self):
+        first = self.storage.save('image/a.jpg', ContentFile(b'shared'))
+        linked = self.storage.link(first, directory='elevated')
+        self.assertTrue(linked.startswith('elevated/'))
+        self.assertEqual(self.storage.refcount(linked), 2)
+
+        self.storage.delete(first)
+        self.assertFalse(self.storage.exists(first))
+        self.assertEqual(self.storage.refcount(linked), 1)
+        with self.storage.open(linked, 'rb') as f:
+            self.assertEqual(f.read(), b'shared')
+        self.assertEqual(len(self.blobs()), 1)
+
+        self.storage.delete(linked)
+        self.assertEqual(self.blobs(), [])
+        # 重复删除不报错
+        self.storage.delete(linked)
+
+    def test_link_of_a_legacy_name_stores_it_by_content(self):
+        legacy = Path(self.root, 'image', 'legacy.jpg')
+        legacy.parent.mkdir(parents=True)
+        legacy.write_bytes(b'legacy')
+
+        linked = self.storage.link('image/legacy.jpg', directory='elevated')
+        self.assertEqual(self.storage.content_hash_of(linked), hashlib.sha256(b'legacy').hexdigest())
+        self.assertEqual(self.storage.refcount(linked), 1)
+        self.assertTrue(legacy.exists())
+
+
+class ElevatedFileLifetimeTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('elevate', password='elevate')
+        self.user.user_permissions.add(
+            *Permission.objects.filter(codename__in=['change_imagegeneration', 'delete_image'])
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.image = self.create_image(self.user)
+
+    def test_deleting_the_original_keeps_the_elevated_file(self):
+        generation = run_process(self.image.pk, 'FLIP', {'axis': 1})
+        with mock.patch.object(workers, 'submit'):
+            response = self.client.put(f'/api/v1/image/generation/{generation.pk}/elevate/')
+        elevated = Image.objects.get(pk=response.json()['id'])
+        self.assertNotEqual(elevated.image.name, generation.processed_image.name)
+        self.assertEqual(elevated.image.storage.refcount(elevated.image.name), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/v1/image/images/{self.image.pk}/delete/')
+        self.assertEqual(response.status_code, 204)
+        file_deleter.join()
+
+        self.assertFalse(elevated.image.storage.exists(generation.processed_image.name))
+        self.assertEqual(elevated.image.storage.refcount(elevated.image.name), 1)
+        with elevated.image.open('rb') as f:
+            self.assertEqual(cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_COLOR).shape, (240, 320, 3))
+
+
+class BackgroundFileDeleterTestCase(SimpleTestCase):
+    def test_retry_does_not_block_other_files(self):
+        deleted = []
+        failed = threading.Event()
+
+        class Storage:
+            @staticmethod
+            def delete(name):
+                if name == 'flaky' and not failed.is_set():
+                    failed.set()
+                    raise OSError('busy')
+                deleted.append((name, time.monotonic()))
+
+        deleter = BackgroundFileDeleter(storage=Storage(), retry_delay=0.5)
+        start = time.monotonic()
+        deleter.delete(['flaky'])
+        self.assertTrue(failed.wait(5))
+        deleter.delete(['a', 'b'])
+        deleter.join()
+
+        self.assertEqual([name for name, _ in deleted], ['a', 'b', 'flaky'])
+        # 重试等待期间其他文件立即删除
+        self.assertLess(deleted[1][1] - start, 0.4)
+        self.assertGreaterEqual(deleted[2][1] - start, 0.5)
+
+    def test_gives_up_after_max_retries(self):
+        storage = mock.Mock()
+        storage.delete.side_effect = OSError('gone')
+        deleter = BackgroundFileDeleter(storage=storage, max_retries=3, retry_delay=0.01)
+        with self.assertLogs('common.utils.deleter', 'ERROR'):
+            deleter.delete(['missing'])
+            deleter.join()
+        self.assertEqual(storage.delete.call_count, 3)
+
+
+class MultiIndexHashTableTestCase(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        base = rng.integers(0, 2 ** 64, 50, dtype=np.uint64)
+        # 每个基准哈希附近再放若干个随机翻转 1~MAX_DISTANCE 位的哈希
+        hashes = []
+        for value in base.tolist():
+            hashes.append(value)
+            for _ in range(8):
+                bits = rng.choice(64, rng.integers(1, MAX_DISTANCE + 1), replace=False)
+                hashes.append(value ^ sum(1 << int(bit) for bit in bits))
+        self.hashes = dict(enumerate(hashes, start=1))
+        self.queries = base.tolist()[:10]
+
+    def linear_scan(self, query, max_distance):
+        results = [(id_, bin(value ^ query).count('1')) for id_, value in self.hashes.items()]
+        return sorted(((id_, d) for id_, d in results if d <= max_distance), key=lambda item: (item[1], item[0]))
+
+    def assert_matches_linear_scan(self, table):
+        for query in self.queries:
+            for max_distance in range(MAX_DISTANCE + 1):
+                self.assertEqual(table.search(query, max_distance), self.linear_scan(query, max_distance))
+
+    def test_search_matches_linear_scan(self):
+        table = MultiIndexHashTable()
+        table.build(list(self.hashes), list(self.hashes.values()))
+        self.assertEqual(len(table), len(self.hashes))
+        self.assert_matches_linear_scan(table)
+
+    def test_add_and_remove_before_and_after_merge(self):
+        table = MultiIndexHashTable(merge_threshold=64)
+        for id_, value in self.hashes.items():
+            table.add(id_, value)
+        # 部分已合并，部分仍在缓冲区
+        self.assertTrue(len(table._ids) and table._pending)
+        self.assert_matches_linear_scan(table)
+
+        for id_ in list(self.hashes)[::3]:
+            table.remove(id_)
+            del self.hashes[id_]
+        self.assertEqual(len(table), len(self.hashes))
+        self.assert_matches_linear_scan(table)
+
+        # 重新加入已删除的条目，哈希值改变
+        table.add(1, self.queries[0])
+        self.hashes[1] = self.queries[0]
+        self.assert_matches_linear_scan(table)
+
+    def test_max_distance_is_bounded(self):
+        table = MultiIndexHashTable()
+        with self.assertRaises(ValueError):
+            table.search(0, MAX_DISTANCE + 1)
+
+    def test_signed_round_trip(self):
+        for value in (0, 1, 2 ** 63 - 1, 2 ** 63, 2 ** 64 - 1):
+            signed = to_signed(value)
+            self.assertTrue(-2 ** 63 <= signed < 2 ** 63)
+            self.assertEqual(to_unsigned(signed), value)
+
+
+class UserCacheTestCase(MediaMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        version_file = Path(self.media_root, 'auth_users.version')
+        settings_override = override_settings(
+            AUTH_USER_CACHE={'TTL': 60, 'MAX_ENTRIES': 100, 'VERSION_FILE': version_file}
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(user_cache.invalidate)
+        user_cache.invalidate()
+
+        self.user = get_user_model().objects.create_user('auth', password='auth')
+        self.user.user_permissions.add(Permission.objects.get(codename='change_image'))
+        self.image = self.create_image(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_invalidate_increments_the_shared_counter(self):
+        version = user_cache.version()
+        # 另一个进程中的缓存读写同一个版本文件
+        other = UserCache()
+        other.invalidate()
+        other.invalidate()
+        self.assertEqual(user_cache.version(), version + 2)
+
+    def test_invalidation_in_another_process_clears_the_cache(self):
+        version = user_cache.version()
+        self.assertIsNone(user_cache.get(self.user.pk, version))
+        user_cache.put(self.user.pk, self.user, version)
+        self.assertEqual(user_cache.get(self.user.pk).pk, self.user.pk)
+
+        UserCache().invalidate()
+        self.assertIsNone(user_cache.get(self.user.pk))
+
+    def test_user_loaded_across_an_invalidation_is_not_cached(self):
+        version = user_cache.version()
+        self.assertIsNone(user_cache.get(self.user.pk, version))
+        # 加载期间其他进程修改了权限
+        UserCache().invalidate()
+        user_cache.put(self.user.pk, self.user, version)
+        self.assertIsNone(user_cache.get(self.user.pk))
+
+    def test_permission_change_applies_to_the_next_request(self):
+        response = self.client.patch(f'/api/v1/image/image/{self.image.pk}/', {'name': 'first'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        # 令牌中的用户 id 为字符串
+        self.assertIsNotNone(user_cache.get(str(self.user.pk)))
+
+        self.user.user_permissions.clear()
+        response = self.client.patch(f'/api/v1/image/image/{self.image.pk}/', {'name': 'second'}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class UploadImagesTestCase(MediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('upload', password='upload')
+
+    def upload(self, suffix):
+        content = encode(cv2.resize(noise(40, 30), (1600, 1200), interpolation=cv2.INTER_CUBIC), suffix)
+        request = type('Request', (), {'user': self.user})
+        serializer = ImageCreateSerializer(
+            data={'name': 'upload', 'image': SimpleUploadedFile(f'upload{suffix}', content)},
+            context={'request': request},
+        )
+        with mock.patch('common.utils.image._open_image', wraps=image_utils._open_image) as open_image, \
+                mock.patch('apiv1.serializers.image.difference_hash', create=True) as difference_hash:
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        difference_hash.assert_not_called()
+        return serializer.save(), content, open_image.call_count
+
+    def test_upload_is_decoded_once(self):
+        for suffix in ('.png', '.jpg'):
+            with self.subTest(suffix=suffix):
+                image, content, decodes = self.upload(suffix)
+                self.assertEqual(decodes, 1)
+                self.assertEqual(sorted(image.derivatives, key=int), ['128', '512', '1024'])
+                with image.thumbnail.open('rb') as f:
+                    thumbnail = cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_COLOR)
+                self.assertEqual(thumbnail.shape, (128, 128, 3))
+                # 取自金字塔的哈希与从文件计算的哈希几乎一致
+                expected = to_signed(image_utils.difference_hash(BytesIO(content)))
+                self.assertLessEqual(bin(to_unsigned(image.phash) ^ to_unsigned(expected)).count('1'), 4)
@@ -2,5 +2,7 @@ from django.urls import path, include
 
 urlpatterns = [
     path('auth/', include('apiv1.urls.auth')),
-    path('image/', include('apiv1.urls.image'))
+    path('image/', include('apiv1.urls.image')),
+    path('aio/image/', include('apiv1.urls.aio')),
+    path('system/', include('apiv1.urls.system')),
 ]
@@ -0,0 +1,9 @@
+from django.urls import path
+from apiv1.views import aio as views
+
+urlpatterns = [
+    path('images/', views.ListCreateImageView.as_view(), name='aio_images'),
+    path('image/<int:pk>/<str:action>/', views.ProcessImageView.as_view(), name='aio_process_image'),
+    path('image/<int:pk>/<str:action>/preview/', views.PreviewImageView.as_view(), name='aio_preview_image'),
+    path('generation/<int:pk>/elevate/', views.ElevateGenerationImageView.as_view(), name='aio_elevate_image'),
+]
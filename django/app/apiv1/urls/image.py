@@ -4,8 +4,16 @@ from apiv1.views import image as views
 urlpatterns = [
     path('images/', views.ListCreateImageView.as_view(), name='images'),
     path('image/<int:pk>/', views.RetrieveUpdateDestroyImageView.as_view(), name='image'),
+    path('images/<int:pk>/similar/', views.ListSimilarImageView.as_view(), name='similar_images'),
     path('images/<comma_ints:image_ids>/delete/', views.DeleteMultiImageView.as_view(), name='delete_images'),
+    path(
+        'images/<comma_ints:image_ids>/<str:action>/', views.BatchProcessImageView.as_view(),
+        name='batch_process_images'
+    ),
 
+    path('image/<int:pk>/generations/', views.ListImageGenerationView.as_view(), name='image_generations'),
     path('image/<int:pk>/<str:action>/', views.ProcessImageView.as_view(), name='process_image'),
-    path('generation/<int:pk>/elevate/', views.ElevateGenerationImageView.as_view(), name='elevate_image')
+    path('image/<int:pk>/<str:action>/preview/', views.PreviewImageView.as_view(), name='preview_image'),
+    path('generation/<int:pk>/elevate/', views.ElevateGenerationImageView.as_view(), name='elevate_image'),
+    path('jobs/<int:pk>/', views.RetrieveImageJobView.as_view(), name='job'),
 ]
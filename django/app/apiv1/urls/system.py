@@ -0,0 +1,8 @@
+from django.urls import path
+
+from apiv1.views import system as views
+
+urlpatterns = [
+    path('cache/', views.ResultCacheStatsView.as_view(), name='result_cache_stats'),
+    path('cpu/', views.CpuBudgetView.as_view(), name='cpu_budget'),
+]
@@ -1,6 +1,151 @@
-from common.utils.image import resize_image
+import hashlib
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from common.utils import metrics
+from common.utils.encoders import encode_image
+from common.utils.hamming import to_signed
+from common.utils.image import (
+    build_image_pyramid, build_upload_images, difference_hash, resize_array, resize_image
+)
+from common.utils.shm_cache import SharedArrayCache
+
+_decoded_image_caches = {}
+
+
+def get_decoded_image_cache() -> SharedArrayCache:
+    """
+    The decoded-image cache of this deployment. Its shared memory is namespaced
+    by NAMESPACE, by default a hash of the database and media root, so other
+    deployments and test runs on the same host do not share entries.
+    """
+    namespace = settings.DECODED_IMAGE_CACHE['NAMESPACE']
+    if not namespace:
+        scope = f"{settings.DATABASES['default']['NAME']}|{settings.MEDIA_ROOT}"
+        namespace = hashlib.sha1(scope.encode()).hexdigest()[:12]
+    cache = _decoded_image_caches.get(namespace)
+    if cache is None:
+        cache = _decoded_image_caches.setdefault(namespace, SharedArrayCache(
+            f'image_processor_decoded_{namespace}',
+            max_bytes=settings.DECODED_IMAGE_CACHE['MAX_BYTES'],
+        ))
+    return cache
+
+
+def get_encoder_profile(name=None) -> dict:
+    """Encoder profile by name, the default output profile when no name is given"""
+    return settings.IMAGE_ENCODER_PROFILES[name or settings.IMAGE_ENCODER_PROFILE]
 
 
 def generate_thumbnail(image, width=128, height=128):
-    thumbnail = resize_image(image, width=width, height=height)
+    profile = get_encoder_profile(settings.IMAGE_THUMBNAIL_PROFILE)
+    thumbnail = resize_image(image, width=width, height=height, profile=profile)
     return thumbnail
+
+
+def encode_thumbnail(image, suffix, width=128, height=128):
+    """
+    generate_thumbnail for an image already decoded in memory, such as a
+    processing result; returns (bytes, suffix) like encode_image
+    """
+    profile = get_encoder_profile(settings.IMAGE_THUMBNAIL_PROFILE)
+    return encode_image(resize_array(image, width=width, height=height), suffix, profile)
+
+
+def ensure_generation_thumbnail(generation):
+    """
+    Thumbnail and perceptual hash of a generation, computed from its file and
+    saved for older rows, which were stored without them.
+    """
+    if generation.thumbnail and generation.phash is not None:
+        return generation
+    with generation.processed_image.open('rb') as f:
+        generation.thumbnail = generate_thumbnail(f)
+        f.seek(0)
+        generation.phash = to_signed(difference_hash(f))
+    generation.save(update_fields=['thumbnail', 'phash'])
+    return generation
+
+
+def generate_derivatives(image, sizes=None):
+    """
+    {long edge: file} for each configured derivative size smaller than the image
+    """
+    if sizes is None:
+        sizes = settings.IMAGE_DERIVATIVE_SIZES
+    return build_image_pyramid(image, sizes, profile=get_encoder_profile(settings.IMAGE_DERIVATIVE_PROFILE))
+
+
+def generate_upload_images(image, sizes=None):
+    """
+    (derivatives, thumbnail, signed perceptual hash) of an upload, decoded once:
+    generate_derivatives, generate_thumbnail and difference_hash in one pass
+    """
+    if sizes is None:
+        sizes = settings.IMAGE_DERIVATIVE_SIZES
+    derivatives, thumbnail, phash = build_upload_images(
+        image, sizes, thumbnail_size=(128, 128),
+        profile=get_encoder_profile(settings.IMAGE_DERIVATIVE_PROFILE),
+        thumbnail_profile=get_encoder_profile(settings.IMAGE_THUMBNAIL_PROFILE),
+    )
+    return derivatives, thumbnail, to_signed(phash)
+
+
+def link_file(field_file, directory=None) -> str:
+    """
+    A name of its own for the bytes of ``field_file``, for a second row that
+    references the same content; the name is shared when the storage cannot link.
+    """
+    storage = field_file.storage
+    if hasattr(storage, 'link'):
+        return storage.link(field_file.name, directory=str(directory) if directory else None)
+    return field_file.name
+
+
+def read_image(instance, flags=cv2.IMREAD_COLOR):
+    """
+    Decode an Image's file, going through the decoded-image cache shared by all workers
+    """
+    key = None
+    if settings.DECODED_IMAGE_CACHE['ENABLED']:
+        name = instance.image.name
+        mtime = instance.image.storage.get_modified_time(name).timestamp()
+        key = f'{instance.pk}:{name}:{mtime}:{flags}'
+        image = get_decoded_image_cache().get(key)
+        if image is not None:
+            return image
+
+    # 读取文件内容为字节流
+    with metrics.stage('read'), instance.image.open('rb') as f:
+        image_bytes = f.read()
+    metrics.count_bytes('read', len(image_bytes))
+    # 将字节流解码为图像
+    with metrics.stage('decode'):
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), flags)
+    if key is not None and image is not None:
+        get_decoded_image_cache().put(key, image)
+    return image
+
+
+def decode_proxy(instance, max_edge):
+    """
+    Decode a copy of an Image whose long edge is at most ``max_edge``.
+
+    Uses the smallest stored derivative that is still large enough, and only
+    falls back to the original when there is none.
+    """
+    sizes = sorted(int(size) for size in instance.derivatives if int(size) >= max_edge)
+    if sizes:
+        with instance.image.storage.open(instance.derivatives[str(sizes[0])], 'rb') as f:
+            image = cv2.imdecode(np.frombuffer(f.read(), dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        image = read_image(instance)
+
+    height, width = image.shape[:2]
+    scale = max_edge / max(width, height)
+    if scale < 1:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return image
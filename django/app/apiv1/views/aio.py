@@ -0,0 +1,255 @@
+"""
+Async versions of the image endpoints, mounted under /api/v1/aio/.
+
+The DRF views run on Django's single thread-sensitive executor, so under
+uvicorn one slow OpenCV request holds up every other request of the worker.
+These views run on the event loop:
+
+- database access goes through the async queryset API (aget, acreate, afirst,
+  async iteration);
+- decoding, processing, encoding and storage writes go to a bounded thread
+  executor, so a worker serves many slow requests concurrently and answers
+  503 instead of queueing without limit.
+
+Request and response bodies match the DRF views; the list endpoint pages
+with ``?before=<id>`` instead of an opaque cursor.
+"""
+import json
+import mimetypes
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, NotAuthenticated, ParseError, PermissionDenied, ValidationError
+from rest_framework.permissions import DjangoModelPermissions
+
+from apiv1.cache import result_cache
+from apiv1.cpu import cpu_budget
+from apiv1.pagination import IdCursorPagination
+from apiv1.serializers import image as image_serializers
+from apiv1.utils import ensure_generation_thumbnail, link_file
+from apiv1.workers import enqueue_job
+from common.backends import CustomJWTAuthentication
+from common.utils.aio import BoundedExecutor, Overloaded
+from main.models.image import IMAGE_PATH, Image, ImageGeneration
+from main.models.job import ImageJob
+
+# OpenCV、Pillow 与文件读写释放 GIL，线程池即可并行；每个 web worker 一个，默认只用本 worker 分到的核数
+cpu_executor = BoundedExecutor(
+    'image-cpu',
+    max_workers=settings.ASYNC_EXECUTOR['CPU_THREADS'] or cpu_budget.worker_cores,
+    max_pending=settings.ASYNC_EXECUTOR['MAX_PENDING'],
+)
+io_executor = BoundedExecutor(
+    'image-io',
+    max_workers=settings.ASYNC_EXECUTOR['IO_THREADS'],
+    max_pending=settings.ASYNC_EXECUTOR['MAX_PENDING'],
+)
+
+
+def _in_thread(fn, *args):
+    """Run fn in an executor thread that may use the ORM, closing the thread's connection afterwards"""
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
+
+def _visible_images(user):
+    return Image.objects.filter(Q(user=user) | Q(is_public=True)).select_related('user')
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """
+    JWT authentication, DjangoModelPermissions and DRF-style error responses for async handlers
+    """
+    model = None
+    authentication = CustomJWTAuthentication()
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            await self.initial(request)
+            handler = getattr(self, request.method.lower(), None)
+            if request.method.lower() not in self.http_method_names or handler is None:
+                return await self.http_method_not_allowed(request, *args, **kwargs)
+            return await handler(request, *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return JsonResponse(detail, status=exc.status_code, safe=False)
+        except Http404 as exc:
+            # aget_object_or_404 的消息带有模型名，与 DRF 视图一致
+            return JsonResponse({'detail': str(exc) or 'Not found.'}, status=404)
+        except Overloaded as exc:
+            return JsonResponse({'detail': str(exc)}, status=503, headers={'Retry-After': '1'})
+
+    async def initial(self, request):
+        result = await self.authentication.aauthenticate(request)
+        if result is None:
+            raise NotAuthenticated()
+        request.user, request.auth = result
+        perms = DjangoModelPermissions().get_required_permissions(request.method, self.model)
+        if perms and not await sync_to_async(request.user.has_perms)(perms):
+            raise PermissionDenied()
+
+    @staticmethod
+    def json_body(request) -> dict:
+        if not request.body:
+            return {}
+        try:
+            return json.loads(request.body)
+        except ValueError as e:
+            raise ParseError(f'JSON parse error - {e}')
+
+
+class ListCreateImageView(AsyncAPIView):
+    model = Image
+
+    async def get(self, request):
+        try:
+            page_size = min(
+                int(request.GET.get('page_size', IdCursorPagination.page_size)), IdCursorPagination.max_page_size
+            )
+            before = int(request.GET['before']) if 'before' in request.GET else None
+        except ValueError:
+            raise ValidationError('page_size and before must be integers.')
+
+        queryset = _visible_images(request.user).order_by('-id')
+        if before is not None:
+            queryset = queryset.filter(id__lt=before)
+        images = [image async for image in queryset[:page_size + 1]]
+
+        next_url = None
+        if len(images) > page_size:
+            images = images[:page_size]
+            params = request.GET.copy()
+            params['before'] = images[-1].id
+            next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+        data = image_serializers.ImageSerializer(images, many=True, context={'request': request}).data
+        return JsonResponse({'next': next_url, 'results': data})
+
+    async def post(self, request):
+        def parse():
+            # 解析 multipart 需要读取整个请求体
+            data = request.POST.copy()
+            data.update(request.FILES)
+            return data
+
+        serializer = image_serializers.ImageCreateSerializer(
+            data=await io_executor.run(parse), context={'request': request}
+        )
+
+        def create():
+            # 缩略图、衍生图与内容哈希在校验中生成，保存时写入存储
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return serializer.data
+
+        data = await cpu_executor.run(_in_thread, create)
+        job = await ImageJob.objects.acreate(action='DETECT', image=serializer.instance, user=request.user)
+        enqueue_job(job.pk)
+        return JsonResponse(data, status=201)
+
+
+class ProcessImageView(AsyncAPIView):
+    model = Image
+
+    async def get_serializer(self, request, pk, action):
+        serializer_class = image_serializers.get_process_serializer_class(action)
+        instance = await aget_object_or_404(_visible_images(request.user), pk=pk)
+        serializer = serializer_class(
+            instance, data=self.json_body(request), context={'request': request, 'action': action.upper()}
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+    async def put(self, request, pk, action):
+        serializer = await self.get_serializer(request, pk, action)
+        instance = serializer.instance
+        if self.is_async(request):
+            job = await ImageJob.objects.acreate(
+                action=action.upper(), params=serializer.validated_data, image=instance, user=request.user
+            )
+            enqueue_job(job.pk)
+            data = image_serializers.ImageJobSerializer(job, context={'request': request}).data
+            return JsonResponse(data, status=202)
+
+        if result_cache.enabled and instance.content_hash and serializer.produces_image:
+            # 命中缓存时只需一次查询，不占用线程
+            cache_key = result_cache.make_key(
+                instance.content_hash, action, serializer.normalize_params(serializer.validated_data)
+            )
+            generation = await ImageGeneration.objects.filter(original_image=instance, cache_key=cache_key).afirst()
+            if generation is not None:
+                result_cache.record('hits')
+                generation.original_image = instance
+                return JsonResponse(serializer.to_representation(generation))
+
+        def save():
+            serializer.save()
+            return serializer.data
+
+        return JsonResponse(await cpu_executor.run(_in_thread, save))
+
+    @staticmethod
+    def is_async(request):
+        value = request.GET.get('async')
+        if value is None:
+            return settings.IMAGE_PROCESS_ASYNC
+        return value.lower() in ('1', 'true', 'yes')
+
+
+class PreviewImageView(ProcessImageView):
+
+    async def put(self, request, pk, action):
+        serializer = await self.get_serializer(request, pk, action)
+        if not serializer.produces_image:
+            raise ValidationError(f'The action {action} does not support preview.')
+        params = image_serializers.PreviewParamsSerializer(data=request.GET)
+        params.is_valid(raise_exception=True)
+        max_edge = params.validated_data.get('max_edge', settings.IMAGE_PREVIEW_MAX_EDGE)
+
+        content, suffix = await cpu_executor.run(
+            serializer.preview, serializer.instance, serializer.validated_data, max_edge
+        )
+        content_type, _ = mimetypes.guess_type(f'preview{suffix}')
+        response = HttpResponse(content, content_type=content_type or 'application/octet-stream')
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
+class ElevateGenerationImageView(AsyncAPIView):
+    model = ImageGeneration
+
+    async def put(self, request, pk):
+        instance = await aget_object_or_404(ImageGeneration, pk=pk)
+        if not instance.thumbnail or instance.phash is None:
+            # 旧的处理结果没有缩略图，补算一次
+            await cpu_executor.run(_in_thread, ensure_generation_thumbnail, instance)
+
+        def link():
+            return (
+                link_file(instance.processed_image, IMAGE_PATH / 'image'),
+                link_file(instance.thumbnail, IMAGE_PATH / 'thumbnail'),
+            )
+
+        name, thumbnail = await io_executor.run(link)
+        image = await Image.objects.acreate(
+            name=f'{instance.action.lower().capitalize()}_{instance.id}',
+            user=request.user,
+            image=name,
+            generated_action=instance.action,
+            phash=instance.phash,
+            thumbnail=thumbnail,
+            width=instance.width,
+            height=instance.height
+        )
+        job = await ImageJob.objects.acreate(action='DETECT', image=image, user=request.user)
+        enqueue_job(job.pk)
+        return JsonResponse(image_serializers.ImageSerializer(image, context={'request': request}).data)
@@ -1,32 +1,49 @@
-import time
+import mimetypes
+import uuid
+from concurrent.futures import FIRST_COMPLETED, wait
+from pathlib import Path
 
-from django.db.models import Q
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import HttpResponse
+from django.utils import timezone
 from rest_framework import generics, status
+from rest_framework.generics import get_object_or_404
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from apiv1.serializers import image as image_serializers
-from apiv1.utils import generate_thumbnail
+from apiv1.utils import ensure_generation_thumbnail, link_file
 from apiv1.views.mixin import MultipleObjectsIdentityCheckMixin
+from apiv1.cache import get_content_hash, result_cache
+from apiv1.pagination import IdCursorPagination
+from apiv1.similar import get_phash, similar_index
+from apiv1.workers import expire_stale_jobs, pool_size, process_image_bytes, submit, submit_job
+from common.utils.deleter import file_deleter
 from common.views.mixins import CreateMixin, UpdateMixin
-from main.models.image import Image, ImageGeneration
+from main.models.image import IMAGE_PATH, Image, ImageGeneration
+from main.models.job import ImageJob
 
 
 class ListCreateImageView(CreateMixin, generics.ListCreateAPIView):
     queryset = Image.objects.all()
     create_serializer_class = image_serializers.ImageCreateSerializer
     serializer_class = image_serializers.ImageSerializer
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
-        time.sleep(1)
         return Image.objects.filter(
             Q(user=self.request.user) | Q(is_public=True)
-        )
+        ).select_related('user')
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
+        # 上传后在后台完成检测，读取 detected_info 时不再需要解码
+        submit_job(ImageJob.objects.create(action='DETECT', image=serializer.instance, user=request.user))
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -40,23 +57,89 @@ class RetrieveUpdateDestroyImageView(UpdateMixin, generics.RetrieveUpdateDestroy
         return super().perform_destroy(instance)
 
 
+class ListSimilarImageView(generics.RetrieveAPIView):
+    """
+    Visible images whose perceptual hash is within ``?distance=`` bits of the image, nearest first
+    """
+    queryset = Image.objects.all()
+
+    def get_queryset(self):
+        return Image.objects.filter(Q(user=self.request.user) | Q(is_public=True))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        params = image_serializers.SimilarParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        distance = params.validated_data.get('distance', settings.SIMILAR_IMAGES['DEFAULT_DISTANCE'])
+        limit = params.validated_data.get('limit', settings.SIMILAR_IMAGES['MAX_RESULTS'])
+
+        matches = [(id_, d) for id_, d in similar_index.search(get_phash(instance), distance) if id_ != instance.id]
+        results = []
+        # 其他用户的私有图片与已删除的图片由数据库过滤，按距离顺序分段取够 limit 条
+        for start in range(0, len(matches), limit * 4):
+            chunk = matches[start:start + limit * 4]
+            images = self.get_queryset().select_related('user').in_bulk([id_ for id_, _ in chunk])
+            results.extend({'distance': d, 'image': images[id_]} for id_, d in chunk if id_ in images)
+            if len(results) >= limit:
+                break
+        serializer = image_serializers.SimilarImageSerializer(
+            results[:limit], many=True, context=self.get_serializer_context()
+        )
+        return Response(data={'results': serializer.data})
+
+
+class ListImageGenerationView(generics.ListAPIView):
+    queryset = ImageGeneration.objects.all()
+    serializer_class = image_serializers.ImageGenerationSerializer
+    pagination_class = IdCursorPagination
+
+    def get_queryset(self):
+        image = get_object_or_404(
+            Image.objects.filter(Q(user=self.request.user) | Q(is_public=True)),
+            pk=self.kwargs['pk']
+        )
+        queryset = ImageGeneration.objects.filter(original_image=image)
+        action = self.request.query_params.get('action')
+        if action:
+            queryset = queryset.filter(action=action.upper())
+        return queryset
+
+
 class DeleteMultiImageView(MultipleObjectsIdentityCheckMixin, generics.DestroyAPIView):
     queryset = Image.objects.all()
 
     def get_queryset(self):
         image_ids = self.kwargs['image_ids']
-        return Image.objects.filter(id__in=image_ids)
+        return self.check_objects_identity(Image.objects.filter(id__in=image_ids))
 
     def delete(self, request, *args, **kwargs):
         images = self.get_queryset()
-        for image in images:
-            # Delete associated files
-            image.image.delete(save=False)
-            image.thumbnail.delete(save=False)
-            for gen in image.generations.all():
-                gen.processed_image.delete(save=False)
-
-        images.delete()
+        # 先收集所有关联文件，数据库记录在一个事务中删除，文件交给后台线程删除
+        names = []
+        shareable = []
+        for image_name, thumbnail_name, derivatives in images.values_list('image', 'thumbnail', 'derivatives'):
+            names.extend([image_name, thumbnail_name, *derivatives.values()])
+            shareable.append(image_name)
+        generation_names = []
+        generations = ImageGeneration.objects.filter(original_image__in=images)
+        for processed_name, thumbnail_name in generations.values_list('processed_image', 'thumbnail'):
+            generation_names.append(processed_name)
+            if thumbnail_name:
+                names.append(thumbnail_name)
+        names.extend(generation_names)
+        shareable.extend(generation_names)
+        with transaction.atomic():
+            images.delete()
+            # 旧数据中，提升得到的图片与处理结果共用同一个文件名，仍被其他记录引用的文件不能删除
+            in_use = set()
+            for start in range(0, len(shareable), 500):
+                chunk = shareable[start:start + 500]
+                in_use.update(Image.objects.filter(image__in=chunk).values_list('image', flat=True))
+                in_use.update(
+                    ImageGeneration.objects.filter(processed_image__in=chunk).values_list('processed_image', flat=True)
+                )
+            names = [name for name in names if name not in in_use]
+            transaction.on_commit(lambda: file_deleter.delete(names))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -64,12 +147,7 @@ class ProcessImageView(generics.UpdateAPIView):
     queryset = Image.objects.all()
 
     def get_serializer_class(self):
-        action: str = self.kwargs['action']
-        try:
-            cls = getattr(image_serializers, f'{action.capitalize()}ImageSerializer')
-        except AttributeError:
-            raise ValidationError(f'The action {action} is not valid.')
-        return cls
+        return image_serializers.get_process_serializer_class(self.kwargs['action'])
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -80,29 +158,187 @@ class ProcessImageView(generics.UpdateAPIView):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
-        try:
-            serializer.is_valid(raise_exception=True)
-        except Exception as e:
-            print(e)
-            raise
+        serializer.is_valid(raise_exception=True)
+        if self.is_async():
+            job = ImageJob.objects.create(
+                action=self.kwargs['action'].upper(),
+                params=serializer.validated_data,
+                image=instance,
+                user=request.user,
+            )
+            submit_job(job)
+            data = image_serializers.ImageJobSerializer(job, context=self.get_serializer_context()).data
+            return Response(data=data, status=status.HTTP_202_ACCEPTED)
         serializer.save()
         return Response(data=serializer.data)
 
+    def is_async(self):
+        value = self.request.query_params.get('async')
+        if value is None:
+            return settings.IMAGE_PROCESS_ASYNC
+        return value.lower() in ('1', 'true', 'yes')
+
+
+class PreviewImageView(ProcessImageView):
+    """
+    低分辨率预览：返回处理后的图片字节流，不写存储、不建 ImageGeneration
+    """
+
+    def put(self, request, *args, **kwargs):
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data)
+        if not serializer.produces_image:
+            raise ValidationError(f'The action {self.kwargs["action"]} does not support preview.')
+        serializer.is_valid(raise_exception=True)
+        params = image_serializers.PreviewParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        max_edge = params.validated_data.get('max_edge', settings.IMAGE_PREVIEW_MAX_EDGE)
+
+        content, suffix = serializer.preview(instance, serializer.validated_data, max_edge)
+        content_type, _ = mimetypes.guess_type(f'preview{suffix}')
+        response = HttpResponse(content, content_type=content_type or 'application/octet-stream')
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
+class BatchProcessImageView(generics.UpdateAPIView):
+    """
+    对多张图片执行同一个处理动作，像素计算分发到按 CPU 核数配置的进程池
+    """
+    queryset = Image.objects.all()
+
+    def get_queryset(self):
+        return Image.objects.filter(id__in=self.kwargs['image_ids'], user=self.request.user)
+
+    def put(self, request, *args, **kwargs):
+        action: str = self.kwargs['action']
+        serializer_class = image_serializers.get_process_serializer_class(action)
+        if not serializer_class.produces_image:
+            raise ValidationError(f'The action {action} does not support batch processing.')
+        serializer = serializer_class(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        action = action.upper()
+
+        images = {image.id: image for image in self.get_queryset()}
+        results = {image_id: {'image': image_id, 'error': 'Not found.'}
+                   for image_id in self.kwargs['image_ids'] if image_id not in images}
+
+        # 同时交给进程池的图片数有上限，web worker 只持有这些图片的字节
+        max_in_flight = settings.IMAGE_BATCH_MAX_IN_FLIGHT or pool_size('batch')
+        pending = {}
+        cached = {}
+        generations = []
+        saved_names = []
+
+        def collect(futures):
+            for future in futures:
+                image_id, cache_key = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    results[image_id] = {'image': image_id, 'error': getattr(e, 'detail', None) or str(e)}
+                    continue
+                generations.append(self._store(images[image_id], action, params, cache_key, result, saved_names))
+
+        for image_id, image in images.items():
+            cache_key = ''
+            if result_cache.enabled:
+                cache_key = result_cache.make_key(get_content_hash(image), action, serializer.normalize_params(params))
+                generation = ImageGeneration.objects.filter(original_image=image, cache_key=cache_key).first()
+                if generation is not None:
+                    result_cache.record('hits')
+                    cached[image_id] = generation
+                    continue
+                result_cache.record('misses')
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            with image.image.open('rb') as f:
+                image_bytes = f.read()
+            suffix = Path(image.image.name).suffix
+            pending[submit('batch', process_image_bytes, action, image_bytes, suffix, params)] = (image_id, cache_key)
+            del image_bytes
+        collect(list(pending))
+
+        try:
+            with transaction.atomic():
+                ImageGeneration.objects.bulk_create(generations)
+                Image.objects.filter(id__in=[g.original_image_id for g in generations]).update(
+                    generation_num=F('generation_num') + 1, updated_at=timezone.now()
+                )
+        except Exception:
+            # 记录没有写入，已保存的文件不再被引用
+            file_deleter.delete(saved_names)
+            raise
+
+        context = self.get_serializer_context()
+        for generation in [*generations, *cached.values()]:
+            results[generation.original_image_id] = {
+                'image': generation.original_image_id,
+                'generation': image_serializers.ImageGenerationSerializer(generation, context=context).data,
+            }
+        return Response(data={'results': [results[image_id] for image_id in self.kwargs['image_ids']]})
+
+    @staticmethod
+    def _store(image, action, params, cache_key, result, saved_names) -> ImageGeneration:
+        """Save the files of a pool result; the returned generation is not saved yet."""
+        content, suffix, width, height, thumbnail, thumbnail_suffix, phash = result
+        field = ImageGeneration._meta.get_field('processed_image')
+        thumbnail_field = ImageGeneration._meta.get_field('thumbnail')
+        filename = f'{action.lower()}_{uuid.uuid4().hex}{suffix}'
+        processed_name = field.storage.save(
+            field.generate_filename(ImageGeneration(action=action), filename), ContentFile(content)
+        )
+        saved_names.append(processed_name)
+        thumbnail_name = thumbnail_field.storage.save(
+            thumbnail_field.generate_filename(None, f'thumbnail{thumbnail_suffix}'), ContentFile(thumbnail)
+        )
+        saved_names.append(thumbnail_name)
+        return ImageGeneration(
+            action=action,
+            original_image=image,
+            processed_image=processed_name,
+            thumbnail=thumbnail_name,
+            phash=phash,
+            params=params,
+            cache_key=cache_key,
+            width=width,
+            height=height,
+        )
+
+
+class RetrieveImageJobView(generics.RetrieveAPIView):
+    queryset = ImageJob.objects.all()
+    serializer_class = image_serializers.ImageJobSerializer
+
+    def get_queryset(self):
+        return ImageJob.objects.filter(user=self.request.user).select_related('generation')
+
+    def get_object(self):
+        job = super().get_object()
+        if job.status == ImageJob.RUNNING and expire_stale_jobs(ImageJob.objects.filter(pk=job.pk)):
+            job.refresh_from_db()
+        return job
+
 
 class ElevateGenerationImageView(generics.UpdateAPIView):
     queryset = ImageGeneration.objects.all()
 
     def put(self, request, *args, **kwargs):
-        instance: ImageGeneration = self.get_object()
-        thumbnail = generate_thumbnail(instance.processed_image.file)
+        instance: ImageGeneration = ensure_generation_thumbnail(self.get_object())
+        # 只写元数据：新图片的文件和缩略图是处理结果文件的链接，删除任一方不影响另一方
         image = Image.objects.create(
             name=f'{instance.action.lower().capitalize()}_{instance.id}',
             user=self.request.user,
-            image=instance.processed_image,
+            phash=instance.phash,
+            image=link_file(instance.processed_image, IMAGE_PATH / 'image'),
             generated_action=instance.action,
-            thumbnail=thumbnail,
+            thumbnail=link_file(instance.thumbnail, IMAGE_PATH / 'thumbnail'),
             width=instance.width,
             height=instance.height
         )
+        # 与上传的图片一样在后台完成检测
+        submit_job(ImageJob.objects.create(action='DETECT', image=image, user=request.user))
         data = image_serializers.ImageSerializer(image).data
         return Response(data)
@@ -13,10 +13,12 @@ class SingleObjectIdentityCheckMixin:
 class MultipleObjectsIdentityCheckMixin:
     user_field = 'user'
 
+    def check_objects_identity(self, queryset):
+        # 一次聚合查询：是否存在不属于当前用户的对象（包括 user 为空的对象）
+        if hasattr(queryset.model, self.user_field):
+            if queryset.exclude(**{self.user_field: self.request.user}).exists():
+                raise PermissionDenied
+        return queryset
+
     def get_queryset(self):
-        queryset = super().get_queryset()
-        for obj in queryset:
-            if hasattr(obj, self.user_field):
-                if getattr(obj, self.user_field) != self.request.user:
-                    raise PermissionDenied
-        return super().get_queryset()
+        return self.check_objects_identity(super().get_queryset())
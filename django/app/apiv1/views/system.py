@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views import View
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from apiv1.cache import result_cache
+from apiv1.cpu import cpu_budget
+from apiv1.utils import get_decoded_image_cache
+from common.utils import metrics
+
+
+class ResultCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @staticmethod
+    def get(request):
+        data = result_cache.stats()
+        data['decoded_images'] = get_decoded_image_cache().stats()
+        return Response(data)
+
+
+class CpuBudgetView(APIView):
+    """Effective OpenCV/BLAS thread configuration of the worker serving the request"""
+    permission_classes = [IsAdminUser]
+
+    @staticmethod
+    def get(request):
+        from apiv1.views.aio import cpu_executor, io_executor
+
+        data = cpu_budget.stats()
+        data['async_executors'] = [cpu_executor.stats(), io_executor.stats()]
+        return Response(data)
+
+
+class MetricsView(View):
+    """
+    Prometheus metrics of all worker processes, for scrapers on the allowed addresses only
+    """
+
+    @staticmethod
+    def get(request):
+        if request.META.get('REMOTE_ADDR') not in settings.METRICS['ALLOWED_IPS']:
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE_LATEST)
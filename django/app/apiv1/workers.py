@@ -0,0 +1,218 @@
+"""
+Local process pools for image work done off the request thread.
+
+``jobs``: the ``main_image_job`` table is the queue, the web worker only
+inserts a row and hands its id to the pool, the pool process claims and runs it.
+``recover_jobs`` runs when a web worker starts: it hands over the jobs still
+queued and fails the ones left running by a process that is gone.
+
+``batch``: pure pixel work (decode, process, encode) for batch requests; the
+web worker keeps all storage and database access.
+"""
+import logging
+import multiprocessing
+import os
+from datetime import timedelta
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import django
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from apiv1.cpu import cpu_budget
+from apiv1.utils import encode_thumbnail
+from common.utils.hamming import to_signed
+from common.utils.image import array_difference_hash, estimate_jpeg_quality
+
+__all__ = [
+    'get_executor',
+    'pool_size',
+    'shutdown',
+    'enqueue_job',
+    'submit_job',
+    'jobs_pending',
+    'run_job',
+    'expire_stale_jobs',
+    'recover_jobs',
+    'process_image_bytes',
+]
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+
+
+def _init_worker(name):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_processor_backend.settings')
+    django.setup()
+    cpu_budget.apply(pool=name)
+
+
+def pool_size(name) -> int:
+    return cpu_budget.pool_size(name)
+
+
+def get_executor(name='jobs') -> ProcessPoolExecutor:
+    if name not in _executors:
+        # spawn 而不是 fork：子进程不继承父进程的数据库连接和 OpenCV 线程池
+        _executors[name] = ProcessPoolExecutor(
+            max_workers=pool_size(name),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(name,),
+        )
+    return _executors[name]
+
+
+def submit(name, fn, *args):
+    try:
+        return get_executor(name).submit(fn, *args)
+    except BrokenProcessPool:
+        # 子进程异常退出后进程池不可再用，重建一次
+        _executors.pop(name, None)
+        return get_executor(name).submit(fn, *args)
+
+
+def shutdown(wait=True):
+    """Stop the pools of this process, e.g. before a multiprocessing child exits and joins its children"""
+    while _executors:
+        _, executor = _executors.popitem()
+        executor.shutdown(wait=wait)
+
+
+def _job_done(job_id, future):
+    error = future.exception()
+    if error is None:
+        return
+    # 进程池子进程异常退出（BrokenProcessPool 等），run_job 没有机会记录结果
+    from main.models import ImageJob
+
+    logger.error('Image job %s failed in the pool: %r', job_id, error)
+    try:
+        ImageJob.objects.filter(pk=job_id, status__in=(ImageJob.QUEUED, ImageJob.RUNNING)).update(
+            status=ImageJob.FAILED, error=str(error) or type(error).__name__, finished_at=timezone.now()
+        )
+    except DatabaseError:
+        logger.exception('Failed to mark image job %s as failed', job_id)
+    finally:
+        # 回调在进程池的管理线程中执行，关闭该线程的连接
+        connection.close()
+
+
+def enqueue_job(job_id):
+    """Hand a committed ImageJob to the pool; failures are logged, the job stays queued"""
+    try:
+        future = submit('jobs', run_job, job_id)
+    except Exception:
+        # 事务已提交，请求不能再失败；任务保持 queued，由 recover_jobs 重新入队
+        logger.exception('Failed to submit image job %s', job_id)
+        return
+    future.add_done_callback(lambda f: _job_done(job_id, f))
+
+
+def submit_job(job):
+    """Hand a saved ImageJob to the pool once the surrounding transaction commits."""
+    transaction.on_commit(lambda: enqueue_job(job.pk))
+
+
+def jobs_pending() -> bool:
+    """Whether any image job is queued or running on this database"""
+    from main.models import ImageJob
+
+    return ImageJob.objects.filter(status__in=(ImageJob.QUEUED, ImageJob.RUNNING)).exists()
+
+
+def expire_stale_jobs(queryset=None) -> int:
+    """
+    Fail the jobs of ``queryset`` (all jobs by default) that have been running
+    for longer than IMAGE_JOB_TIMEOUT, left behind by a process that exited.
+    """
+    from main.models import ImageJob
+
+    if queryset is None:
+        queryset = ImageJob.objects.all()
+    now = timezone.now()
+    return queryset.filter(
+        status=ImageJob.RUNNING, started_at__lt=now - timedelta(seconds=settings.IMAGE_JOB_TIMEOUT)
+    ).update(status=ImageJob.FAILED, error='Timed out.', finished_at=now)
+
+
+def recover_jobs():
+    """
+    Expire stale running jobs and hand the queued ones to this process's pool.
+
+    Every web worker does this when it starts; a job submitted by several
+    workers still runs once, the first pool process to claim it wins.
+    """
+    from main.models import ImageJob
+
+    try:
+        expired = expire_stale_jobs()
+        if expired:
+            logger.warning('%d stale image job(s) marked as failed', expired)
+        for job_id in ImageJob.objects.filter(status=ImageJob.QUEUED).values_list('pk', flat=True):
+            enqueue_job(job_id)
+    except DatabaseError:
+        logger.exception('Failed to recover image jobs')
+    finally:
+        close_old_connections()
+
+
+def run_job(job_id):
+    # 子进程在 initializer 中才完成 django.setup()，模型需延迟导入
+    from apiv1.serializers.image import get_process_serializer_class
+    from main.models import ImageGeneration, ImageJob
+
+    close_old_connections()
+    try:
+        claimed = ImageJob.objects.filter(pk=job_id, status=ImageJob.QUEUED).update(
+            status=ImageJob.RUNNING, started_at=timezone.now()
+        )
+        if not claimed:
+            return
+        job = ImageJob.objects.select_related('image').get(pk=job_id)
+        try:
+            serializer_class = get_process_serializer_class(job.action)
+            serializer = serializer_class(job.image, context={'action': job.action})
+            result = serializer.update(job.image, job.params)
+        except Exception as e:
+            job.status = ImageJob.FAILED
+            job.error = str(e)
+        else:
+            job.status = ImageJob.DONE
+            if isinstance(result, ImageGeneration):
+                job.generation = result
+        job.finished_at = timezone.now()
+        # 超时已被标记为失败的任务不再覆盖
+        ImageJob.objects.filter(pk=job.pk, status=ImageJob.RUNNING).update(
+            status=job.status, error=job.error, generation=job.generation, finished_at=job.finished_at
+        )
+    finally:
+        close_old_connections()
+
+
+def process_image_bytes(action, image_bytes, suffix, params):
+    """
+    Decode, process and encode one image; returns (encoded bytes, suffix, width,
+    height, thumbnail bytes, thumbnail suffix, signed perceptual hash)
+    """
+    from apiv1.serializers.image import get_process_serializer_class
+
+    serializer = get_process_serializer_class(action)(context={'action': action.upper()})
+    with Image.open(BytesIO(image_bytes)) as img:
+        size = img.size
+    tiled = serializer.check_budget(size, params, suffix=suffix)
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), serializer.decode_flags(size, params))
+    umat_image = serializer.process(image, params, tiled=tiled)
+    height, width = umat_image.shape[:2]
+    quality = estimate_jpeg_quality(BytesIO(image_bytes))
+    content, suffix = serializer.encode(umat_image, suffix, profile=params.get('profile'), quality=quality)
+    thumbnail, thumbnail_suffix = encode_thumbnail(umat_image, suffix)
+    phash = to_signed(array_difference_hash(umat_image, draft=suffix in ('.jpg', '.jpeg')))
+    return content, suffix, width, height, thumbnail, thumbnail_suffix, phash
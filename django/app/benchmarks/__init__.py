@@ -0,0 +1,32 @@
+"""
+Benchmarks for the image processor backend.
+
+Each module is runnable from django/app, e.g. ``python -m benchmarks.image_list``,
+and works against a throwaway SQLite database and media root.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+
+def setup_django(work_dir=None) -> Path:
+    """
+    Point Django at a temporary database and media root and create the tables
+    """
+    work_dir = Path(work_dir or tempfile.mkdtemp(prefix='image_processor_bench_'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_processor_backend.settings')
+    os.environ.setdefault('DJANGO_SECRET_KEY', 'benchmark')
+    os.environ.setdefault('DJANGO_TRUSTED_ORIGINS', 'http://localhost')
+    os.environ['DB_ENGINE'] = 'django.db.backends.sqlite3'
+    os.environ['DB_NAME'] = str(work_dir / 'db.sqlite3')
+    os.environ['DJANGO_MEDIA_ROOT'] = str(work_dir / 'media')
+
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.core.management import call_command
+    # 迁移文件不随仓库提交（部署时生成），这里直接按模型建表
+    settings.MIGRATION_MODULES = {'main': None, 'apiv1': None}
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    return work_dir
@@ -0,0 +1,71 @@
+"""
+Output encoder profiles: bytes and encode time per profile.
+
+Two synthetic sources: a smooth photo-like image with sensor noise, and a
+flat-colour screenshot with text-like edges.
+
+    python -m benchmarks.encoders --width 2048 --height 1536
+"""
+import argparse
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks import setup_django
+
+
+def photo(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        127 + 100 * np.sin(x / width * 6 + c) * np.cos(y / height * 4 - c)
+        for c in (0.0, 1.0, 2.0)
+    ], axis=-1)
+    noise = rng.normal(0, 6, base.shape)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def screenshot(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 245, np.uint8)
+    cv2.rectangle(image, (0, 0), (width, 48), (60, 60, 60), -1)
+    for row in range(80, height - 20, 24):
+        length = int(rng.integers(width // 4, width - 40))
+        cv2.putText(image, 'lorem ipsum dolor sit amet ' * (length // 200 + 1), (20, row),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (30, 30, 30), 1, cv2.LINE_AA)
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=2048)
+    parser.add_argument('--height', type=int, default=1536)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.conf import settings
+
+    from common.utils.encoders import encode_image
+
+    sources = {
+        'photo': (photo(args.width, args.height), '.jpg'),
+        'screenshot': (screenshot(args.width, args.height), '.png'),
+    }
+    print(f'{"source":<11} {"profile":<10} {"format":<6} {"KiB":>9} {"encode (ms)":>12}')
+    for source, (image, suffix) in sources.items():
+        for name, profile in settings.IMAGE_ENCODER_PROFILES.items():
+            samples = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                content, out_suffix = encode_image(image, suffix, profile, default_quality=90)
+                samples.append(time.perf_counter() - start)
+            print(f'{source:<11} {name:<10} {out_suffix:<6} {len(content) / 1024:>9.1f} '
+                  f'{statistics.median(samples) * 1000:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
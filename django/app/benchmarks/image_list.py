@@ -0,0 +1,132 @@
+"""
+Image list endpoint: before/after keyset pagination.
+
+before: PageNumberPagination over Q(user) | Q(is_public), no composite
+        indexes, no select_related (the old ListCreateImageView)
+after:  ListCreateImageView as shipped (-id cursor, composite indexes,
+        select_related('user'))
+
+    python -m benchmarks.image_list --rows 1000000
+"""
+import argparse
+import statistics
+import time
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks import setup_django
+
+
+def seed(rows, users, public_ratio, batch_size=20000):
+    from django.contrib.auth import get_user_model
+    from main.models import Image
+
+    user_model = get_user_model()
+    owners = user_model.objects.bulk_create(
+        [user_model(username=f'user{i}') for i in range(users)]
+    )
+    public_every = max(1, round(1 / public_ratio)) if public_ratio else 0
+    for start in range(0, rows, batch_size):
+        Image.objects.bulk_create([
+            Image(
+                name=f'image {i}',
+                user=owners[i % users],
+                image=f'image/image/{i}.jpg',
+                thumbnail=f'image/thumbnail/{i}.jpg',
+                is_public=bool(public_every) and i % public_every == 0,
+                width=1024,
+                height=768,
+            )
+            for i in range(start, min(start + batch_size, rows))
+        ])
+    return owners[0]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--public-ratio', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.db import connection
+    from django.db.models import Q
+    from rest_framework import generics
+    from rest_framework.pagination import Cursor, PageNumberPagination
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from apiv1.pagination import IdCursorPagination
+    from apiv1.serializers.image import ImageSerializer
+    from apiv1.views.image import ListCreateImageView
+    from main.models import Image
+
+    class LegacyListView(generics.ListAPIView):
+        serializer_class = ImageSerializer
+        pagination_class = PageNumberPagination
+
+        def get_queryset(self):
+            return Image.objects.filter(Q(user=self.request.user) | Q(is_public=True))
+
+    print(f'seeding {args.rows} images ...', flush=True)
+    start = time.perf_counter()
+    user = seed(args.rows, args.users, args.public_ratio)
+    print(f'seeded in {time.perf_counter() - start:.1f}s')
+
+    factory = APIRequestFactory()
+    visible = Image.objects.filter(Q(user=user) | Q(is_public=True))
+    page_size = IdCursorPagination.page_size
+    last_page = visible.count() // page_size
+    depths = sorted({1, 10, 1000, max(1, last_page * 9 // 10)})
+
+    def call(view, params):
+        request = factory.get('/api/v1/image/images/', params)
+        force_authenticate(request, user)
+        response = view(request)
+        response.render()
+        assert response.status_code == 200, response.content
+
+    def cursor_params(depth):
+        if depth == 1:
+            return {}
+        position = visible.order_by('-id').values_list('id', flat=True)[(depth - 1) * page_size - 1]
+        paginator = IdCursorPagination()
+        paginator.base_url = 'http://testserver/'
+        url = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=str(position)))
+        return {'cursor': parse_qs(urlparse(url).query)['cursor'][0]}
+
+    indexes = Image._meta.indexes
+    with connection.schema_editor() as editor:
+        for index in indexes:
+            editor.remove_index(Image, index)
+    connection.cursor().execute('ANALYZE')
+    before = {depth: timed(lambda: call(LegacyListView.as_view(), {'page': depth}), args.repeat) for depth in depths}
+
+    with connection.schema_editor() as editor:
+        for index in indexes:
+            editor.add_index(Image, index)
+    connection.cursor().execute('ANALYZE')
+    view = ListCreateImageView.as_view()
+    after = {}
+    for depth in depths:
+        params = cursor_params(depth)
+        after[depth] = timed(lambda: call(view, params), args.repeat)
+
+    print(f'\n{"page":>8} {"before (ms)":>12} {"after (ms)":>12} {"speedup":>8}')
+    for depth in depths:
+        print(f'{depth:>8} {before[depth] * 1000:>12.2f} {after[depth] * 1000:>12.2f} '
+              f'{before[depth] / after[depth]:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""
+Load test against the ASGI application, in process, without a network.
+
+Seeds a throwaway SQLite database and media root with a user and images,
+logs in through TokenObtainPairView, then runs ``--concurrency`` clients
+that replay a weighted mix of list, upload, process, detect and elevate
+calls for ``--duration`` seconds. Each ``--workers`` process stands in for
+one uvicorn worker (its own event loop, thread pools and connections), all
+sharing the database and media root, and clients are split across them.
+
+Several concurrency levels are run one after another; the level where
+requests/s stops growing while latency climbs is the saturation point.
+
+    python -m benchmarks.loadtest --workers 5 --concurrency 1 5 10 20 40 --duration 20
+    python -m benchmarks.loadtest --mix list=1 --concurrency 8 32 128
+    python -m benchmarks.loadtest --api aio --mix process=3,elevate=1
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import statistics
+import time
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlencode
+
+USERNAME = 'loadtest'
+PASSWORD = 'loadtest-password'
+DEFAULT_MIX = 'list=40,upload=5,process=35,detect=10,elevate=10'
+PREFIXES = {
+    'sync': '/api/v1/image',
+    'aio': '/api/v1/aio/image',
+}
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in ('list', 'upload', 'process', 'detect', 'elevate'):
+            raise argparse.ArgumentTypeError(f'unknown endpoint {name!r}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+class Client:
+    """Calls the ASGI application the way uvicorn would, one request at a time"""
+
+    def __init__(self, app):
+        self.app = app
+        self.token = None
+
+    async def request(self, method, path, body=b'', content_type='application/json', query=None):
+        headers = [
+            (b'host', b'localhost'),
+            (b'content-type', content_type.encode()),
+            (b'content-length', str(len(body)).encode()),
+        ]
+        if self.token:
+            headers.append((b'authorization', f'Bearer {self.token}'.encode()))
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': urlencode(query or {}).encode(),
+            'headers': headers,
+            'client': ('127.0.0.1', 50000),
+            'server': ('localhost', 9005),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        disconnected = asyncio.Event()
+        status, chunks = None, []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            disconnected.set()
+        return status, b''.join(chunks)
+
+    async def json(self, method, path, data=None, query=None):
+        status, body = await self.request(method, path, json.dumps(data or {}).encode(), query=query)
+        try:
+            return status, json.loads(body) if body else None
+        except ValueError:
+            return status, None
+
+    async def login(self):
+        status, data = await self.json(
+            'POST', '/api/v1/auth/token/obtain/', {'username': USERNAME, 'password': PASSWORD}
+        )
+        if status != 200:
+            raise RuntimeError(f'login failed: {status} {data}')
+        self.token = data['access']
+
+
+class Scenario:
+    """The calls of the mix; each returns the HTTP status, or None when it cannot run yet"""
+
+    def __init__(self, client, prefix, image_ids, upload_bytes, rng):
+        self.client = client
+        self.prefix = prefix
+        self.image_ids = image_ids
+        self.generation_ids = []
+        self.upload_bytes = upload_bytes
+        self.rng = rng
+
+    async def list(self):
+        status, _ = await self.client.json('GET', f'{self.prefix}/images/', query={'page_size': 20})
+        return status
+
+    async def upload(self):
+        boundary = f'loadtest{self.rng.getrandbits(64):x}'
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="name"\r\n\r\nloadtest\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="is_public"\r\n\r\ntrue\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="loadtest.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'
+        ).encode() + self.upload_bytes + f'\r\n--{boundary}--\r\n'.encode()
+        status, _ = await self.client.request(
+            'POST', f'{self.prefix}/images/', body, content_type=f'multipart/form-data; boundary={boundary}'
+        )
+        return status
+
+    def process_params(self):
+        # 参数随机化，避免全部命中结果缓存
+        action = self.rng.choice(('blur', 'rotate', 'crop', 'flip'))
+        if action == 'blur':
+            return action, {'mode': self.rng.choice(('mean', 'median', 'gaussian'))}
+        if action == 'rotate':
+            return action, {'angle': self.rng.randrange(1, 360)}
+        if action == 'crop':
+            return action, {'width': self.rng.randrange(200, 1200), 'height': self.rng.randrange(200, 900)}
+        return action, {'axis': self.rng.choice((0, 1))}
+
+    async def process(self):
+        action, params = self.process_params()
+        image_id = self.rng.choice(self.image_ids)
+        status, data = await self.client.json(
+            'PUT', f'{self.prefix}/image/{image_id}/{action}/', params, query={'async': 0}
+        )
+        if status == 200 and data:
+            self.generation_ids.append(data['id'])
+        return status
+
+    async def detect(self):
+        image_id = self.rng.choice(self.image_ids)
+        status, _ = await self.client.json(
+            'PUT', f'{self.prefix}/image/{image_id}/detect/', {'refresh': True}, query={'async': 0}
+        )
+        return status
+
+    async def elevate(self):
+        if not self.generation_ids:
+            return None
+        generation_id = self.rng.choice(self.generation_ids)
+        status, _ = await self.client.json('PUT', f'{self.prefix}/generation/{generation_id}/elevate/')
+        return status
+
+
+async def run_clients(app, prefix, clients, duration, mix, image_ids, upload_bytes, worker_index):
+    client = Client(app)
+    await client.login()
+    names, weights = list(mix), list(mix.values())
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    deadline = time.perf_counter() + duration
+
+    async def loop(index):
+        rng = random.Random(worker_index * 1000 + index)
+        scenario = Scenario(client, prefix, image_ids, upload_bytes, rng)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = await getattr(scenario, name)()
+            except Exception:
+                status = 599
+            if status is None:
+                # 还没有可提升的处理结果
+                await asyncio.sleep(0)
+                continue
+            samples[name].append(time.perf_counter() - start)
+            if status >= 400:
+                errors[name] += 1
+
+    await asyncio.gather(*(loop(i) for i in range(clients)))
+    return {'samples': dict(samples), 'errors': dict(errors)}
+
+
+def worker(work_dir, api, clients, duration, mix, image_ids, upload_bytes, worker_index, barrier, queue):
+    from benchmarks import setup_django
+    setup_django(work_dir)
+
+    import logging
+    # 4xx/5xx 计入错误率，不逐条打印
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    from apiv1 import workers
+    from image_processor_backend.asgi import application
+
+    barrier.wait()
+    result = asyncio.run(
+        run_clients(application, PREFIXES[api], clients, duration, mix, image_ids, upload_bytes, worker_index)
+    )
+    # 等待上传触发的检测任务完成，进程池退出后本进程才能退出
+    workers.shutdown()
+    queue.put(result)
+
+
+def seed(images, megapixels):
+    """Create the user and images; returns (image ids, bytes used for uploads)"""
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.models import Permission
+    from django.core.files.base import ContentFile
+
+    from apiv1.utils import generate_thumbnail
+    from benchmarks.suite import synthetic
+    from main.models import Image
+
+    # 普通用户：权限检查走 DjangoModelPermissions，与生产一致
+    user = get_user_model().objects.create_user(USERNAME, password=PASSWORD)
+    user.user_permissions.set(Permission.objects.filter(content_type__app_label='main'))
+
+    data, suffix, _ = synthetic('jpeg', megapixels)
+    ids = []
+    for i in range(images):
+        image = ContentFile(data, name=f'seed_{i}{suffix}')
+        ids.append(Image.objects.create(
+            name=f'seed_{i}', user=user, is_public=True, image=image, thumbnail=generate_thumbnail(image)
+        ).id)
+    upload_bytes, _, _ = synthetic('jpeg', min(megapixels, 2))
+    return ids, upload_bytes
+
+
+def report(level, duration, results):
+    samples, errors = defaultdict(list), defaultdict(int)
+    for result in results:
+        for name, values in result['samples'].items():
+            samples[name].extend(values)
+        for name, count in result['errors'].items():
+            errors[name] += count
+
+    total = sum(len(values) for values in samples.values())
+    total_errors = sum(errors.values())
+    summary = {'concurrency': level, 'requests_per_s': total / duration, 'endpoints': {}}
+    print(f'\nconcurrency {level}: {total / duration:.1f} req/s, '
+          f'{total_errors / total if total else 0:.1%} errors')
+    print(f'  {"endpoint":<9} {"count":>6} {"req/s":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8} '
+          f'{"errors":>7}')
+    for name in sorted(samples):
+        values = samples[name]
+        stats = {
+            'count': len(values),
+            'requests_per_s': len(values) / duration,
+            'p50_ms': statistics.median(values) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': max(values) * 1000,
+            'error_rate': errors[name] / len(values),
+        }
+        summary['endpoints'][name] = stats
+        print(f'  {name:<9} {stats["count"]:>6} {stats["requests_per_s"]:>7.1f} {stats["p50_ms"]:>8.1f} '
+              f'{stats["p95_ms"]:>8.1f} {stats["p99_ms"]:>8.1f} {stats["max_ms"]:>8.1f} {stats["error_rate"]:>7.1%}')
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=1, help='processes, like uvicorn --workers')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='clients in total, per level')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per level')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'endpoint weights, default {DEFAULT_MIX}')
+    parser.add_argument('--api', choices=list(PREFIXES), default='sync', help='DRF views or the async views')
+    parser.add_argument('--images', type=int, default=20, help='images seeded before the run')
+    parser.add_argument('--megapixels', type=float, default=2, help='size of the seeded images')
+    parser.add_argument('--output', help='save the summary as JSON')
+    args = parser.parse_args()
+
+    from benchmarks import setup_django
+    work_dir = setup_django()
+    image_ids, upload_bytes = seed(args.images, args.megapixels)
+    print(f'work dir {work_dir}: {len(image_ids)} images of {args.megapixels:g} MP, {args.workers} worker(s), '
+          f'api {args.api}, mix {args.mix}')
+
+    ctx = multiprocessing.get_context('spawn')
+    summaries = []
+    for level in args.concurrency:
+        workers = min(args.workers, level)
+        barrier = ctx.Barrier(workers)
+        queue = ctx.Queue()
+        processes = [
+            ctx.Process(target=worker, args=(
+                work_dir, args.api, level // workers + (i < level % workers), args.duration, args.mix,
+                image_ids, upload_bytes, i, barrier, queue,
+            ))
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        results = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        summaries.append(report(level, args.duration, results))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({'args': {
+            'workers': args.workers, 'duration': args.duration, 'mix': args.mix, 'api': args.api,
+            'images': args.images, 'megapixels': args.megapixels,
+        }, 'levels': summaries}, indent=2))
+        print(f'\nsaved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Similar image search: multi-index hash table vs a linear popcount scan.
+
+Random 64-bit hashes stand in for the library, with a few near-duplicates
+planted around each query hash. Results of both methods are compared.
+
+    python -m benchmarks.similar --images 1000000
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from common.utils.hamming import MAX_DISTANCE, MultiIndexHashTable, popcount
+
+
+def plant(rng, hashes, query, count, max_bits):
+    """Overwrite ``count`` random rows with hashes within max_bits of query"""
+    rows = rng.choice(len(hashes), count, replace=False)
+    for row in rows:
+        bits = rng.choice(64, rng.integers(0, max_bits + 1), replace=False)
+        hashes[row] = query ^ np.uint64(sum(1 << int(b) for b in bits))
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    ids = np.arange(1, args.images + 1, dtype=np.int64)
+    hashes = rng.integers(0, 2 ** 64, args.images, dtype=np.uint64)
+    queries = [hashes[i] for i in rng.choice(args.images, args.queries, replace=False)]
+    for query in queries:
+        plant(rng, hashes, query, 20, MAX_DISTANCE)
+
+    table = MultiIndexHashTable()
+    start = time.perf_counter()
+    table.build(ids, hashes)
+    print(f'build: {time.perf_counter() - start:.2f} s for {args.images} hashes')
+
+    # 增量插入走缓冲区
+    for i in range(1000):
+        table.add(args.images + 1 + i, int(rng.integers(0, 2 ** 64, dtype=np.uint64)))
+
+    print(f'{"distance":>8} {"index ms":>9} {"scan ms":>8} {"matches":>8}')
+    for distance in (0, 4, 8, 10, MAX_DISTANCE):
+        index_ms, scan_ms, matches = [], [], 0
+        for query in queries:
+            found, elapsed = timed(lambda: table.search(int(query), distance), 5)
+            index_ms.append(elapsed)
+            expected, elapsed = timed(lambda: ids[popcount(hashes ^ query) <= distance], 1)
+            scan_ms.append(elapsed)
+            assert {id_ for id_, _ in found if id_ <= args.images} == set(expected.tolist())
+            matches += len(found)
+        print(f'{distance:>8} {statistics.median(index_ms):>9.2f} {statistics.median(scan_ms):>8.1f} '
+              f'{matches / len(queries):>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
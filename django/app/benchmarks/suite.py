@@ -0,0 +1,297 @@
+"""
+Benchmark suite: resize_image, generate_thumbnail, every _process
+implementation and the full BaseProcessSerializer.update path, on synthetic
+JPEG (photo), PNG (screenshot) and RGBA PNG inputs of several sizes.
+
+Each input runs in a fresh process with the result and decoded-image caches
+off. Per case it reports p50/p95 latency, throughput in megapixels per
+second and the peak RSS growth of the case (VmHWM is reset before each one).
+
+    python -m benchmarks.suite run --output base.json
+    python -m benchmarks.suite run --sizes 2 12 --formats jpeg --output head.json
+    python -m benchmarks.suite compare base.json head.json
+
+``compare`` exits with status 1 when a case got slower or used more memory
+than the threshold allows.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+
+from benchmarks.encoders import photo, screenshot
+from benchmarks.thumbnails import peak_rss_mib
+
+SIZES = (0.3, 2, 12, 24)
+FORMATS = ('jpeg', 'png', 'rgba')
+
+# (动作, 参数)：_process 与完整 update 路径使用相同的参数
+ACTIONS = {
+    'crop': ('CROP', {'width': 800, 'height': 600}),
+    'flip': ('FLIP', {'axis': 1}),
+    'rotate_90': ('ROTATE', {'angle': 90}),
+    'rotate_30': ('ROTATE', {'angle': 30, 'expand': True}),
+    'blur_mean': ('BLUR', {'mode': 'mean'}),
+    'blur_median': ('BLUR', {'mode': 'median'}),
+    'blur_gaussian': ('BLUR', {'mode': 'gaussian'}),
+    'pipeline': ('PIPELINE', {'steps': [
+        {'action': 'rotate', 'params': {'angle': 90}},
+        {'action': 'blur', 'params': {'mode': 'gaussian'}},
+    ]}),
+}
+
+# 耗时差异小于该值时视为噪声
+MIN_TIME_DELTA_MS = 2
+MIN_MEMORY_DELTA_MIB = 8
+
+
+def synthetic(fmt, megapixels):
+    """Encoded bytes, suffix and size of a synthetic 3:2 input"""
+    import cv2
+
+    height = int(math.sqrt(megapixels * 1e6 * 2 / 3))
+    width = height * 3 // 2
+    if fmt == 'jpeg':
+        _, encoded = cv2.imencode('.jpg', photo(width, height), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        suffix = '.jpg'
+    elif fmt == 'png':
+        _, encoded = cv2.imencode('.png', screenshot(width, height))
+        suffix = '.png'
+    else:
+        # 照片叠加从左到右渐变的透明度
+        alpha = np.broadcast_to(np.linspace(0, 255, width, dtype=np.uint8), (height, width))
+        _, encoded = cv2.imencode('.png', np.dstack((photo(width, height), alpha)))
+        suffix = '.png'
+    return encoded.tobytes(), suffix, (width, height)
+
+
+def reset_peak_rss():
+    # 写入 5 将本进程的 VmHWM 重置为当前 RSS（Linux 4.0+）
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def current_rss_mib():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q))
+
+
+def measure(fn, repeat, megapixels):
+    fn()  # 预热：导入、OpenCV 线程池、数据库连接
+    reset_peak_rss()
+    base_rss = current_rss_mib()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    p50 = percentile(samples, 50)
+    return {
+        'p50_ms': round(p50, 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'ops_per_s': round(1000 / p50, 2) if p50 else None,
+        'mp_per_s': round(megapixels * 1000 / p50, 2) if p50 else None,
+        'peak_mib': round(peak_rss_mib() - base_rss, 1),
+        'repeat': repeat,
+    }
+
+
+def run_input(fmt, megapixels, repeat, cases, queue):
+    # 缓存会让重复执行直接命中，基准中关闭
+    os.environ['IMAGE_RESULT_CACHE_ENABLED'] = '0'
+    os.environ['DECODED_IMAGE_CACHE_ENABLED'] = '0'
+    from benchmarks import setup_django
+    setup_django()
+
+    import cv2
+    from django.contrib.auth import get_user_model
+    from django.core.files.base import ContentFile
+
+    from apiv1.serializers.image import DetectImageSerializer, get_process_serializer_class
+    from apiv1.utils import generate_thumbnail
+    from common.utils.image import resize_image
+    from main.models import Image
+
+    data, suffix, size = synthetic(fmt, megapixels)
+    pixels = size[0] * size[1] / 1e6
+    user = get_user_model().objects.create(username='benchmark')
+    instance = Image.objects.create(name='benchmark', user=user, image=ContentFile(data, name=f'bench{suffix}'))
+
+    def source():
+        f = BytesIO(data)
+        f.name = f'bench{suffix}'
+        return f
+
+    decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+    def process(action, params):
+        serializer = get_process_serializer_class(action)(data=params, context={'action': action})
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+        # 部分实现原地写入，每次使用解码结果的副本
+        return lambda: serializer._process(decoded.copy(), validated_data)
+
+    def update(action, params):
+        def fn():
+            serializer = get_process_serializer_class(action)(
+                instance, data=params, context={'action': action, 'request': None}
+            )
+            serializer.is_valid(raise_exception=True)
+            serializer.update(instance, serializer.validated_data)
+        return fn
+
+    def detect():
+        serializer = DetectImageSerializer(instance, data={'refresh': True}, context={'action': 'DETECT'})
+        serializer.is_valid(raise_exception=True)
+        serializer.update(instance, serializer.validated_data)
+
+    benchmarks = {
+        'resize_image': lambda: resize_image(source(), width=1024),
+        'generate_thumbnail': lambda: generate_thumbnail(source()),
+        'update/detect': detect,
+    }
+    for name, (action, params) in ACTIONS.items():
+        benchmarks[f'process/{name}'] = process(action, params)
+        benchmarks[f'update/{name}'] = update(action, params)
+
+    results = {}
+    for name, fn in benchmarks.items():
+        if cases and not any(name.startswith(case) for case in cases):
+            continue
+        results[name] = measure(fn, repeat, pixels)
+    queue.put({'size': list(size), 'bytes': len(data), 'results': results})
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    import cv2
+    import PIL
+
+    revision = git_revision()
+    report = {
+        'meta': {
+            'revision': revision,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'pillow': PIL.__version__,
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+        },
+        'results': {},
+    }
+    # 固定 glibc 的 mmap 阈值：大块内存释放后立即归还，峰值 RSS 只反映当前用例
+    os.environ.setdefault('MALLOC_MMAP_THRESHOLD_', str(1024 * 1024))
+    ctx = multiprocessing.get_context('spawn')
+    for fmt in args.formats:
+        for megapixels in args.sizes:
+            label = f'{fmt}-{megapixels:g}MP'
+            # 大图减少重复次数，p95 仍至少有 5 个样本
+            repeat = max(5, round(args.repeat * min(1, 2 / megapixels)))
+            queue = ctx.Queue()
+            process = ctx.Process(target=run_input, args=(fmt, megapixels, repeat, args.cases, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            width, height = result['size']
+            print(f'\n{label}: {width}x{height}, {result["bytes"] / 2 ** 20:.1f} MiB')
+            print(f'  {"case":<24} {"p50 ms":>9} {"p95 ms":>9} {"MP/s":>8} {"peak MiB":>9}')
+            for name, stats in result['results'].items():
+                report['results'][f'{label}/{name}'] = stats
+                print(f'  {name:<24} {stats["p50_ms"]:>9.1f} {stats["p95_ms"]:>9.1f} '
+                      f'{stats["mp_per_s"]:>8.1f} {stats["peak_mib"]:>9.1f}')
+
+    output = args.output or f'benchmark-{revision or "local"}.json'
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nsaved to {output}')
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    print(f'base {base["meta"].get("revision")}  head {head["meta"].get("revision")}  '
+          f'threshold {args.threshold:.0%}\n')
+    print(f'{"case":<44} {"base p50":>9} {"head p50":>9} {"change":>8} {"base MiB":>9} {"head MiB":>9}')
+
+    regressions = []
+    for name in sorted(set(base['results']) & set(head['results'])):
+        old, new = base['results'][name], head['results'][name]
+        change = new['p50_ms'] / old['p50_ms'] - 1 if old['p50_ms'] else 0
+        flags = []
+        if change > args.threshold and new['p50_ms'] - old['p50_ms'] > MIN_TIME_DELTA_MS:
+            flags.append('SLOWER')
+        memory_delta = new['peak_mib'] - old['peak_mib']
+        if memory_delta > MIN_MEMORY_DELTA_MIB and memory_delta > abs(old['peak_mib']) * args.threshold:
+            flags.append('MEMORY')
+        if change < -args.threshold and old['p50_ms'] - new['p50_ms'] > MIN_TIME_DELTA_MS:
+            flags.append('faster')
+        print(f'{name:<44} {old["p50_ms"]:>9.1f} {new["p50_ms"]:>9.1f} {change:>+8.1%} '
+              f'{old["peak_mib"]:>9.1f} {new["peak_mib"]:>9.1f}  {" ".join(flags)}')
+        if 'SLOWER' in flags or 'MEMORY' in flags:
+            regressions.append(name)
+
+    missing = set(base['results']) - set(head['results'])
+    if missing:
+        print(f'\n{len(missing)} case(s) only in base')
+    if regressions:
+        print(f'\n{len(regressions)} regression(s)')
+        return 1
+    print('\nno regressions')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the suite and save the results')
+    run_parser.add_argument('--sizes', type=float, nargs='+', default=SIZES, help='megapixels')
+    run_parser.add_argument('--formats', nargs='+', choices=FORMATS, default=FORMATS)
+    run_parser.add_argument('--cases', nargs='+', help='case name prefixes, e.g. process/blur update/')
+    run_parser.add_argument('--repeat', type=int, default=20, help='samples per case at 2 MP and below')
+    run_parser.add_argument('--output', help='JSON file, benchmark-<revision>.json by default')
+
+    compare_parser = subparsers.add_parser('compare', help='flag regressions between two result files')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('head')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='relative change, 0.1 = 10%%')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
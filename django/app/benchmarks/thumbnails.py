@@ -0,0 +1,112 @@
+"""
+Shrink-on-load: thumbnail and crop-resize of a large JPEG, before/after.
+
+before: full-resolution decode, then LANCZOS (thumbnail) or cv2.resize (crop)
+after:  resize_image / CropImageSerializer as shipped (DCT-domain reduced
+        decode, then area filtering for the rest)
+
+Each variant runs in a fresh process so peak RSS is its own.
+
+    python -m benchmarks.thumbnails --megapixels 24
+"""
+import argparse
+import math
+import multiprocessing
+import statistics
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from benchmarks.encoders import photo
+
+
+def legacy_thumbnail(data, size):
+    img = Image.open(BytesIO(data)).convert('RGB')
+    return img.resize(size, Image.LANCZOS)
+
+
+def shipped_thumbnail(data, size):
+    from common.utils.image import resize_image
+
+    f = BytesIO(data)
+    f.name = 'bench.jpg'
+    return resize_image(f, *size)
+
+
+def legacy_crop(data, size):
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return cv2.resize(image, size)
+
+
+def shipped_crop(data, size):
+    from apiv1.serializers.image import CropImageSerializer
+
+    serializer = CropImageSerializer()
+    params = {'width': size[0], 'height': size[1]}
+    with Image.open(BytesIO(data)) as img:
+        flags = serializer.decode_flags(img.size, params)
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    return serializer._process(image, params)
+
+
+VARIANTS = {
+    'thumbnail': (legacy_thumbnail, shipped_thumbnail, (128, 128)),
+    'crop': (legacy_crop, shipped_crop, (800, 600)),
+}
+
+
+def peak_rss_mib():
+    # ru_maxrss 在 execve 后保留父进程的值，这里读取本进程自身的 VmHWM
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def measure(name, which, data, repeat, queue):
+    from benchmarks import setup_django
+    setup_django()
+    legacy, shipped, size = VARIANTS[name]
+    fn = legacy if which == 'before' else shipped
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data, size)
+        samples.append(time.perf_counter() - start)
+    queue.put((statistics.median(samples), peak_rss_mib()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=float, default=24)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    height = int(math.sqrt(args.megapixels * 1e6 * 2 / 3))
+    width = height * 3 // 2
+    _, encoded = cv2.imencode('.jpg', photo(width, height), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    data = encoded.tobytes()
+    print(f'source: {width}x{height} JPEG, {len(data) / 2 ** 20:.1f} MiB')
+
+    ctx = multiprocessing.get_context('spawn')
+    print(f'\n{"variant":<10} {"before (ms)":>12} {"after (ms)":>11} {"speedup":>8} '
+          f'{"before RSS":>11} {"after RSS":>10}')
+    for name in VARIANTS:
+        results = {}
+        for which in ('before', 'after'):
+            queue = ctx.Queue()
+            process = ctx.Process(target=measure, args=(name, which, data, args.repeat, queue))
+            process.start()
+            results[which] = queue.get()
+            process.join()
+        (before, before_rss), (after, after_rss) = results['before'], results['after']
+        print(f'{name:<10} {before * 1000:>12.1f} {after * 1000:>11.1f} {before / after:>7.1f}x '
+              f'{before_rss:>7.0f} MiB {after_rss:>6.0f} MiB')
+
+
+if __name__ == '__main__':
+    main()
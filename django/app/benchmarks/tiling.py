@@ -0,0 +1,60 @@
+"""
+Blur on a large frame: whole-frame vs strip-wise in place.
+
+Each variant runs in a fresh process so peak RSS is its own; the decoded
+frame is generated inside the process and counts towards both.
+
+    python -m benchmarks.tiling --megapixels 48
+"""
+import argparse
+import math
+import multiprocessing
+import time
+
+import numpy as np
+
+from benchmarks.thumbnails import peak_rss_mib
+
+
+def measure(mode, tiled, width, height, queue):
+    from benchmarks import setup_django
+    setup_django()
+
+    from apiv1.serializers.image import BlurImageSerializer
+
+    serializer = BlurImageSerializer(context={'action': 'BLUR'})
+    image = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    base_rss = peak_rss_mib()
+    start = time.perf_counter()
+    result = serializer.process(image, {'mode': mode}, tiled=tiled)
+    elapsed = time.perf_counter() - start
+    checksum = int(result[::97, ::89].sum())
+    queue.put((elapsed, peak_rss_mib() - base_rss, checksum))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=float, default=48)
+    args = parser.parse_args()
+
+    height = int(math.sqrt(args.megapixels * 1e6 * 2 / 3))
+    width = height * 3 // 2
+    print(f'frame: {width}x{height}x3, {width * height * 3 / 2 ** 20:.0f} MiB')
+
+    ctx = multiprocessing.get_context('spawn')
+    print(f'\n{"mode":<9} {"whole (ms)":>11} {"tiled (ms)":>11} {"whole +RSS":>11} {"tiled +RSS":>11} {"equal":>6}')
+    for mode in ('mean', 'median', 'gaussian'):
+        results = {}
+        for tiled in (False, True):
+            queue = ctx.Queue()
+            process = ctx.Process(target=measure, args=(mode, tiled, width, height, queue))
+            process.start()
+            results[tiled] = queue.get()
+            process.join()
+        (whole, whole_rss, whole_sum), (tiled, tiled_rss, tiled_sum) = results[False], results[True]
+        print(f'{mode:<9} {whole * 1000:>11.0f} {tiled * 1000:>11.0f} {whole_rss:>7.0f} MiB {tiled_rss:>7.0f} MiB '
+              f'{str(whole_sum == tiled_sum):>6}')
+
+
+if __name__ == '__main__':
+    main()
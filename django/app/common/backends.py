@@ -1,11 +1,114 @@
+import copy
+import fcntl
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
 from django.conf import settings
 
 
+class UserCache:
+    """
+    Users resolved from access tokens, with their permission sets loaded, kept for TTL seconds.
+
+    The cache is per process. ``invalidate`` (called from the user, group and
+    permission signals once the change is committed) clears it here and
+    increments a counter in a version file, which the other workers read on
+    each lookup and then clear theirs. A user loaded while the version changed
+    is not cached, so a lookup racing an invalidation cannot keep stale data.
+    Callers get a shallow copy, so per-request attributes never leak between requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # user_id -> (过期时间, user)
+        self._users = OrderedDict()
+        self._version = None
+
+    @property
+    def ttl(self) -> float:
+        return settings.AUTH_USER_CACHE['TTL']
+
+    @property
+    def version_file(self) -> Path:
+        return Path(settings.AUTH_USER_CACHE['VERSION_FILE'])
+
+    def version(self) -> int:
+        """Invalidation counter shared by all processes; read it before loading a user to put()."""
+        try:
+            with open(self.version_file, 'rb') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def get(self, user_id, version: int = None):
+        if not self.ttl:
+            return None
+        if version is None:
+            version = self.version()
+        with self._lock:
+            if version != self._version:
+                # 其他进程修改了用户或权限
+                self._users.clear()
+                self._version = version
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+            return copy.copy(entry[1])
+
+    def put(self, user_id, user, version: int):
+        """Cache ``user``, loaded after ``version`` was read; skipped if an invalidation happened since."""
+        if not self.ttl:
+            return
+        current = self.version()
+        with self._lock:
+            if version != current or version != self._version:
+                return
+            self._users[user_id] = (time.monotonic() + self.ttl, copy.copy(user))
+            self._users.move_to_end(user_id)
+            while len(self._users) > settings.AUTH_USER_CACHE['MAX_ENTRIES']:
+                self._users.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._users.clear()
+        try:
+            self.version_file.parent.mkdir(parents=True, exist_ok=True)
+            # 计数器而不是 mtime：mtime 精度有限，同一时刻的两次修改可能无法区分
+            with open(self.version_file, 'a+b') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    version = int(f.read() or 0) + 1
+                except ValueError:
+                    version = 1
+                f.seek(0)
+                f.truncate()
+                f.write(str(version).encode())
+        except OSError:
+            pass
+
+
+user_cache = UserCache()
+
+
 class CustomJWTAuthentication(JWTAuthentication):
     """Custom authentication class"""
 
-    def authenticate(self, request):
+    def get_validated_request_token(self, request):
         header = self.get_header(request)
         if header is None:
             raw_token = request.COOKIES.get(settings.SIMPLE_JWT['AUTH_COOKIE_ACCESS']) or None
@@ -14,5 +117,64 @@ class CustomJWTAuthentication(JWTAuthentication):
         if raw_token is None:
             return
 
-        validated_token = self.get_validated_token(raw_token)
+        return self.get_validated_token(raw_token)
+
+    def authenticate(self, request):
+        validated_token = self.get_validated_request_token(request)
+        if validated_token is None:
+            return
         return self.get_user(validated_token), validated_token
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views: the user is loaded through the async ORM API"""
+        validated_token = self.get_validated_request_token(request)
+        if validated_token is None:
+            return
+        return await self.aget_user(validated_token), validated_token
+
+    @staticmethod
+    def get_user_id(validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+    @staticmethod
+    def check_user(user, validated_token):
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if getattr(api_settings, 'CHECK_REVOKE_TOKEN', False):
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        version = user_cache.version()
+        user = user_cache.get(user_id, version)
+        if user is None:
+            user = super().get_user(validated_token)
+            # 权限集合缓存在用户对象上，DjangoModelPermissions 不再查询
+            user.get_all_permissions()
+            user_cache.put(user_id, user, version)
+        else:
+            self.check_user(user, validated_token)
+        return user
+
+    async def aget_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        version = user_cache.version()
+        user = user_cache.get(user_id, version)
+        if user is not None:
+            self.check_user(user, validated_token)
+            return user
+
+        try:
+            user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found') from e
+
+        self.check_user(user, validated_token)
+        await sync_to_async(user.get_all_permissions)()
+        user_cache.put(user_id, user, version)
+        return user
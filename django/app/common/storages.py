@@ -0,0 +1,160 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+__all__ = [
+    'ContentAddressedStorage',
+]
+
+HASH_LENGTH = 64
+
+
+@deconstructible(path='common.storages.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names files by the sha256 of their content and stores identical bytes once.
+
+    The bytes live in a blob under ``BLOB_DIR/ab/cd/<sha256>``. Every saved name
+    is a hard link to that blob, sharded the same way under the directory the
+    ``upload_to`` function asked for::
+
+        image/image/ab/cd/<sha256>.jpg
+        image/image/ab/cd/<sha256>_Xk3pQ9a.jpg    # the same bytes uploaded again
+
+    Each name belongs to exactly one database reference, so deleting a name
+    never affects another row, and the link count of the inode is the
+    reference count. A blob that is no longer linked from any name is
+    removed on the last delete.
+    """
+
+    def __init__(self, blob_dir=None, **kwargs):
+        super().__init__(**kwargs)
+        self._blob_dir = blob_dir
+
+    @cached_property
+    def blob_dir(self) -> Path:
+        return Path(self._blob_dir or settings.CONTENT_STORAGE['BLOB_DIR'])
+
+    def blob_path(self, content_hash: str) -> Path:
+        return self.blob_dir / content_hash[:2] / content_hash[2:4] / content_hash
+
+    @staticmethod
+    def content_hash_of(name: str):
+        """sha256 encoded in a content-addressed name, None for other names"""
+        stem = Path(name).stem[:HASH_LENGTH]
+        if len(stem) == HASH_LENGTH and all(c in '0123456789abcdef' for c in stem):
+            return stem
+        return None
+
+    @staticmethod
+    def addressed_name(name: str, content_hash: str) -> str:
+        path = Path(name)
+        return str(path.parent / content_hash[:2] / content_hash[2:4] / f'{content_hash}{path.suffix.lower()}')
+
+    def _write_temp(self, content) -> tuple:
+        """Stream content into a temp file next to the blobs, returning (temp path, sha256)"""
+        os.makedirs(self.blob_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, digest.hexdigest()
+
+    def _link(self, source: Path, name: str) -> str:
+        """Hard link source to an available name derived from ``name``"""
+        while True:
+            name = self.get_available_name(name)
+            full_path = Path(self.path(name))
+            os.makedirs(full_path.parent, exist_ok=True)
+            try:
+                os.link(source, full_path)
+            except FileExistsError:
+                # 其他进程同时占用了这个名字
+                continue
+            return name
+
+    def _save(self, name, content):
+        tmp_path, content_hash = self._write_temp(content)
+        blob = self.blob_path(content_hash)
+        name = self.addressed_name(name, content_hash)
+        try:
+            try:
+                name = self._link(blob, name)
+            except FileNotFoundError:
+                # 新内容：临时文件成为 blob（并发写入相同内容时原子替换，内容一致）
+                os.makedirs(blob.parent, exist_ok=True)
+                os.replace(tmp_path, blob)
+                name = self._link(blob, name)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return str(name).replace('\\', '/')
+
+    def link(self, name: str, directory: str = None) -> str:
+        """
+        A new name for the file at ``name``, sharing its bytes.
+
+        Use it instead of pointing two rows at the same name; each row can then
+        delete its own name. ``directory`` defaults to the directory of ``name``.
+        """
+        content_hash = self.content_hash_of(name)
+        if content_hash is None:
+            # 旧的非内容寻址文件：读入并按内容保存
+            target = str(Path(directory or Path(name).parent) / Path(name).name)
+            with self.open(name, 'rb') as f:
+                return self.save(target, f)
+        if directory is None:
+            # <目录>/ab/cd/<hash><后缀>
+            directory = Path(name).parent.parent.parent
+        target = self.addressed_name(str(Path(directory) / Path(name).name), content_hash)
+        return self._link(Path(self.path(name)), target)
+
+    def refcount(self, name: str) -> int:
+        """Number of names sharing the bytes of ``name``, blob excluded"""
+        st = os.stat(self.path(name))
+        content_hash = self.content_hash_of(name)
+        if content_hash is not None:
+            try:
+                if os.stat(self.blob_path(content_hash)).st_ino == st.st_ino:
+                    return st.st_nlink - 1
+            except FileNotFoundError:
+                pass
+        return st.st_nlink
+
+    def delete(self, name):
+        if not name:
+            raise ValueError('The name must be given to delete().')
+        path = self.path(name)
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            return
+        super().delete(name)
+
+        content_hash = self.content_hash_of(name)
+        if content_hash is None:
+            return
+        blob = self.blob_path(content_hash)
+        try:
+            st = os.stat(blob)
+            if st.st_ino == inode and st.st_nlink == 1:
+                # 最后一个引用已删除；若此时有并发保存刚链接到 blob，其名字仍持有同一 inode，数据不丢失
+                os.remove(blob)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,54 @@
+"""
+Bounded thread executor for blocking work called from async views.
+
+OpenCV, Pillow and file I/O release the GIL, so a small thread pool runs
+them in parallel without blocking the event loop. Work beyond the pool size
+waits in a bounded queue; once that is full ``run`` raises ``Overloaded``
+straight away instead of letting latency grow without limit.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = [
+    'BoundedExecutor',
+    'Overloaded',
+]
+
+
+class Overloaded(Exception):
+    pass
+
+
+class BoundedExecutor:
+
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    async def run(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_pending:
+                raise Overloaded(f'{self.name} is overloaded.')
+            self._in_flight += 1
+        future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        # 请求被取消时线程中的任务仍在运行，任务结束才释放名额
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            'name': self.name,
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'in_flight': self._in_flight,
+        }
@@ -0,0 +1,87 @@
+import logging
+import queue
+import threading
+import time
+
+from django.core.files.storage import default_storage
+
+__all__ = [
+    'BackgroundFileDeleter',
+    'file_deleter',
+]
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundFileDeleter:
+    """
+    Deletes storage files on a daemon thread, a batch at a time, retrying failures
+    """
+
+    def __init__(self, storage=None, batch_size=100, max_retries=3, retry_delay=1.0):
+        self._storage = storage
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        # 新文件入队时唤醒等待重试时间的线程
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def storage(self):
+        return self._storage or default_storage
+
+    def delete(self, names):
+        for name in names:
+            if name:
+                self._queue.put((name, 0, 0.0))
+        self._wakeup.set()
+        self._ensure_thread()
+
+    def join(self):
+        """Block until every queued file has been deleted or given up on."""
+        self._queue.join()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='file-deleter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            now = time.monotonic()
+            due = False
+            wake_at = None
+            for name, attempts, not_before in batch:
+                if not_before > now:
+                    # 未到重试时间的放回队列，不阻塞后面的文件
+                    self._queue.put((name, attempts, not_before))
+                    wake_at = not_before if wake_at is None else min(wake_at, not_before)
+                else:
+                    due = True
+                    self._delete(name, attempts)
+                self._queue.task_done()
+            if not due and wake_at is not None:
+                self._wakeup.wait(wake_at - now)
+                self._wakeup.clear()
+
+    def _delete(self, name, attempts):
+        try:
+            self.storage.delete(name)
+        except Exception:
+            if attempts + 1 < self.max_retries:
+                self._queue.put((name, attempts + 1, time.monotonic() + self.retry_delay * 2 ** attempts))
+            else:
+                logger.exception('Failed to delete %s after %d attempts', name, attempts + 1)
+
+
+file_deleter = BackgroundFileDeleter()
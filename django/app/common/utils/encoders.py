@@ -0,0 +1,91 @@
+"""
+Output encoder profiles.
+
+A profile is a dict such as::
+
+    {'format': 'webp', 'quality': 80}
+    {'format': 'jpeg', 'quality': 85, 'progressive': True, 'optimize': True}
+    {'format': 'png', 'compression': 6}
+
+``format`` None keeps the source format, ``quality`` None keeps the caller's
+default (e.g. the quality estimated from a JPEG original).
+"""
+import cv2
+
+__all__ = [
+    'FORMAT_SUFFIXES',
+    'encode_image',
+    'save_pil_image',
+]
+
+FORMAT_SUFFIXES = {
+    'jpeg': '.jpg',
+    'png': '.png',
+    'webp': '.webp',
+}
+
+SUFFIX_FORMATS = {
+    '.jpg': 'jpeg',
+    '.jpeg': 'jpeg',
+    '.png': 'png',
+    '.webp': 'webp',
+}
+
+
+def _output_format(profile: dict, default_format: str) -> str:
+    fmt = (profile.get('format') or default_format).lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in FORMAT_SUFFIXES:
+        raise ValueError(f'Unsupported output format: {fmt}')
+    return fmt
+
+
+def encode_image(image, suffix: str, profile: dict, default_quality: int = None):
+    """
+    Encode an OpenCV image with a profile; returns (bytes, suffix of the output format)
+    """
+    fmt = _output_format(profile, SUFFIX_FORMATS.get(suffix.lower(), 'png'))
+    quality = profile.get('quality') or default_quality
+    params = []
+    if fmt == 'jpeg':
+        if quality is not None:
+            params += [cv2.IMWRITE_JPEG_QUALITY, quality]
+        if profile.get('progressive'):
+            params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+        if profile.get('optimize'):
+            params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    elif fmt == 'png':
+        if profile.get('compression') is not None:
+            params += [cv2.IMWRITE_PNG_COMPRESSION, profile['compression']]
+    elif fmt == 'webp':
+        if quality is not None:
+            params += [cv2.IMWRITE_WEBP_QUALITY, quality]
+
+    suffix = FORMAT_SUFFIXES[fmt]
+    _, encoded = cv2.imencode(suffix, image, params)
+    return encoded.tobytes(), suffix
+
+
+def save_pil_image(img, fp, profile: dict, default_format: str, default_quality: int = None) -> str:
+    """
+    Save a Pillow image with a profile; returns the output format ('jpeg', 'png', 'webp')
+    """
+    fmt = _output_format(profile, default_format)
+    quality = profile.get('quality') or default_quality
+    kwargs = {}
+    if fmt == 'jpeg':
+        if quality is not None:
+            kwargs['quality'] = quality
+        kwargs['progressive'] = bool(profile.get('progressive'))
+        kwargs['optimize'] = bool(profile.get('optimize'))
+    elif fmt == 'png':
+        if profile.get('compression') is not None:
+            kwargs['compress_level'] = profile['compression']
+        kwargs['optimize'] = bool(profile.get('optimize'))
+    elif fmt == 'webp':
+        if quality is not None:
+            kwargs['quality'] = quality
+        kwargs['method'] = profile.get('method', 4)
+    img.save(fp, fmt.upper(), **kwargs)
+    return fmt
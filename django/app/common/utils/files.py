@@ -0,0 +1,43 @@
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+__all__ = [
+    'file_digest',
+    'file_lock',
+]
+
+
+def file_digest(file, algorithm='sha256') -> str:
+    """
+    Hash a django File / file-like object chunk by chunk, leaving its position at 0
+    """
+    digest = hashlib.new(algorithm)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    if hasattr(file, 'chunks'):
+        for chunk in file.chunks():
+            digest.update(chunk)
+    else:
+        for chunk in iter(lambda: file.read(64 * 1024), b''):
+            digest.update(chunk)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return digest.hexdigest()
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive advisory lock shared by every process on this host
+    """
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
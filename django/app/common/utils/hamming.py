@@ -0,0 +1,143 @@
+"""
+Multi-index hashing for 64-bit hashes under Hamming distance.
+
+Each hash is split into four 16-bit blocks. Two hashes within distance ``r``
+agree on at least one block to within ``r // 4`` bits (pigeonhole), so a
+query only probes every block value within that sub-radius and verifies the
+candidates with a popcount. Block values are kept as sorted NumPy arrays,
+about 40 bytes per hash in total, and probed with ``searchsorted``.
+
+Inserts go to a small unsorted buffer that is scanned directly and merged
+into the sorted arrays once it grows; removals are tombstones dropped on the
+next merge.
+"""
+import threading
+from itertools import combinations
+
+import numpy as np
+
+__all__ = [
+    'MAX_DISTANCE',
+    'MultiIndexHashTable',
+    'to_signed',
+    'to_unsigned',
+]
+
+BLOCKS = 4
+BLOCK_BITS = 16
+MAX_SUB_RADIUS = 2
+# 每个块最多允许 MAX_SUB_RADIUS 位不同，总距离上限由此确定
+MAX_DISTANCE = BLOCKS * (MAX_SUB_RADIUS + 1) - 1
+
+# 字节 popcount 查找表
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def to_signed(value: int) -> int:
+    """uint64 -> int64, for storing in a BigIntegerField"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    return _POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _flip_masks(bits: int, radius: int) -> np.ndarray:
+    masks = [0]
+    for r in range(1, radius + 1):
+        for positions in combinations(range(bits), r):
+            masks.append(sum(1 << p for p in positions))
+    return np.array(masks, dtype=np.uint16)
+
+
+_MASKS = {radius: _flip_masks(BLOCK_BITS, radius) for radius in range(MAX_SUB_RADIUS + 1)}
+
+
+class MultiIndexHashTable:
+
+    def __init__(self, merge_threshold: int = 4096):
+        self.merge_threshold = merge_threshold
+        self._lock = threading.RLock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._hashes = np.empty(0, dtype=np.uint64)
+        # 每个块：(排序后的块值, 对应的行号)
+        self._blocks = [(np.empty(0, dtype=np.uint16), np.empty(0, dtype=np.int64)) for _ in range(BLOCKS)]
+        self._pending = {}
+        self._removed = set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids) - len(self._removed & set(self._ids.tolist())) + len(self._pending)
+
+    @staticmethod
+    def _block_values(hashes: np.ndarray, block: int) -> np.ndarray:
+        return ((hashes >> np.uint64(block * BLOCK_BITS)) & np.uint64(0xFFFF)).astype(np.uint16)
+
+    def build(self, ids, hashes):
+        """Replace the contents with (ids, unsigned 64-bit hashes)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        blocks = []
+        for block in range(BLOCKS):
+            values = self._block_values(hashes, block)
+            order = np.argsort(values, kind='stable')
+            blocks.append((values[order], order))
+        with self._lock:
+            self._ids, self._hashes, self._blocks = ids, hashes, blocks
+            self._pending = {}
+            self._removed = set()
+
+    def add(self, id_: int, hash_: int):
+        with self._lock:
+            self._removed.discard(id_)
+            self._pending[id_] = hash_
+            if len(self._pending) >= self.merge_threshold:
+                self._merge()
+
+    def remove(self, id_: int):
+        with self._lock:
+            self._pending.pop(id_, None)
+            self._removed.add(id_)
+
+    def _merge(self):
+        keep = ~np.isin(self._ids, np.fromiter(self._removed | set(self._pending), dtype=np.int64))
+        ids = np.concatenate((self._ids[keep], np.fromiter(self._pending.keys(), dtype=np.int64)))
+        hashes = np.concatenate((self._hashes[keep], np.fromiter(self._pending.values(), dtype=np.uint64)))
+        self.build(ids, hashes)
+
+    def search(self, hash_: int, max_distance: int) -> list:
+        """[(id, distance)] within ``max_distance`` of ``hash_``, nearest first"""
+        if not 0 <= max_distance <= MAX_DISTANCE:
+            raise ValueError(f'max_distance must be between 0 and {MAX_DISTANCE}.')
+        sub_radius = max_distance // BLOCKS
+        query = np.uint64(hash_)
+        with self._lock:
+            ids, hashes, blocks = self._ids, self._hashes, self._blocks
+            pending = dict(self._pending)
+            removed = set(self._removed)
+
+        rows = []
+        for block, (values, order) in enumerate(blocks):
+            probes = self._block_values(np.array([query]), block)[0] ^ _MASKS[sub_radius]
+            left = np.searchsorted(values, probes, side='left')
+            right = np.searchsorted(values, probes, side='right')
+            for start, stop in zip(left[left < right], right[left < right]):
+                rows.append(order[start:stop])
+        candidates = np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+        distances = popcount(hashes[candidates] ^ query)
+        matched = candidates[distances <= max_distance]
+
+        results = {}
+        for row, distance in zip(matched.tolist(), distances[distances <= max_distance].tolist()):
+            id_ = int(ids[row])
+            if id_ not in removed and id_ not in pending:
+                results[id_] = distance
+        for id_, value in pending.items():
+            distance = bin(value ^ hash_).count('1')
+            if distance <= max_distance:
+                results[id_] = distance
+        return sorted(results.items(), key=lambda item: (item[1], item[0]))
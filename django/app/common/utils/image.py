@@ -1,21 +1,135 @@
+import math
 from io import BytesIO
 from pathlib import Path
 
+import cv2
+import numpy as np
 from PIL import Image
 from django.core.files.uploadedfile import InMemoryUploadedFile
 
+from common.utils import metrics
+from common.utils.encoders import FORMAT_SUFFIXES, save_pil_image
+
 __all__ = [
     'resize_image',
+    'build_image_pyramid',
+    'build_upload_images',
+    'reduction_factor',
+    'reduced_decode_flags',
+    'estimate_jpeg_quality',
+    'difference_hash',
+    'array_difference_hash',
+    'resize_array',
+    'REDUCED_COLOR_FLAGS',
 ]
 
 DEFAULT_WIDTH = 200
 DEFAULT_HEIGHT = 200
 
+# Image.resize 的 reducing_gap：缩小倍数超过它时，先用 reduce() 做整数倍的面积平均
+REDUCING_GAP = 3.0
+
+# cv2.imdecode 按 1/2、1/4、1/8 缩小解码（JPEG 在 DCT 域完成，几乎不增加开销）
+REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
 
-def resize_image(image_file, width: int = None, height: int = None, quality=75) -> InMemoryUploadedFile:
+# IJG 标准亮度量化表（quality=50）
+STANDARD_LUMINANCE_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+)
+
+
+def estimate_jpeg_quality(image_file):
     """
-    Process InMemoryUploadedFile
-    return size: 200x200
+    Estimate the IJG quality (1-100) a JPEG was saved with from its luminance
+    quantization table; None for non-JPEG files. Only the header is read.
+    """
+    try:
+        with Image.open(image_file) as img:
+            if img.format != 'JPEG' or not getattr(img, 'quantization', None):
+                return None
+            table = img.quantization[0]
+    except (OSError, ValueError):
+        return None
+    # 编码时 table = (standard * scale + 50) // 100，反推 scale 再换算 quality
+    scale = sum(table) * 100 / sum(STANDARD_LUMINANCE_TABLE)
+    quality = 5000 / scale if scale > 100 else (200 - scale) / 2
+    return max(1, min(100, round(quality)))
+
+
+def _dhash_bits(pixels: bytes) -> int:
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def difference_hash(image_file) -> int:
+    """
+    64-bit perceptual hash (dHash): each bit compares two horizontally
+    adjacent pixels of a 9x8 grayscale thumbnail. Similar images differ in
+    few bits, so the Hamming distance measures similarity.
+    """
+    with Image.open(image_file) as img:
+        # 只需 9x8 像素，JPEG 按 1/8 缩小解码
+        img.draft('L', (9, 8))
+        pixels = img.convert('L').resize((9, 8), Image.LANCZOS, reducing_gap=REDUCING_GAP).tobytes()
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    return _dhash_bits(pixels)
+
+
+def array_difference_hash(image, draft: bool = False) -> int:
+    """
+    difference_hash of an image already decoded by OpenCV (BGR, BGRA or grayscale).
+    With ``draft`` it also reproduces the reduced JPEG decode, so an image
+    about to be saved as JPEG hashes like its file.
+    """
+    if image.ndim == 3:
+        # 与 Pillow 的 convert('L') 使用相同的 ITU-R 601-2 亮度公式
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    if draft:
+        height, width = image.shape
+        factor = reduction_factor((width, height), (9, 8))
+        if factor > 1:
+            size = (-(-width // factor), -(-height // factor))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    img = Image.fromarray(image)
+    return _dhash_bits(img.resize((9, 8), Image.LANCZOS, reducing_gap=REDUCING_GAP).tobytes())
+
+
+def reduction_factor(src_size, dst_size) -> int:
+    """
+    Largest of 1/2/4/8 that can divide src_size (w, h) and still cover dst_size
+    """
+    src_width, src_height = src_size
+    dst_width, dst_height = dst_size
+    factor = 1
+    while factor < 8 and src_width // (factor * 2) >= dst_width and src_height // (factor * 2) >= dst_height:
+        factor *= 2
+    return factor
+
+
+def reduced_decode_flags(src_size, dst_size) -> int:
+    """
+    cv2.imdecode flags that decode at the smallest 1/2, 1/4, 1/8 scale still covering dst_size
+    """
+    return REDUCED_COLOR_FLAGS[reduction_factor(src_size, dst_size)]
+
+
+def _open_image(image_file, draft_size=None):
+    """
+    打开图片并转换为 L/RGB 模式，返回 (img, format, file_name)
+    draft_size 为 (w, h) 时，JPEG 在 DCT 域按 1/2、1/4、1/8 缩小解码，结果不小于 draft_size
     """
     if isinstance(image_file, str):
         image_file = Path(image_file)
@@ -28,6 +142,10 @@ def resize_image(image_file, width: int = None, height: int = None, quality=75)
     assert img.format.upper() in ('PNG', 'JPG', 'JPEG')
     img_format = img.format
 
+    if draft_size is not None:
+        # 须在像素载入之前调用，非 JPEG 时不生效
+        img.draft('RGB', draft_size)
+
     mode = img.mode
     if mode not in ('L', 'RGB'):
         if mode == 'RGBA':
@@ -38,8 +156,49 @@ def resize_image(image_file, width: int = None, height: int = None, quality=75)
             img.paste((255, 255, 255), None, bgmask)
         else:
             img = img.convert('RGB')
+    return img, img_format, image_file_name
+
 
-    img_width, img_height = img.size
+def _image_size(image_file):
+    """(w, h) from the file header, without decoding pixels"""
+    with Image.open(image_file) as img:
+        size = img.size
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    return size
+
+
+def _to_uploaded_file(img: Image.Image, img_format, quality, image_file, image_file_name,
+                      profile: dict = None) -> InMemoryUploadedFile:
+    img_io = BytesIO()
+    if profile is None:
+        img.save(img_io, img_format, quality=quality)
+        try:
+            content_type = image_file.content_type
+        except AttributeError:
+            suffix = Path(image_file_name).suffix.lstrip('.')
+            content_type = f'image/{suffix}'
+    else:
+        # 按输出格式修改文件后缀和 content type
+        fmt = save_pil_image(img, img_io, profile, img_format, quality)
+        image_file_name = Path(image_file_name).with_suffix(FORMAT_SUFFIXES[fmt]).name
+        content_type = f'image/{fmt}'
+
+    return InMemoryUploadedFile(
+        file=img_io,
+        field_name=None,
+        name=image_file_name,
+        content_type=content_type,
+        size=img_io.tell(),
+        charset=None
+    )
+
+
+def _crop_box(img_size, width: int = None, height: int = None):
+    """
+    目标宽高（不放大）以及按目标比例居中裁剪的区域 box：(left, upper, right, lower)
+    """
+    img_width, img_height = img_size
     if any((width, height)):
         # 缺少的宽高参数补全
         if width is None:
@@ -53,6 +212,7 @@ def resize_image(image_file, width: int = None, height: int = None, quality=75)
     if width > img_width or height > img_height:
         # 目标宽/高大于原始图片宽高，无法缩小
         width, height = img_width, img_height
+    width, height = round(width), round(height)
 
     # 调整比例
     img_wh_ratio = img_width / img_height
@@ -64,33 +224,140 @@ def resize_image(image_file, width: int = None, height: int = None, quality=75)
         target_height = img_width / target_wh_ratio  # 目标高度（小于原高）
         delta = (img_height - target_height) / 2
         box = (0, delta, img_width, delta + target_height)
-        region = img.crop(box)
     elif target_wh_ratio < img_wh_ratio:
         target_width = img_height * target_wh_ratio
         delta = (img_width - target_width) / 2
         box = (delta, 0, delta + target_width, img_height)
-        region = img.crop(box)
     else:
         # 比例相同，原图
-        region = img
+        box = (0, 0, img_width, img_height)
+    return width, height, box
 
-    a = region.resize((width, height), Image.LANCZOS)  # anti-aliasing
 
-    img_io = BytesIO()
-    a.save(img_io, img_format, quality=quality)
+def resize_image(image_file, width: int = None, height: int = None, quality=75,
+                 profile: dict = None) -> InMemoryUploadedFile:
+    """
+    Process InMemoryUploadedFile
+    return size: 200x200
+    """
+    img_width, img_height = _image_size(image_file)
+    width, height, box = _crop_box((img_width, img_height), width, height)
 
-    try:
-        content_type = image_file.content_type
-    except AttributeError:
-        suffix = Path(image_file_name).suffix.lstrip('.')
-        content_type = f'image/{suffix}'
+    with metrics.track('RESIZE', (img_width, img_height)):
+        # 缩小解码后，裁剪区域仍需覆盖目标尺寸
+        region_width, region_height = box[2] - box[0], box[3] - box[1]
+        draft_size = (math.ceil(img_width * width / region_width), math.ceil(img_height * height / region_height))
+        with metrics.stage('decode'):
+            img, img_format, image_file_name = _open_image(image_file, draft_size=draft_size)
+            img.load()
+        scale_x, scale_y = img.width / img_width, img.height / img_height
+        box = (box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y)
 
-    img_file = InMemoryUploadedFile(
-        file=img_io,
-        field_name=None,
-        name=image_file_name,
-        content_type=content_type,
-        size=img_io.tell(),
-        charset=None
+        # 先按整数倍做面积平均缩小（reduce），剩余不超过 REDUCING_GAP 倍的缩放再做 LANCZOS 抗锯齿
+        with metrics.stage('process'):
+            a = img.resize((width, height), Image.LANCZOS, box=box, reducing_gap=REDUCING_GAP)
+
+        with metrics.stage('encode'):
+            uploaded_file = _to_uploaded_file(a, img_format, quality, image_file, image_file_name, profile)
+        metrics.count_bytes('written', uploaded_file.size)
+        return uploaded_file
+
+
+def resize_array(image, width: int = None, height: int = None):
+    """
+    resize_image for an image already decoded by OpenCV: the same centre crop
+    and size, downscaled with pixel-area averaging; nothing is decoded or encoded.
+    """
+    img_height, img_width = image.shape[:2]
+    width, height, box = _crop_box((img_width, img_height), width, height)
+    left, upper, right, lower = (round(v) for v in box)
+    return cv2.resize(image[upper:lower, left:right], (width, height), interpolation=cv2.INTER_AREA)
+
+
+def build_image_pyramid(image_file, sizes, quality=75, profile: dict = None) -> dict:
+    """
+    Downscaled copies of an image, keyed by long edge size.
+
+    Levels are built from the largest size down, each one resized from the
+    previous level rather than from the full image. Sizes not smaller than
+    the original are skipped (no upscaling).
+    """
+    img_width, img_height = _image_size(image_file)
+    long_edge = max(img_width, img_height)
+    sizes = sorted((size for size in set(sizes) if size < long_edge), reverse=True)
+    if not sizes:
+        return {}
+
+    def target_size(size):
+        # 按原图比例计算，避免逐级取整误差累积
+        return max(1, round(img_width * size / long_edge)), max(1, round(img_height * size / long_edge))
+
+    # 最大一级需要的分辨率决定缩小解码的倍数
+    img, img_format, image_file_name = _open_image(image_file, draft_size=target_size(sizes[0]))
+
+    pyramid = {}
+    level = img
+    for size in sizes:
+        level = level.resize(target_size(size), Image.LANCZOS, reducing_gap=REDUCING_GAP)
+        pyramid[size] = _to_uploaded_file(level, img_format, quality, image_file, image_file_name, profile)
+    return pyramid
+
+
+def build_upload_images(image_file, sizes, thumbnail_size=(DEFAULT_WIDTH, DEFAULT_HEIGHT), quality=75,
+                        profile: dict = None, thumbnail_profile: dict = None):
+    """
+    build_image_pyramid, the resize_image thumbnail and the difference_hash of
+    an upload from a single decode; returns (pyramid, thumbnail file, hash).
+
+    The thumbnail is cropped from the smallest level that still covers it,
+    and the hash is taken from the smallest level.
+    """
+    img_width, img_height = _image_size(image_file)
+    long_edge = max(img_width, img_height)
+    sizes = sorted((size for size in set(sizes) if size < long_edge), reverse=True)
+
+    def target_size(size):
+        return max(1, round(img_width * size / long_edge)), max(1, round(img_height * size / long_edge))
+
+    thumb_width, thumb_height, box = _crop_box((img_width, img_height), *thumbnail_size)
+    region_width, region_height = box[2] - box[0], box[3] - box[1]
+    # 缩小解码的倍数须同时满足最大一级和缩略图的裁剪区域
+    draft_size = (
+        math.ceil(img_width * thumb_width / region_width), math.ceil(img_height * thumb_height / region_height)
     )
-    return img_file
+    if sizes:
+        draft_size = tuple(max(a, b) for a, b in zip(draft_size, target_size(sizes[0])))
+
+    with metrics.track('RESIZE', (img_width, img_height)):
+        with metrics.stage('decode'):
+            img, img_format, image_file_name = _open_image(image_file, draft_size=draft_size)
+            img.load()
+
+        with metrics.stage('process'):
+            levels = [img]
+            for size in sizes:
+                levels.append(levels[-1].resize(target_size(size), Image.LANCZOS, reducing_gap=REDUCING_GAP))
+            # 裁剪区域在该级中仍不小于缩略图尺寸
+            source = next(
+                level for level in reversed(levels)
+                if level.width * region_width >= thumb_width * img_width
+                and level.height * region_height >= thumb_height * img_height
+            )
+            scale_x, scale_y = source.width / img_width, source.height / img_height
+            thumbnail = source.resize(
+                (thumb_width, thumb_height), Image.LANCZOS, reducing_gap=REDUCING_GAP,
+                box=(box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y),
+            )
+            hash_ = array_difference_hash(np.asarray(levels[-1].convert('L')))
+
+        with metrics.stage('encode'):
+            pyramid = {
+                size: _to_uploaded_file(level, img_format, quality, image_file, image_file_name, profile)
+                for size, level in zip(sizes, levels[1:])
+            }
+            thumbnail_file = _to_uploaded_file(
+                thumbnail, img_format, quality, image_file, image_file_name, thumbnail_profile
+            )
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    return pyramid, thumbnail_file, hash_
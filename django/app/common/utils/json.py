@@ -7,7 +7,11 @@ import numpy
 class NumJsonEncoder(json.JSONEncoder):
 
     def default(self, o: Any) -> Any:
-        if isinstance(o, numpy.uint8):
+        if isinstance(o, numpy.integer):
             return int(o)
+        if isinstance(o, numpy.floating):
+            return float(o)
+        if isinstance(o, numpy.ndarray):
+            return o.tolist()
 
         return super().default(o)
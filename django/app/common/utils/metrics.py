@@ -0,0 +1,128 @@
+"""
+Prometheus metrics for image operations.
+
+An operation (a process action, detection, a resize) is wrapped in
+``track(action, size)``; the stages inside it (read, decode, process,
+encode, store, db) are wrapped in ``stage(name)`` and labelled with the
+action and image size bucket of the innermost operation in the current
+context. Stages outside any operation are not recorded.
+
+With ``PROMETHEUS_MULTIPROC_DIR`` set before the first import of
+prometheus_client, every process (uvicorn workers and the job pools)
+writes its values to files in that directory and ``render`` sums them, so
+any worker can serve the totals. The directory must be emptied when the
+service starts (see entrypoint.sh).
+"""
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+)
+
+__all__ = [
+    'track',
+    'stage',
+    'count_bytes',
+    'size_bucket',
+    'render',
+    'CONTENT_TYPE_LATEST',
+]
+
+# 图片尺寸分档（百万像素）
+SIZE_BUCKETS = (0.5, 2, 8, 24)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+OPERATION_SECONDS = Histogram(
+    'image_operation_seconds', 'Duration of image operations', ['action', 'size'], buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    'image_stage_seconds', 'Duration of the stages of image operations', ['action', 'size', 'stage'],
+    buckets=LATENCY_BUCKETS
+)
+OPERATIONS = Counter('image_operations', 'Image operations by outcome', ['action', 'size', 'outcome'])
+IN_FLIGHT = Gauge(
+    'image_operations_in_flight', 'Image operations in progress', ['action'], multiprocess_mode='livesum'
+)
+BYTES = Counter('image_bytes', 'Bytes read and written by image operations', ['action', 'direction'])
+
+# 当前上下文中最内层操作的 (action, size)
+_current = contextvars.ContextVar('image_operation', default=None)
+
+
+def size_bucket(size) -> str:
+    """Label for an image of ``size`` (w, h), e.g. ``2-8MP``"""
+    width, height = size
+    megapixels = (width or 0) * (height or 0) / 1e6
+    lower = 0
+    for upper in SIZE_BUCKETS:
+        if megapixels < upper:
+            return f'{lower}-{upper}MP'
+        lower = upper
+    return f'{lower}MP+'
+
+
+@contextmanager
+def track(action: str, size):
+    action = action.upper()
+    bucket = size_bucket(size)
+    token = _current.set((action, bucket))
+    in_flight = IN_FLIGHT.labels(action)
+    in_flight.inc()
+    outcome = 'error'
+    start = time.perf_counter()
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        OPERATION_SECONDS.labels(action, bucket).observe(time.perf_counter() - start)
+        OPERATIONS.labels(action, bucket, outcome).inc()
+        in_flight.dec()
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(*current, name).observe(time.perf_counter() - start)
+
+
+def count_bytes(direction: str, amount: int):
+    """Add ``amount`` bytes ``read`` or ``written`` to the current operation"""
+    current = _current.get()
+    if current is not None:
+        BYTES.labels(current[0], direction).inc(amount)
+
+
+def _mark_dead_processes(path):
+    # 进程池的子进程退出时不会清理，抓取时移除已退出进程的 in-flight 值
+    for filename in os.listdir(path):
+        if not filename.startswith('gauge_live'):
+            continue
+        pid = int(filename.rsplit('_', 1)[1].split('.')[0])
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            multiprocess.mark_process_dead(pid, path)
+        except PermissionError:
+            pass
+
+
+def render() -> bytes:
+    """Metrics in the Prometheus text format, summed over all processes in multiprocess mode"""
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not path:
+        return generate_latest(REGISTRY)
+    _mark_dead_processes(path)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=path)
+    return generate_latest(registry)
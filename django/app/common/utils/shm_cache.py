@@ -0,0 +1,222 @@
+"""
+Bounded LRU cache of NumPy arrays kept in shared memory.
+
+Every process on the host that uses the same ``name`` sees the same entries:
+the pixels of each entry are a file in ``/dev/shm/<name>/`` (tmpfs, i.e.
+POSIX shared memory on Linux; a temporary directory elsewhere) and a small
+SQLite index next to them records key -> file, shape, dtype, size, owner
+process and last use. Eviction is by total bytes, least recently used first.
+
+Space is made before an entry is written, and the write goes through
+``write()`` so a full tmpfs fails with ENOSPC instead of SIGBUS. The limit
+is capped at half of the tmpfs size. Entries are removed when the process
+that wrote them exits, or when another process finds their owner gone.
+"""
+import math
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from multiprocessing import util
+
+import numpy as np
+
+__all__ = [
+    'SharedArrayCache',
+]
+
+# 缓存最多占用共享内存文件系统容量的比例，写入后至少保留的空闲空间
+MAX_FS_FRACTION = 0.5
+MIN_FREE_BYTES = 16 * 1024 * 1024
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedArrayCache:
+
+    def __init__(self, name: str, max_bytes: int, base_dir: str = None):
+        self.name = name
+        if base_dir is None:
+            base_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.directory = os.path.join(base_dir, name)
+        self.index_path = os.path.join(self.directory, 'index.sqlite3')
+        self._max_bytes = max_bytes
+        self._local = threading.local()
+        self._finalizer = None
+
+    @property
+    def max_bytes(self) -> int:
+        try:
+            st = os.statvfs(self.directory if os.path.isdir(self.directory) else os.path.dirname(self.directory))
+        except OSError:
+            return self._max_bytes
+        return min(self._max_bytes, int(st.f_blocks * st.f_frsize * MAX_FS_FRACTION))
+
+    def _free_bytes(self) -> int:
+        st = os.statvfs(self.directory)
+        return st.f_bavail * st.f_frsize
+
+    def _path(self, segment: str) -> str:
+        return os.path.join(self.directory, segment)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            conn = sqlite3.connect(self.index_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, segment TEXT NOT NULL, shape TEXT NOT NULL, '
+                'dtype TEXT NOT NULL, nbytes INTEGER NOT NULL, pid INTEGER NOT NULL, '
+                'ready INTEGER NOT NULL DEFAULT 0, last_used REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+            self._local.conn = conn
+        return conn
+
+    def _register_cleanup(self):
+        # 进程退出时删除本进程写入的条目；util.Finalize 在 multiprocessing 子进程中同样执行
+        if self._finalizer is None:
+            self._finalizer = util.Finalize(self, self.release, args=(os.getpid(),), exitpriority=10)
+
+    def get(self, key: str):
+        """Return a private copy of the cached array, or None."""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT segment, shape, dtype FROM entries WHERE key = ? AND ready = 1', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        segment, shape, dtype = row
+        shape = tuple(int(i) for i in shape.split(',') if i)
+        try:
+            array = np.fromfile(self._path(segment), dtype=np.dtype(dtype), count=math.prod(shape)).reshape(shape)
+        except (FileNotFoundError, ValueError):
+            # 已被其他进程淘汰
+            conn.execute('DELETE FROM entries WHERE key = ? AND segment = ?', (key, segment))
+            return None
+        conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        return array
+
+    def put(self, key: str, array: np.ndarray):
+        nbytes = array.nbytes
+        max_bytes = self.max_bytes
+        if not nbytes or nbytes > max_bytes:
+            return
+        conn = self._connect()
+        segment = secrets.token_hex(8)
+        evicted = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT 1 FROM entries WHERE key = ?', (key,)).fetchone():
+                # 其他进程已经放入
+                conn.execute('ROLLBACK')
+                return
+            # 写入进程已退出的条目
+            for (pid,) in conn.execute('SELECT DISTINCT pid FROM entries').fetchall():
+                if not _pid_alive(pid):
+                    evicted += conn.execute('SELECT segment FROM entries WHERE pid = ?', (pid,)).fetchall()
+                    conn.execute('DELETE FROM entries WHERE pid = ?', (pid,))
+            # 先腾出空间再写入，总量不会超过上限
+            total = conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM entries').fetchone()[0]
+            if total + nbytes > max_bytes:
+                rows = conn.execute('SELECT key, segment, nbytes FROM entries ORDER BY last_used').fetchall()
+                for old_key, old_segment, old_nbytes in rows:
+                    conn.execute('DELETE FROM entries WHERE key = ?', (old_key,))
+                    evicted.append((old_segment,))
+                    total -= old_nbytes
+                    if total + nbytes <= max_bytes:
+                        break
+            # 条目在写完之前不可读（ready = 0），但计入总量
+            conn.execute(
+                'INSERT INTO entries (key, segment, shape, dtype, nbytes, pid, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, segment, ','.join(str(i) for i in array.shape), array.dtype.str, nbytes, os.getpid(), time.time())
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            for (old_segment,) in evicted:
+                _remove(self._path(old_segment))
+        self._register_cleanup()
+
+        path = self._path(segment)
+        try:
+            if self._free_bytes() < nbytes + MIN_FREE_BYTES:
+                raise OSError('not enough shared memory')
+            # write() 在空间不足时返回 ENOSPC；写入 mmap 映射的页面则会触发 SIGBUS
+            with open(path, 'xb') as f:
+                f.write(memoryview(np.ascontiguousarray(array)).cast('B'))
+        except OSError:
+            conn.execute('DELETE FROM entries WHERE key = ? AND segment = ?', (key, segment))
+            _remove(path)
+            return
+        updated = conn.execute(
+            'UPDATE entries SET ready = 1 WHERE key = ? AND segment = ?', (key, segment)
+        ).rowcount
+        if not updated:
+            # 写入期间已被淘汰
+            _remove(path)
+
+    def release(self, pid: int = None):
+        """Remove the entries written by process ``pid`` (this process by default)."""
+        if pid is None:
+            pid = os.getpid()
+        if pid != os.getpid() or not os.path.isdir(self.directory):
+            # fork 出的子进程继承了 Finalize，不删除父进程的条目
+            return
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        segments = [row[0] for row in conn.execute('SELECT segment FROM entries WHERE pid = ?', (pid,))]
+        conn.execute('DELETE FROM entries WHERE pid = ?', (pid,))
+        conn.execute('COMMIT')
+        for segment in segments:
+            _remove(self._path(segment))
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        segments = [row[0] for row in conn.execute('SELECT segment FROM entries')]
+        conn.execute('DELETE FROM entries')
+        conn.execute('COMMIT')
+        for segment in segments:
+            _remove(self._path(segment))
+
+    def destroy(self):
+        """Remove every entry and the index, e.g. when a test run or a deployment is torn down."""
+        if not os.path.isdir(self.directory):
+            return
+        self.clear()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        for name in os.listdir(self.directory):
+            _remove(self._path(name))
+        os.rmdir(self.directory)
+
+    def stats(self) -> dict:
+        entries, total = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM entries'
+        ).fetchone()
+        return {'entries': entries, 'bytes': total, 'max_bytes': self.max_bytes}
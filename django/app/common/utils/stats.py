@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+
+__all__ = [
+    'image_statistics',
+]
+
+CHANNELS = ('blue', 'green', 'red')  # OpenCV 的通道顺序
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+LEVELS = np.arange(256, dtype=np.float64)
+
+
+def _channel_statistics(hist: np.ndarray, total: int) -> dict:
+    # 所有统计量都由直方图推出，不再遍历像素
+    mean = float(hist @ LEVELS / total)
+    std = float(np.sqrt(hist @ (LEVELS - mean) ** 2 / total))
+    cumsum = np.cumsum(hist)
+    nonzero = np.flatnonzero(hist)
+    return {
+        'min': int(nonzero[0]),
+        'max': int(nonzero[-1]),
+        'mean': round(mean, 3),
+        'std': round(std, 3),
+        'percentiles': {
+            str(p): int(np.searchsorted(cumsum, total * p / 100)) for p in PERCENTILES
+        },
+        'histogram': hist.astype(np.int64).tolist(),
+    }
+
+
+def _palette(image: np.ndarray, size: int) -> list:
+    # 每通道量化到 4 bit，共 4096 个颜色桶，取像素最多的桶并计算桶内平均色
+    pixels = image.reshape(-1, 3)
+    quantized = (pixels >> 4).astype(np.uint16)
+    index = (quantized[:, 2] << 8) | (quantized[:, 1] << 4) | quantized[:, 0]
+    counts = np.bincount(index, minlength=4096)
+    top = np.argsort(counts)[::-1][:size]
+    top = top[counts[top] > 0]
+    sums = np.stack([np.bincount(index, weights=pixels[:, c], minlength=4096)[top] for c in (2, 1, 0)], axis=1)
+    colors = np.rint(sums / counts[top, None]).astype(int)
+    total = len(pixels)
+    return [
+        {'color': '#{:02x}{:02x}{:02x}'.format(*color), 'ratio': round(float(count) / total, 4)}
+        for color, count in zip(colors, counts[top])
+    ]
+
+
+def image_statistics(image: np.ndarray, palette_size: int = 5) -> dict:
+    """
+    Per-channel histogram / mean / std / percentiles, a dominant-color palette
+    and a sharpness estimate (variance of the Laplacian) of a BGR image
+    """
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    total = image.shape[0] * image.shape[1]
+    channels = {
+        name: _channel_statistics(cv2.calcHist([image], [i], None, [256], [0, 256]).ravel(), total)
+        for i, name in enumerate(CHANNELS)
+    }
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    return {
+        'max': max(c['max'] for c in channels.values()),
+        'min': min(c['min'] for c in channels.values()),
+        'channels': channels,
+        'palette': _palette(image, palette_size),
+        'sharpness': round(sharpness, 3),
+    }
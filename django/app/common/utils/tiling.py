@@ -0,0 +1,54 @@
+"""
+Strip-wise processing of large images.
+
+The image is cut into horizontal strips that each carry ``halo`` extra rows
+above and below. A filter whose kernel radius is not larger than ``halo``
+sees exactly the neighbourhood it would see on the whole frame, so the
+stitched output matches the untiled result. At the true top and bottom edge
+the strip boundary is the image boundary, and OpenCV's border handling
+applies in the same way.
+"""
+import numpy as np
+
+__all__ = [
+    'apply_tiled',
+    'strip_rows',
+]
+
+
+def strip_rows(image: np.ndarray, max_bytes: int, halo: int = 0) -> int:
+    """Rows per strip so that one strip including its halo stays within ``max_bytes``"""
+    row_bytes = image.nbytes // max(image.shape[0], 1) or 1
+    return max(max_bytes // row_bytes - 2 * halo, halo, 1)
+
+
+def apply_tiled(image: np.ndarray, func, halo: int = 0, rows: int = 256, out: np.ndarray = None) -> np.ndarray:
+    """
+    Apply ``func`` (array -> array of the same shape) strip by strip.
+
+    ``out`` may be ``image`` itself: strips are then written back in place and
+    only the original rows still needed as the next strip's upper halo are
+    kept aside, so memory stays at one frame plus one strip.
+    """
+    height = image.shape[0]
+    # 原地写回时，下一条带的上方 halo 只能来自当前条带
+    rows = max(rows, halo, 1)
+    if out is None:
+        out = np.empty_like(image)
+    in_place = out is image
+    carry = None
+
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        top, bottom = max(0, y0 - halo), min(height, y1 + halo)
+        if carry is not None:
+            strip = np.concatenate((carry, image[y0:bottom]))
+        else:
+            strip = image[top:bottom]
+        if in_place and halo:
+            # 写回之前保留原始行，供下一条带使用
+            carry = image[max(0, y1 - halo):y1].copy()
+
+        result = func(strip)
+        out[y0:y1] = result[y0 - top:y1 - top]
+    return out
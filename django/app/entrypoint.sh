@@ -13,4 +13,11 @@ fi
 
 #python manage.py collectstatic --noinput
 
+# 多进程指标文件属于上一次运行，启动前清空
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]
+then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 exec "$@"
@@ -8,9 +8,25 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
 
 import os
+import threading
 
 from django.core.asgi import get_asgi_application
 
+from apiv1.cpu import cpu_budget
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_processor_backend.settings')
 
+# BLAS 线程数须在导入 NumPy 之前设置
+cpu_budget.limit_blas_threads()
+
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.SIMILAR_IMAGES['WARM_UP']:
+    from apiv1.similar import similar_index  # noqa: E402
+    similar_index.warm_up()
+
+# 上次退出时未完成的任务：排队中的重新交给进程池，运行中的超时后标记为失败
+from apiv1.workers import recover_jobs  # noqa: E402
+threading.Thread(target=recover_jobs, name='recover-jobs', daemon=True).start()
@@ -15,6 +15,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 import os
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
@@ -100,10 +101,28 @@ DATABASES = {
     'default': {
         'ATOMIC_REQUESTS': bool(int(os.environ.get('DB_ATOMIC_REQUESTS', default=0))),
         'ENGINE': os.environ.get('DB_ENGINE'),
-        'NAME': BASE_DIR / 'data' / 'db.sqlite3',
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'data' / 'db.sqlite3'),
+        # ASGI 下每个请求可能在不同线程上处理，持久连接按线程保留且不会被请求结束时回收，
+        # Django 建议保持 0（每个请求结束时关闭）；WSGI 部署可通过 DB_CONN_MAX_AGE 开启
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', default=0)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # 多个 worker 共享同一个 SQLite 文件：WAL 模式下读写互不阻塞。
+    # IMMEDIATE 使每个 atomic() 块在开始时就获取写锁（等待至多 timeout 秒），避免读事务升级为写事务时
+    # 直接报 database is locked；代价是只读的 atomic() 块也会与写入串行，因此 atomic() 只用于写入路径。
+    # ATOMIC_REQUESTS 会把每个请求（包括 GET）包在事务中，开启时不使用 IMMEDIATE
+    DATABASES['default']['OPTIONS'] = {
+        'timeout': float(os.environ.get('DB_SQLITE_TIMEOUT', default=20)),
+        'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+    }
+    if not DATABASES['default']['ATOMIC_REQUESTS']:
+        DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+    # 测试数据库使用文件而不是共享内存，并发测试中的锁行为与生产一致
+    DATABASES['default']['TEST'] = {'NAME': str(Path(tempfile.gettempdir(), 'image_processor_test.sqlite3'))}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -173,10 +192,145 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
-MEDIA_ROOT = Path(BASE_DIR, 'media')
+MEDIA_ROOT = Path(os.environ.get('DJANGO_MEDIA_ROOT', Path(BASE_DIR, 'media')))
 MEDIA_URL = '/media/'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'common.storages.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# 内容寻址存储：相同内容只保存一份 blob，各引用为指向它的硬链接，BLOB_DIR 须与 MEDIA_ROOT 在同一文件系统
+CONTENT_STORAGE = {
+    'BLOB_DIR': Path(os.environ.get('CONTENT_STORAGE_BLOB_DIR', MEDIA_ROOT / '.blobs')),
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Image processing
+# 异步处理：?async=1 时 ProcessImageView 返回 202，由本地进程池执行
+
+IMAGE_PROCESS_ASYNC = bool(int(os.environ.get('IMAGE_PROCESS_ASYNC', default=0)))
+
+IMAGE_JOB_WORKERS = int(os.environ.get('IMAGE_JOB_WORKERS', default=2))
+
+# 运行超过该秒数的任务视为执行它的进程已退出，标记为失败
+IMAGE_JOB_TIMEOUT = int(os.environ.get('IMAGE_JOB_TIMEOUT', default=600))
+
+# 批量处理进程池大小（每个 web worker 一个），0 表示 CPU 核数 // WEB_CONCURRENCY
+IMAGE_BATCH_WORKERS = int(os.environ.get('IMAGE_BATCH_WORKERS', default=0))
+
+# 一次批量请求同时交给进程池的图片数（web worker 同时持有这些原图的字节），0 表示进程池大小
+IMAGE_BATCH_MAX_IN_FLIGHT = int(os.environ.get('IMAGE_BATCH_MAX_IN_FLIGHT', default=0))
+
+# pipeline 动作一次请求最多包含的步骤数
+IMAGE_PIPELINE_MAX_STEPS = int(os.environ.get('IMAGE_PIPELINE_MAX_STEPS', default=8))
+
+# 处理结果缓存：相同原图 + 动作 + 参数直接复用已有的 ImageGeneration
+IMAGE_RESULT_CACHE = {
+    'ENABLED': bool(int(os.environ.get('IMAGE_RESULT_CACHE_ENABLED', default=1))),
+    'LOCK_DIR': os.environ.get('IMAGE_LOCK_DIR', Path(tempfile.gettempdir(), 'image_processor_locks')),
+}
+
+# 解码后图像的共享内存缓存（所有 uvicorn worker 共用），按总字节数 LRU 淘汰。
+# 实际上限不超过 /dev/shm 容量的一半（Docker 默认只有 64 MB，见 docker-compose.yml 的 shm_size）；
+# NAMESPACE 为空时按数据库和 MEDIA_ROOT 区分，同一主机上的不同部署互不共享
+DECODED_IMAGE_CACHE = {
+    'ENABLED': bool(int(os.environ.get('DECODED_IMAGE_CACHE_ENABLED', default=1))),
+    'MAX_BYTES': int(os.environ.get('DECODED_IMAGE_CACHE_MAX_BYTES', default=512 * 1024 * 1024)),
+    'NAMESPACE': os.environ.get('DECODED_IMAGE_CACHE_NAMESPACE', ''),
+}
+
+# 上传时生成的衍生图长边尺寸，逐级缩小
+IMAGE_DERIVATIVE_SIZES = [
+    int(size) for size in os.environ.get('IMAGE_DERIVATIVE_SIZES', '128 512 1024 2048').split()
+]
+
+# 预览图长边上限（客户端可传入更小的 max_edge）
+IMAGE_PREVIEW_MAX_EDGE = int(os.environ.get('IMAGE_PREVIEW_MAX_EDGE', default=1024))
+
+# 图片详情中内嵌的最近处理记录条数
+IMAGE_NESTED_GENERATIONS = int(os.environ.get('IMAGE_NESTED_GENERATIONS', default=10))
+
+# 检测统计使用缩小解码的图像，短边不小于该值
+IMAGE_DETECT_MIN_EDGE = int(os.environ.get('IMAGE_DETECT_MIN_EDGE', default=512))
+
+# 输出编码配置：format 为空时沿用原图格式，quality 为空时沿用原图的 JPEG 质量
+IMAGE_ENCODER_PROFILES = {
+    'original': {'format': None, 'quality': None},
+    'jpeg': {'format': 'jpeg', 'quality': 85, 'progressive': True, 'optimize': True},
+    'png': {'format': 'png', 'compression': 6},
+    'webp': {'format': 'webp', 'quality': 80},
+    'thumbnail': {'format': 'webp', 'quality': 75},
+}
+
+# 处理结果默认使用的编码配置，请求中可通过 profile 参数指定
+IMAGE_ENCODER_PROFILE = os.environ.get('IMAGE_ENCODER_PROFILE', 'original')
+
+IMAGE_THUMBNAIL_PROFILE = os.environ.get('IMAGE_THUMBNAIL_PROFILE', 'thumbnail')
+
+IMAGE_DERIVATIVE_PROFILE = os.environ.get('IMAGE_DERIVATIVE_PROFILE', 'webp')
+
+# 单次处理的像素预算：不超过 MAX_PIXELS 时整帧处理；超过时能分块的动作（模糊、逐像素操作）
+# 按条带处理，每条带不超过 TILE_BYTES，直到 MAX_TILED_PIXELS；其余情况拒绝
+IMAGE_PROCESS_BUDGET = {
+    'MAX_PIXELS': int(os.environ.get('IMAGE_MAX_PIXELS', default=40_000_000)),
+    'MAX_TILED_PIXELS': int(os.environ.get('IMAGE_MAX_TILED_PIXELS', default=150_000_000)),
+    'TILE_BYTES': int(os.environ.get('IMAGE_TILE_BYTES', default=16 * 1024 * 1024)),
+}
+
+# OpenCV / BLAS 线程预算：CORES 为 0 时按 CPU 亲和性和 cgroup 配额检测，
+# WORKERS 与 uvicorn 一致读取 WEB_CONCURRENCY。每个 web worker 各有一个任务进程池和批量进程池，
+# THREADS 为 0 时按 核数 // (WORKERS * (1 + IMAGE_JOB_WORKERS)) 分配，批量进程单线程。
+# 像素数不少于 BOOST_MIN_PIXELS 的单个请求，在 1 分钟负载 / 核数低于 IDLE_LOAD 且没有排队或执行中的任务时，
+# 交给 web worker 的单进程 boost 池以 BOOST_THREADS（0 为全部核心）个线程处理，整台主机同时只有一个
+CPU_BUDGET = {
+    'CORES': int(os.environ.get('CPU_BUDGET_CORES', default=0)),
+    'WORKERS': int(os.environ.get('WEB_CONCURRENCY', default=1)),
+    'THREADS': int(os.environ.get('CPU_BUDGET_THREADS', default=0)),
+    'BOOST_THREADS': int(os.environ.get('CPU_BUDGET_BOOST_THREADS', default=0)),
+    'BOOST_MIN_PIXELS': int(os.environ.get('CPU_BUDGET_BOOST_MIN_PIXELS', default=12_000_000)),
+    'IDLE_LOAD': float(os.environ.get('CPU_BUDGET_IDLE_LOAD', default=0.25)),
+    'LOCK_DIR': os.environ.get('IMAGE_LOCK_DIR', Path(tempfile.gettempdir(), 'image_processor_locks')),
+}
+
+# 异步视图（/api/v1/aio/）使用的线程池，每个 web worker 各一组：CPU_THREADS 为 0 时取 核数 // WEB_CONCURRENCY，
+# 所有 worker 同时执行的 OpenCV 调用不超过核数；
+# 每个线程池在执行中的任务之外最多排队 MAX_PENDING 个，超出时返回 503
+ASYNC_EXECUTOR = {
+    'CPU_THREADS': int(os.environ.get('ASYNC_CPU_THREADS', default=0)),
+    'IO_THREADS': int(os.environ.get('ASYNC_IO_THREADS', default=8)),
+    'MAX_PENDING': int(os.environ.get('ASYNC_MAX_PENDING', default=32)),
+}
+
+# 相似图片查询（感知哈希汉明距离）：默认距离与单次返回条数上限；
+# 进程内索引新增条目累计到 MERGE_THRESHOLD 条后合并；WARM_UP 为真时 ASGI 启动即在后台构建索引
+SIMILAR_IMAGES = {
+    'DEFAULT_DISTANCE': int(os.environ.get('SIMILAR_IMAGES_DEFAULT_DISTANCE', default=10)),
+    'MAX_RESULTS': int(os.environ.get('SIMILAR_IMAGES_MAX_RESULTS', default=100)),
+    'MERGE_THRESHOLD': int(os.environ.get('SIMILAR_IMAGES_MERGE_THRESHOLD', default=4096)),
+    'WARM_UP': os.environ.get('SIMILAR_IMAGES_WARM_UP', 'true').lower() in ('1', 'true', 'yes'),
+}
+
+# Prometheus 指标：/metrics 只响应 ALLOWED_IPS 中的地址。
+# 多个 worker 时须设置环境变量 PROMETHEUS_MULTIPROC_DIR（启动时清空），各进程的指标写入该目录并在抓取时汇总
+METRICS = {
+    'ALLOWED_IPS': os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1 ::1').split(),
+}
+
+# JWT 认证用户缓存：每个进程缓存已解析的用户及其权限集合 TTL 秒（0 为关闭），最多 MAX_ENTRIES 个。
+# 用户、组或权限变更提交后清空本进程缓存并递增 VERSION_FILE 中的计数，其他进程在下次查询时发现并清空
+AUTH_USER_CACHE = {
+    'TTL': float(os.environ.get('AUTH_USER_CACHE_TTL', default=30)),
+    'MAX_ENTRIES': int(os.environ.get('AUTH_USER_CACHE_MAX_ENTRIES', default=10000)),
+    'VERSION_FILE': Path(
+        os.environ.get('IMAGE_LOCK_DIR', Path(tempfile.gettempdir(), 'image_processor_locks')), 'auth_users.version'
+    ),
+}
@@ -19,6 +19,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include, register_converter
 
+from apiv1.views.system import MetricsView
+
 
 class CommaSeparatedIntegerListConverter:
     regex = r'\d+(,\d+)*'
@@ -35,6 +37,8 @@ register_converter(CommaSeparatedIntegerListConverter, 'comma_ints')
 urlpatterns = [
     # path('admin/', admin.site.urls),
     path('api/v1/', include(('apiv1.urls', 'apiv1'), namespace='apiv1')),
+    # 只供本机的 Prometheus 抓取，nginx 不转发
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -11,6 +11,11 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from apiv1.cpu import cpu_budget
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_processor_backend.settings')
 
+# BLAS 线程数须在导入 NumPy 之前设置
+cpu_budget.limit_blas_threads()
+
 application = get_wsgi_application()
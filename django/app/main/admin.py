@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from main.models import Image, ImageGeneration
+from main.models import Image, ImageGeneration, ImageJob
 
 
 # Register your models here.
@@ -18,3 +18,11 @@ class ImageGenerationAdmin(admin.ModelAdmin):
     list_filter = ['action']
     list_per_page = 20
     list_display_links = ['id']
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'action', 'image', 'status', 'created_at', 'finished_at']
+    list_filter = ['action', 'status']
+    list_per_page = 20
+    list_display_links = ['id']
@@ -1 +1,2 @@
 from .image import Image, ImageGeneration
+from .job import ImageJob
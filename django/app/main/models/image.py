@@ -5,6 +5,8 @@ from django.contrib.auth import get_user_model
 from django.db import models
 from django.utils import timezone
 
+from common.utils.json import NumJsonEncoder
+
 User = get_user_model()
 
 IMAGE_PATH = Path('image')
@@ -27,26 +29,44 @@ def generation_upload_to(instance, filename):
 class Image(models.Model):
     name = models.CharField(max_length=255)
     user = models.ForeignKey(User, models.SET_NULL, null=True)
-    image = models.ImageField(upload_to=image_upload_to, width_field='width', height_field='height')
-    thumbnail = models.ImageField(upload_to=thumbnail_upload_to)
+    # 内容寻址存储的文件名较长：<目录>/ab/cd/<sha256>[_xxxxxxx]<后缀>
+    image = models.ImageField(upload_to=image_upload_to, width_field='width', height_field='height', max_length=255)
+    thumbnail = models.ImageField(upload_to=thumbnail_upload_to, max_length=255)
+    # {长边尺寸: 存储路径}
+    derivatives = models.JSONField(default=dict, blank=True)
     generated_action = models.CharField(max_length=32, null=True, blank=True)
     generation_num = models.PositiveIntegerField(default=0)
     is_public = models.BooleanField(default=False)
     width = models.IntegerField(blank=True, null=True)
     height = models.IntegerField(blank=True, null=True)
-    detected_info = models.CharField(max_length=65535, default='{}')
+    detected_info = models.JSONField(default=dict, blank=True, encoder=NumJsonEncoder)
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    # 64 位感知哈希（dHash），按有符号整数存储
+    phash = models.BigIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'main_image'
         ordering = ('-id',)
+        indexes = [
+            # 图片列表：Q(user=...) | Q(is_public=True)，按 -id 游标分页
+            models.Index(fields=['user', 'id'], name='main_image_user_id_idx'),
+            models.Index(fields=['is_public', 'id'], name='main_image_public_id_idx'),
+        ]
 
 
 class ImageGeneration(models.Model):
     action = models.CharField(max_length=255)
     original_image = models.ForeignKey(Image, models.CASCADE, related_name='generations')
-    processed_image = models.ImageField(upload_to=generation_upload_to, width_field='width', height_field='height')
+    processed_image = models.ImageField(
+        upload_to=generation_upload_to, width_field='width', height_field='height', max_length=255
+    )
+    params = models.JSONField(default=dict)
+    cache_key = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # 生成时由内存中的结果得到，提升为图片时直接共享
+    thumbnail = models.ImageField(upload_to=thumbnail_upload_to, max_length=255, blank=True)
+    phash = models.BigIntegerField(null=True, blank=True)
     width = models.IntegerField(blank=True, null=True)
     height = models.IntegerField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -54,3 +74,6 @@ class ImageGeneration(models.Model):
     class Meta:
         db_table = 'main_image_generation'
         ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['original_image', 'id'], name='main_image_gen_original_id_idx'),
+        ]
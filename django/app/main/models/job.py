@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.db import models
+
+from main.models.image import Image, ImageGeneration
+
+User = get_user_model()
+
+
+class ImageJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    action = models.CharField(max_length=32)
+    params = models.JSONField(default=dict)
+    image = models.ForeignKey(Image, models.CASCADE, related_name='jobs')
+    user = models.ForeignKey(User, models.SET_NULL, null=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    generation = models.ForeignKey(ImageGeneration, models.SET_NULL, null=True, blank=True, related_name='+')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'main_image_job'
+        ordering = ('-id',)
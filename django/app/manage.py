@@ -15,6 +15,8 @@ def main():
             "available on your PYTHONPATH environment variable? Did you "
             "forget to activate a virtual environment?"
         ) from exc
+    from apiv1.cpu import cpu_budget
+    cpu_budget.limit_blas_threads()
     execute_from_command_line(sys.argv)
 
 